@@ -0,0 +1,98 @@
+"""Admission control for expensive request handlers.
+
+Each pool (ingestion, query) has a global concurrency limit and a per-user
+limit. Requests over a limit wait in a bounded queue for at most the pool's
+timeout. A full queue or an expired wait is rejected right away, with
+``Retry-After``: 429 when the user is over their own limit, 503 when the
+server as a whole is saturated.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from .core import config
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int, max_per_user: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._global = asyncio.Semaphore(self.max_concurrency)
+        # user_id -> [semaphore, requests holding or waiting for it]
+        self._users: dict[str, list] = {}
+        self.running = 0
+        self.waiting = 0
+
+    def _reject(self, status: int, reason: str):
+        metrics.inc("admission_rejected_total", pool=self.name, reason=reason)
+        log.warning("Admission[%s]: rejected (%s), %d running, %d waiting", self.name, reason, self.running, self.waiting)
+        detail = "Too many requests in progress for this user" if status == 429 else "Server is busy, please retry shortly"
+        return HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(config.ADMISSION_RETRY_AFTER)})
+
+    def _publish(self):
+        metrics.gauge("admission_running", self.running, pool=self.name)
+        metrics.gauge("admission_waiting", self.waiting, pool=self.name)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        if self.waiting >= self.max_queue and self.running >= self.max_concurrency:
+            raise self._reject(503, "queue_full")
+        entry = self._users.setdefault(user_id, [asyncio.Semaphore(self.max_per_user), 0])
+        if entry[1] >= 2 * self.max_per_user:
+            # The user already has a full batch running and another one queued
+            raise self._reject(429, "user_queue_full")
+        entry[1] += 1
+        t0 = time.perf_counter()
+        self.waiting += 1
+        self._publish()
+        stage = "user"
+        acquired = []
+        try:
+            deadline = t0 + self.queue_timeout
+            await asyncio.wait_for(entry[0].acquire(), timeout=max(0.0, deadline - time.perf_counter()))
+            acquired.append(entry[0])
+            stage = "global"
+            await asyncio.wait_for(self._global.acquire(), timeout=max(0.0, deadline - time.perf_counter()))
+            acquired.append(self._global)
+        except asyncio.TimeoutError:
+            raise self._reject(429 if stage == "user" else 503, f"{stage}_timeout")
+        finally:
+            self.waiting -= 1
+            if len(acquired) < 2:
+                for sem in acquired:
+                    sem.release()
+                self._leave(user_id, entry)
+            self._publish()
+        metrics.observe("admission_wait_seconds", time.perf_counter() - t0, pool=self.name)
+        self.running += 1
+        self._publish()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._global.release()
+            entry[0].release()
+            self._leave(user_id, entry)
+            self._publish()
+
+    def _leave(self, user_id: str, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0 and self._users.get(user_id) is entry:
+            del self._users[user_id]
+
+
+ingest_admission = AdmissionController(
+    "ingest", config.INGEST_MAX_CONCURRENCY, config.INGEST_MAX_PER_USER,
+    config.INGEST_MAX_QUEUE, config.INGEST_QUEUE_TIMEOUT,
+)
+query_admission = AdmissionController(
+    "query", config.QUERY_MAX_CONCURRENCY, config.QUERY_MAX_PER_USER,
+    config.QUERY_MAX_QUEUE, config.QUERY_QUEUE_TIMEOUT,
+)
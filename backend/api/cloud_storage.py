@@ -0,0 +1,84 @@
+"""Cloudinary REST calls over the shared async HTTP pool.
+
+Only the handful of endpoints the app uses: upload and destroy (signed
+Upload API), resource lookup, bulk delete and ping (Admin API with basic
+auth). Request signing still comes from the Cloudinary SDK, which makes no
+network calls of its own here.
+"""
+import time
+from typing import Iterable, Optional
+import cloudinary
+from cloudinary.utils import sign_request
+from .core import config
+from .http_clients import get_async_client
+
+# Configure Cloudinary (used for request signing and signed download URLs)
+cloudinary.config(
+    cloud_name=config.CLOUDINARY_CLOUD_NAME,
+    api_key=config.CLOUDINARY_API_KEY,
+    api_secret=config.CLOUDINARY_API_SECRET,
+    secure=True
+)
+
+
+class CloudStorageError(Exception):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _url(path: str) -> str:
+    return f"{config.CLOUDINARY_API_BASE.rstrip('/')}/{config.CLOUDINARY_CLOUD_NAME}/{path}"
+
+
+def _auth() -> tuple[str, str]:
+    return (config.CLOUDINARY_API_KEY or "", config.CLOUDINARY_API_SECRET or "")
+
+
+def _check(response) -> dict:
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    if response.status_code >= 400:
+        message = (data.get("error") or {}).get("message") or response.text[:200]
+        raise CloudStorageError(f"Cloudinary {response.status_code}: {message}", response.status_code)
+    return data
+
+
+async def upload_raw(path: str, public_id: str, folder: str | None = None, tags: Iterable[str] = ()) -> dict:
+    params = {"timestamp": int(time.time()), "public_id": public_id, "overwrite": "true"}
+    if folder:
+        params["folder"] = folder
+    tags = [t for t in tags if t]
+    if tags:
+        params["tags"] = ",".join(tags)
+    with open(path, "rb") as f:
+        response = await get_async_client().post(
+            _url("raw/upload"), data=sign_request(params, {}), files={"file": (public_id.rsplit("/", 1)[-1], f)},
+        )
+    return _check(response)
+
+
+async def destroy_raw(public_id: str) -> dict:
+    params = sign_request({"timestamp": int(time.time()), "public_id": public_id}, {})
+    return _check(await get_async_client().post(_url("raw/destroy"), data=params))
+
+
+async def get_resource(public_id: str) -> Optional[dict]:
+    """Admin API resource details, None when it does not exist."""
+    response = await get_async_client().get(_url(f"resources/raw/upload/{public_id}"), auth=_auth())
+    if response.status_code == 404:
+        return None
+    return _check(response)
+
+
+async def delete_resources(public_ids: list[str]) -> dict:
+    response = await get_async_client().request(
+        "DELETE", _url("resources/raw/upload"), params=[("public_ids[]", p) for p in public_ids], auth=_auth(),
+    )
+    return _check(response)
+
+
+async def ping() -> dict:
+    return _check(await get_async_client().get(_url("ping"), auth=_auth()))
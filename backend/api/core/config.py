@@ -4,12 +4,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Optional OpenAI-compatible endpoint (a proxy, or the load-test stub); empty = api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "")
 # Support both MONGODB_URL and MONGODB_URI for flexibility
 MONGODB_URI = os.getenv("MONGODB_URL") or os.getenv("MONGODB_URI", "mongodb://localhost:27017/persona_rag")
 JWT_SECRET = os.getenv("JWT_SECRET_KEY") or os.getenv("JWT_SECRET", "change_this_secret")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+# Root of all per-user vector data (Chroma databases, flat indexes, routers)
+CHROMA_BASE_DIR = os.getenv("CHROMA_BASE_DIR", "/tmp/chroma_db")
 
 # Cloudinary Configuration
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME", "")
@@ -30,4 +34,124 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 # Logo URL for emails (hosted on Cloudinary)
 LOGO_URL = os.getenv("LOGO_URL", "https://res.cloudinary.com/dggwdladu/image/upload/v1759913904/docfusion/docfusion_logo.png")
 
+# Background reclaim worker (asynchronous session deletion)
+RECLAIM_POLL_SECONDS = float(os.getenv("RECLAIM_POLL_SECONDS", "30"))
+RECLAIM_CONCURRENCY = int(os.getenv("RECLAIM_CONCURRENCY", "4"))
+RECLAIM_BATCH_SIZE = int(os.getenv("RECLAIM_BATCH_SIZE", "100"))  # Cloudinary delete_resources accepts up to 100 ids
+RECLAIM_MAX_ATTEMPTS = int(os.getenv("RECLAIM_MAX_ATTEMPTS", "8"))
 
+# Vector store layout: "session" (one Chroma database per session), "user" (one
+# shared collection per user) or "global" (one shared collection for everyone)
+VECTOR_STORE_LAYOUT = os.getenv("VECTOR_STORE_LAYOUT", "session").lower()
+
+# Per-session vector backend: "chroma", "flat" (memory-mapped exact index) or
+# "auto" (flat until a session grows past FLAT_INDEX_MAX_CHUNKS, then Chroma)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+FLAT_INDEX_MAX_CHUNKS = int(os.getenv("FLAT_INDEX_MAX_CHUNKS", "5000"))
+# Storage precision for new flat indexes: "float32", "float16" or "int8"
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16").lower()
+# Total float32 copies kept of float16 indexes to scan them at float32 speed (0 = none)
+FLAT_DECODE_CACHE_MB = int(os.getenv("FLAT_DECODE_CACHE_MB", "0"))
+
+# Two-stage document routing: sessions with more than ROUTER_MIN_DOCUMENTS PDFs
+# search chunks only inside the ROUTER_TOP_DOCUMENTS best-matching documents
+ROUTER_MIN_DOCUMENTS = int(os.getenv("ROUTER_MIN_DOCUMENTS", "8"))
+ROUTER_TOP_DOCUMENTS = int(os.getenv("ROUTER_TOP_DOCUMENTS", "4"))
+
+# Cross-session search: concurrent per-session lookups, each with a timeout;
+# sessions whose best document centroid scores below the cut-off are skipped
+CROSS_SEARCH_WORKERS = int(os.getenv("CROSS_SEARCH_WORKERS", "4"))
+CROSS_SEARCH_TIMEOUT = float(os.getenv("CROSS_SEARCH_TIMEOUT", "5"))
+CROSS_SEARCH_MIN_SCORE = float(os.getenv("CROSS_SEARCH_MIN_SCORE", "0.1"))
+
+# Query router: multi-query expansion ("adaptive", "always" or "never"). In adaptive
+# mode the expansion LLM call only runs when first-pass retrieval looks weak
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "adaptive").lower()
+QUERY_ROUTER_MIN_OVERLAP = float(os.getenv("QUERY_ROUTER_MIN_OVERLAP", "0.25"))
+QUERY_ROUTER_MIN_TOP_SCORE = float(os.getenv("QUERY_ROUTER_MIN_TOP_SCORE", "0.5"))
+QUERY_ROUTER_MIN_MARGIN = float(os.getenv("QUERY_ROUTER_MIN_MARGIN", "0.05"))
+
+# Reciprocal Rank Fusion: constant and per-retriever weights (dense embeddings, BM25)
+RRF_K = int(os.getenv("RRF_K", "60"))
+RRF_DENSE_WEIGHT = float(os.getenv("RRF_DENSE_WEIGHT", "1.0"))
+RRF_SPARSE_WEIGHT = float(os.getenv("RRF_SPARSE_WEIGHT", "1.0"))
+
+# Chunking of uploaded PDFs (characters) and retrieval depth: RETRIEVER_K hits per
+# retriever and query variant, FINAL_K chunks after fusion go into the prompt.
+# Chunking changes only apply to documents indexed afterwards
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "900"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "8"))
+FINAL_K = int(os.getenv("FINAL_K", "6"))
+
+# Admission control: global and per-user concurrency for ingestion (uploads) and
+# query work (chat). Excess requests wait in a bounded queue, then get 429/503
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "2"))
+INGEST_MAX_PER_USER = int(os.getenv("INGEST_MAX_PER_USER", "1"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "8"))
+INGEST_QUEUE_TIMEOUT = float(os.getenv("INGEST_QUEUE_TIMEOUT", "30"))
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "8"))
+QUERY_MAX_PER_USER = int(os.getenv("QUERY_MAX_PER_USER", "2"))
+QUERY_MAX_QUEUE = int(os.getenv("QUERY_MAX_QUEUE", "32"))
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "15"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+# Embedding micro-batching: concurrent encode calls are merged into batches of up
+# to EMBED_BATCH_MAX texts, waiting at most EMBED_BATCH_WAIT_MS for stragglers
+EMBED_MICRO_BATCHING = os.getenv("EMBED_MICRO_BATCHING", "true").lower() in ("1", "true", "yes")
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
+# Embedding backend: "torch" (sentence-transformers), "onnx" or "onnx-int8" (ONNX
+# Runtime, dynamically quantized). The export is made ahead of time into ONNX_CACHE_DIR
+# (python -m api.onnx_embeddings export); without one, or if its cosine agreement with
+# torch falls below ONNX_PARITY_MIN, the server falls back to torch
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "/tmp/onnx_models")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+ONNX_PARITY_MIN = float(os.getenv("ONNX_PARITY_MIN", "0.99"))
+
+# Preload heavy imports and the embedding model in the background once the server
+# is up (health checks are answered meanwhile); off by default
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+# Local disk cache of PDF bytes for /documents/{id}/view (LRU, size-capped)
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "/tmp/pdf_cache")
+PDF_CACHE_MAX_MB = int(os.getenv("PDF_CACHE_MAX_MB", "512"))
+
+# Shared outbound HTTP pools (OpenAI, Cloudinary, PDF downloads)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+CLOUDINARY_API_BASE = os.getenv("CLOUDINARY_API_BASE", "https://api.cloudinary.com/v1_1")
+
+# Compression of JSON listing/history responses (brotli when installed, else gzip)
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# Password hashing: PBKDF2-SHA256 rounds for new hashes, run on a bounded thread pool
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Verified JWTs are cached by token digest (never past their exp); 0 disables
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "1024"))
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))
+
+# Request tracing: sampled, failed and slow requests are written as JSON lines to a rotating file
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces/traces.jsonl")
+TRACE_FILE_MAX_MB = int(os.getenv("TRACE_FILE_MAX_MB", "50"))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "3"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+# Console log level for the api package; below WARNING only sampled requests are printed
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# On-demand request profiling (X-Profile header or users.profile_requests), for users in PROFILE_USERS ("*" = any)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_USERS = os.getenv("PROFILE_USERS", "")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")  # cprofile | sample
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
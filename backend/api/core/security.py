@@ -1,11 +1,30 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import jwt
 from passlib.context import CryptContext
 from ..core import config
+from .. import metrics
 
-# Use PBKDF2-SHA256 to avoid bcrypt's 72-byte limit and backend issues
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Use PBKDF2-SHA256 to avoid bcrypt's 72-byte limit and backend issues. The cost
+# only applies to new hashes; existing ones keep the rounds they were made with
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=config.PASSWORD_HASH_ROUNDS,
+)
+
+# Hashing is deliberately slow CPU work: keep it off the event loop, on a few threads
+_hash_executor = ThreadPoolExecutor(max_workers=max(1, config.PASSWORD_HASH_WORKERS), thread_name_prefix="password-hash")
+
+# Verified tokens: sha256(token) -> (subject, expiry timestamp)
+_token_cache: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+_token_lock = threading.Lock()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -13,6 +32,19 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _run_hashing(op: str, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        metrics.observe("password_hash_seconds", time.perf_counter() - t0, op=op)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing("hash", get_password_hash, password)
+
 def create_access_token(subject: str, expires_delta: Optional[timedelta] = None) -> str:
     if expires_delta is None:
         expires_delta = timedelta(days=7)
@@ -20,11 +52,46 @@ def create_access_token(subject: str, expires_delta: Optional[timedelta] = None)
     to_encode = {"sub": subject, "exp": expire}
     return jwt.encode(to_encode, config.JWT_SECRET, algorithm=config.JWT_ALGORITHM)
 
+def _cached_subject(digest: str, now: float) -> Optional[str]:
+    with _token_lock:
+        entry = _token_cache.get(digest)
+        if entry is None:
+            return None
+        subject, expires_at = entry
+        if expires_at <= now:
+            del _token_cache[digest]
+            return None
+        _token_cache.move_to_end(digest)
+        return subject
+
+def _cache_subject(digest: str, subject: str, exp, now: float) -> None:
+    # Never trust a cached token past its own exp, nor longer than the cache TTL
+    expires_at = now + config.JWT_CACHE_TTL
+    if exp is not None:
+        expires_at = min(expires_at, float(exp))
+    with _token_lock:
+        _token_cache[digest] = (subject, expires_at)
+        _token_cache.move_to_end(digest)
+        while len(_token_cache) > config.JWT_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
 def decode_token(token: str) -> Optional[str]:
+    t0 = time.perf_counter()
+    now = time.time()
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    subject = _cached_subject(digest, now) if config.JWT_CACHE_SIZE > 0 else None
+    if subject is not None:
+        metrics.inc("auth_token_cache_total", result="hit")
+        metrics.observe("auth_seconds", time.perf_counter() - t0, stage="cached")
+        return subject
     try:
         payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
-        return payload.get("sub")
+        subject = payload.get("sub")
     except Exception:
-        return None
-
-
+        subject = None
+        payload = {}
+    if subject and config.JWT_CACHE_SIZE > 0:
+        _cache_subject(digest, subject, payload.get("exp"), now)
+    metrics.inc("auth_token_cache_total", result="miss")
+    metrics.observe("auth_seconds", time.perf_counter() - t0, stage="decode")
+    return subject
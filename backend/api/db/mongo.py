@@ -16,11 +16,12 @@ async def ensure_indexes():
     db = await get_db()
     # Users: unique email
     await db.users.create_index("email", unique=True)
-    # Documents: owner_id for quick lookups
+    # Documents: owner_id for quick lookups, owner_id + session_key for per-session listing
     await db.documents.create_index("owner_id")
+    await db.documents.create_index([("owner_id", 1), ("session_key", 1)])
     # Sessions: owner_id + name
     await db.sessions.create_index([("owner_id", 1), ("name", 1)], unique=True)
-    # Messages: owner_id + session_id ordered by time
-    await db.messages.create_index([("owner_id", 1), ("session_id", 1), ("ts", 1)])
+    # Messages: owner_id + session_key (immutable session id) ordered by time
+    await db.messages.create_index([("owner_id", 1), ("session_key", 1), ("ts", 1)])
 
 
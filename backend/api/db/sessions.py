@@ -0,0 +1,116 @@
+import os
+from pymongo.errors import DuplicateKeyError
+from ..rag import CHROMA_BASE_DIR, get_user_chroma_dir
+
+
+async def resolve_session_key(db, user_id: str, session_name: str | None, create: bool = False) -> str | None:
+    """Map a session display name to its immutable storage key (the session's ObjectId)."""
+    if not session_name:
+        return None
+    session = await db.sessions.find_one({"owner_id": user_id, "name": session_name}, {"_id": 1})
+    if session:
+        return str(session["_id"])
+    if not create:
+        return None
+    try:
+        res = await db.sessions.insert_one({"owner_id": user_id, "name": session_name})
+        return str(res.inserted_id)
+    except DuplicateKeyError:
+        # Created concurrently by another request
+        session = await db.sessions.find_one({"owner_id": user_id, "name": session_name}, {"_id": 1})
+        return str(session["_id"]) if session else None
+
+
+def get_legacy_session_dir(user_id: str, session_name: str) -> str:
+    # Pre-migration layout: vector data keyed by the (mutable) session name
+    return os.path.join(CHROMA_BASE_DIR, f"user_{user_id}", f"session_{session_name}")
+
+
+# Suffix for legacy directories the migration could not move; they are no longer
+# scanned and cleanup_orphaned_chroma.py deletes them
+ORPHANED_SUFFIX = ".orphaned"
+
+
+def _legacy_session_dirs():
+    """(owner_id, session name) for every ``session_<name>`` directory still on disk."""
+    if not os.path.isdir(CHROMA_BASE_DIR):
+        return
+    for user_dir in os.listdir(CHROMA_BASE_DIR):
+        user_path = os.path.join(CHROMA_BASE_DIR, user_dir)
+        if not user_dir.startswith("user_") or not os.path.isdir(user_path):
+            continue
+        for session_dir in os.listdir(user_path):
+            if session_dir.startswith("session_") and not session_dir.endswith(ORPHANED_SUFFIX):
+                yield user_dir[len("user_"):], session_dir[len("session_"):]
+
+
+def _set_aside(legacy_dir: str, reason: str) -> None:
+    orphaned, n = legacy_dir + ORPHANED_SUFFIX, 1
+    while os.path.exists(orphaned):
+        orphaned, n = f"{legacy_dir}.{n}{ORPHANED_SUFFIX}", n + 1
+    os.rename(legacy_dir, orphaned)
+    print(f"Session migration: {reason}, moved '{legacy_dir}' -> '{orphaned}' for cleanup")
+
+
+async def _needs_migration(db) -> bool:
+    if await db.messages.find_one({"session_key": {"$exists": False}}, {"_id": 1}):
+        return True
+    if await db.documents.find_one({"session_key": {"$exists": False}}, {"_id": 1}):
+        return True
+    return next(_legacy_session_dirs(), None) is not None
+
+
+async def migrate_legacy_sessions(db) -> int:
+    """One-time, idempotent migration from name-keyed to id-keyed session storage.
+
+    Backfills ``session_key`` on messages and documents, creates session rows for
+    names that only exist on messages/documents, and moves ``session_<name>``
+    vector directories to their ``sid_<key>`` location. A directory whose name has
+    no session row, or whose ``sid_<key>`` location is already taken, is renamed
+    to ``session_<name>.orphaned`` instead, so later boots skip it. Returns the
+    number of sessions migrated.
+    """
+    if not await _needs_migration(db):
+        return 0
+
+    # Rows without a session name have no key to resolve; give them the key new
+    # unnamed rows get (chat: None, upload: "") so later boots skip them
+    unnamed = {"session_key": {"$exists": False}, "session_id": {"$in": [None, ""]}}
+    await db.messages.update_many(unnamed, {"$set": {"session_key": None}})
+    await db.documents.update_many(unnamed, {"$set": {"session_key": ""}})
+
+    # Names referenced by rows that have not been migrated yet
+    referenced: set[tuple[str, str]] = set()
+    for coll in (db.messages, db.documents):
+        async for row in coll.find({"session_key": {"$exists": False}}, {"owner_id": 1, "session_id": 1}):
+            if row.get("session_id"):
+                referenced.add((row.get("owner_id"), row["session_id"]))
+
+    # Names that still have a legacy vector directory on disk
+    on_disk = set(_legacy_session_dirs())
+
+    migrated = 0
+    for owner_id, name in referenced | on_disk:
+        # A directory alone does not bring back a session the user has deleted
+        key = await resolve_session_key(db, owner_id, name, create=(owner_id, name) in referenced)
+        legacy_dir = get_legacy_session_dir(owner_id, name)
+        if not key:
+            if os.path.isdir(legacy_dir):
+                _set_aside(legacy_dir, f"no session '{name}' for user {owner_id}")
+            continue
+        query = {"owner_id": owner_id, "session_id": name, "session_key": {"$exists": False}}
+        update = {"$set": {"session_key": key}, "$unset": {"original_session_id": ""}}
+        await db.messages.update_many(query, update)
+        await db.documents.update_many(query, update)
+
+        new_dir = get_user_chroma_dir(owner_id, key)
+        if os.path.isdir(legacy_dir):
+            if os.path.exists(new_dir):
+                _set_aside(legacy_dir, f"'{new_dir}' already exists")
+            else:
+                os.rename(legacy_dir, new_dir)
+                print(f"Session migration: moved '{legacy_dir}' -> '{new_dir}'")
+        migrated += 1
+
+    print(f"Session migration: migrated {migrated} sessions to immutable storage keys")
+    return migrated
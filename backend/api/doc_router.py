@@ -0,0 +1,91 @@
+"""Document-level routing index for sessions with many PDFs.
+
+At ingest time each document's chunk embeddings are reduced to a normalized
+centroid and stored in a small per-session sidecar (``doc_router.json``).
+At query time the query is scored against the centroids and chunk search is
+restricted to the best few documents, so per-query cost follows the number of
+relevant documents instead of the total number of chunks.
+"""
+import json
+import os
+import threading
+from typing import List, Tuple
+import numpy as np
+
+ROUTER_FILE = "doc_router.json"
+
+_cache: dict[str, tuple[float, dict]] = {}
+_lock = threading.Lock()
+
+
+def _path(session_dir: str) -> str:
+    return os.path.join(session_dir, ROUTER_FILE)
+
+
+def load_router(session_dir: str) -> dict:
+    """Return ``{"documents": {document_id: {...}}, "ids": [...], "centroids": ndarray}``."""
+    path = _path(session_dir)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {"documents": {}, "ids": [], "centroids": None}
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, encoding="utf-8") as f:
+        documents = json.load(f).get("documents", {})
+    ids = list(documents)
+    centroids = np.asarray([documents[d]["centroid"] for d in ids], dtype=np.float32) if ids else None
+    router = {"documents": documents, "ids": ids, "centroids": centroids}
+    with _lock:
+        _cache[path] = (mtime, router)
+    return router
+
+
+def add_document(session_dir: str, document_id: str, vectors, filename: str | None = None) -> None:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroid = vectors.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    if norm > 0:
+        centroid /= norm
+    with _lock:
+        path = _path(session_dir)
+        documents = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                documents = json.load(f).get("documents", {})
+        documents[document_id] = {
+            "centroid": [round(float(x), 6) for x in centroid],
+            "chunks": int(len(vectors)),
+            "filename": filename or "",
+        }
+        os.makedirs(session_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"documents": documents}, f)
+        os.replace(tmp, path)
+        _cache.pop(path, None)
+
+
+def routed_chunk_count(router: dict) -> int:
+    return sum(d.get("chunks", 0) for d in router["documents"].values())
+
+
+def route(router: dict, query_vector, top_n: int) -> List[Tuple[str, float]]:
+    """Best ``top_n`` documents for the query as ``(document_id, cosine)``."""
+    if router["centroids"] is None:
+        return []
+    q = np.array(query_vector, dtype=np.float32)
+    q /= (np.linalg.norm(q) or 1.0)
+    scores = router["centroids"] @ q
+    top_n = min(top_n, len(scores))
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.argsort(-scores[top])]
+    return [(router["ids"][i], float(scores[i])) for i in top]
+
+
+def best_score(router: dict, query_vector) -> float | None:
+    """Best document-centroid cosine for the query, None if nothing is routed."""
+    top = route(router, query_vector, 1)
+    return top[0][1] if top else None
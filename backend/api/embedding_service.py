@@ -0,0 +1,125 @@
+"""In-process micro-batching scheduler for the embedding model.
+
+Every caller (chat queries, cross-session search, PDF ingestion) submits
+texts to one queue. A single worker thread drains it into batches bounded by
+``EMBED_BATCH_MAX`` texts and ``EMBED_BATCH_WAIT_MS`` of waiting, runs one
+forward pass per batch and hands each caller its slice of the result.
+Interactive queries are served before bulk ingestion, and large ingestion
+requests are split so queries can slip in between their pieces.
+"""
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+from langchain_core.embeddings import Embeddings
+from . import metrics
+
+PRIORITY_QUERY = 0
+PRIORITY_BULK = 1
+_PRIORITY_NAMES = {PRIORITY_QUERY: "query", PRIORITY_BULK: "bulk"}
+
+
+class EmbeddingScheduler:
+    def __init__(self, model: Embeddings, max_batch: int = 64, max_wait: float = 0.005):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue: "queue.PriorityQueue[tuple]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts: List[str], priority: int = PRIORITY_BULK) -> List[Future]:
+        """Queue texts in pieces of at most one batch; one future per piece."""
+        self._ensure_started()
+        futures = []
+        now = time.perf_counter()
+        for start in range(0, len(texts), self.max_batch):
+            future: Future = Future()
+            self._queue.put((priority, next(self._seq), texts[start:start + self.max_batch], future, now))
+            futures.append(future)
+        return futures
+
+    def encode(self, texts: List[str], priority: int = PRIORITY_BULK) -> List[List[float]]:
+        out: List[List[float]] = []
+        for future in self.submit(texts, priority):
+            out.extend(future.result())
+        return out
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        size = len(batch[0][2])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if size + len(item[2]) > self.max_batch:
+                # Does not fit: put it back for the next batch
+                self._queue.put(item)
+                break
+            batch.append(item)
+            size += len(item[2])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            texts = [t for item in batch for t in item[2]]
+            for priority, _, _, _, queued_at in batch:
+                metrics.observe("embedding_queue_seconds", started - queued_at, priority=_PRIORITY_NAMES[priority])
+            try:
+                vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                for item in batch:
+                    item[3].set_exception(e)
+                continue
+            metrics.inc("embedding_batches_total")
+            metrics.observe("embedding_batch_size", len(texts))
+            metrics.observe("embedding_batch_seconds", time.perf_counter() - started)
+            offset = 0
+            for item in batch:
+                n = len(item[2])
+                item[3].set_result(vectors[offset:offset + n])
+                offset += n
+
+
+class BatchedEmbeddings(Embeddings):
+    """LangChain embeddings whose calls go through the shared scheduler."""
+
+    def __init__(self, scheduler: EmbeddingScheduler):
+        self.scheduler = scheduler
+
+    @property
+    def model(self) -> Embeddings:
+        return self.scheduler.model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.scheduler.encode(list(texts), PRIORITY_BULK)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.encode([text], PRIORITY_QUERY)[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # Several interactive queries at once (multi-query expansion)
+        return self.scheduler.encode(list(texts), PRIORITY_QUERY) if texts else []
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    if isinstance(embeddings, BatchedEmbeddings):
+        return embeddings.embed_queries(texts)
+    return embeddings.embed_documents(texts)
@@ -0,0 +1,464 @@
+"""Memory-mapped flat vector index for small and medium sessions.
+
+Normalized embeddings are stored as one append-only matrix (``vectors.bin``)
+with a JSONL sidecar of ids, texts and metadata (``meta.jsonl``).
+``index.json`` holds the committed row count, so a crash mid-append never
+exposes a partial row. Search is an exact, vectorized matrix-vector product;
+there is no database to open and no cold start.
+
+The matrix is float16 by default. float32 keeps full precision. int8 stores
+per-vector scaled codes (``scales.bin`` holds the scales): candidates are
+found with a quantized query, then re-scored against the float query.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from .core import config
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; elsewhere appends are serialized within the process only
+    fcntl = None
+
+HEADER_FILE = "index.json"
+VECTORS_FILE = "vectors.bin"
+META_FILE = "meta.jsonl"
+SCALES_FILE = "scales.bin"
+LOCK_FILE = "index.lock"
+DTYPES = ("float32", "float16", "int8")
+# int8 search re-scores this many candidates per requested result
+RESCORE_OVERSAMPLE = 4
+# Loaded indexes kept in memory; the matrices themselves are memory-mapped
+CACHE_SIZE = 32
+SEARCH_BLOCK_ROWS = 8192
+
+_cache: "OrderedDict[str, FlatIndex]" = OrderedDict()
+# Every index still referenced by a store, evicted from the LRU or not, so a
+# directory never has two in-memory views appending over each other
+_live: "weakref.WeakValueDictionary[str, FlatIndex]" = weakref.WeakValueDictionary()
+_cache_lock = threading.Lock()
+# Optional float32 copies of float16 matrices (numpy has no fast float16 kernels, so
+# upcasting on every search costs ~10x a float32 scan). Least recently searched
+# copies are dropped to keep the total under FLAT_DECODE_CACHE_MB; 0 disables them
+_decoded: "OrderedDict[FlatIndex, int]" = OrderedDict()
+_decoded_bytes = 0
+_decode_lock = threading.Lock()
+
+
+def flat_index_exists(index_dir: str) -> bool:
+    return os.path.isfile(os.path.join(index_dir, HEADER_FILE))
+
+
+def metadata_matches(meta: dict, where: dict | None) -> bool:
+    """Evaluate a Chroma-style ``where`` filter against one metadata dict."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(metadata_matches(meta, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = meta.get(key)
+            for op, arg in cond.items():
+                if op == "$eq" and value != arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization; returns (codes, scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class FlatIndex:
+    """On-disk state of one session's flat index, shared by all store views."""
+
+    def __init__(self, index_dir: str, dtype: str = "float16"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported flat index dtype '{dtype}', expected one of {DTYPES}")
+        self.index_dir = index_dir
+        self.lock = threading.RLock()
+        # Only applies to a new index; an existing one keeps the dtype it was written with
+        self.dtype = dtype
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.dim = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.meta_bytes = 0
+        # document_id -> rows, so document-scoped queries skip the metadata scan
+        self.by_document: dict[str, List[int]] = {}
+        # chunk id -> row, so fused results are materialized without a scan
+        self.row_of: dict[str, int] = {}
+        self.matrix: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.decoded: Optional[np.ndarray] = None
+        # Identity of the header file this state was loaded from (see refresh)
+        self.header_stamp = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _stamp(self):
+        try:
+            st = os.stat(self._path(HEADER_FILE))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _read_header(self) -> dict | None:
+        try:
+            with open(self._path(HEADER_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes appends across processes (uvicorn workers) sharing the directory
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._path(LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        """Reload when the header changed on disk, e.g. after another process appended."""
+        if self._stamp() != self.header_stamp:
+            self._load()
+
+    def _load(self):
+        stamp = self._stamp()
+        header = self._read_header()
+        self._reset()
+        if header is None:
+            return
+        self.header_stamp = stamp
+        count = header["count"]
+        self.dim = header["dim"]
+        self.dtype = header.get("dtype", "float16")
+        self.meta_bytes = header["meta_bytes"]
+        with open(self._path(META_FILE), encoding="utf-8") as f:
+            for line in f:
+                if len(self.ids) >= count:
+                    break
+                row = json.loads(line)
+                self.ids.append(row["id"])
+                self.texts.append(row["text"])
+                self.metadatas.append(row.get("metadata") or {})
+        self._index_rows(0)
+        self._map(count)
+
+    def _index_rows(self, start: int):
+        for row in range(start, len(self.metadatas)):
+            self.row_of[self.ids[row]] = row
+            document_id = self.metadatas[row].get("document_id")
+            if document_id is not None:
+                self.by_document.setdefault(document_id, []).append(row)
+
+    def _map(self, count: int):
+        _release_decoded(self)
+        if count == 0:
+            self.matrix = None
+            self.scales = None
+            return
+        self.matrix = np.memmap(self._path(VECTORS_FILE), dtype=self.dtype, mode="r", shape=(count, self.dim))
+        if self.dtype == "int8":
+            self.scales = np.memmap(self._path(SCALES_FILE), dtype=np.float32, mode="r", shape=(count,))
+
+    def nbytes(self) -> int:
+        """Bytes taken by the stored vectors (what gets paged into RAM on search)."""
+        total = 0 if self.matrix is None else self.matrix.nbytes
+        return total + (0 if self.scales is None else self.scales.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, vectors: np.ndarray, texts: List[str], metadatas: List[dict], ids: List[str] | None = None) -> List[str]:
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        with self.lock, self._file_lock():
+            # Truncation below trusts count and meta_bytes, so they must be the committed ones
+            header = self._read_header()
+            if header is None or header["count"] != len(self.ids) or header["meta_bytes"] != self.meta_bytes:
+                self._load()
+            if self.dim and vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+            count = len(self.ids)
+            row_bytes = vectors.shape[1] * np.dtype(self.dtype).itemsize
+            if self.dtype == "int8":
+                codes, scales = quantize_int8(vectors)
+            else:
+                codes, scales = vectors.astype(self.dtype), None
+            # Drop anything past the committed count left behind by an interrupted append
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.truncate(count * row_bytes)
+                f.write(codes.tobytes())
+            if scales is not None:
+                with open(self._path(SCALES_FILE), "ab") as f:
+                    f.truncate(count * 4)
+                    f.write(scales.tobytes())
+            lines = "".join(
+                json.dumps({"id": i, "text": t, "metadata": m}, ensure_ascii=False) + "\n"
+                for i, t, m in zip(ids, texts, metadatas)
+            ).encode("utf-8")
+            with open(self._path(META_FILE), "ab") as f:
+                f.truncate(self.meta_bytes)
+                f.write(lines)
+            self.dim = vectors.shape[1]
+            self.meta_bytes += len(lines)
+            header_tmp = self._path(HEADER_FILE + ".tmp")
+            with open(header_tmp, "w") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype, "count": count + len(ids), "meta_bytes": self.meta_bytes}, f)
+            os.replace(header_tmp, self._path(HEADER_FILE))
+            self.header_stamp = self._stamp()
+            self.ids.extend(ids)
+            self.texts.extend(texts)
+            self.metadatas.extend(metadatas)
+            self._index_rows(count)
+            self._map(len(self.ids))
+        return ids
+
+    def select(self, where: dict | None) -> np.ndarray:
+        if not where:
+            return np.arange(len(self.ids))
+        if list(where) == ["document_id"]:
+            cond = where["document_id"]
+            if isinstance(cond, str):
+                return np.asarray(self.by_document.get(cond, []), dtype=np.int64)
+            if isinstance(cond, dict) and list(cond) == ["$in"]:
+                rows = [r for d in cond["$in"] for r in self.by_document.get(d, [])]
+                return np.asarray(sorted(rows), dtype=np.int64)
+        return np.fromiter((i for i, m in enumerate(self.metadatas) if metadata_matches(m, where)), dtype=np.int64)
+
+    def vectors(self, rows: np.ndarray | None = None) -> np.ndarray:
+        if self.matrix is None:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        block = np.asarray(self.matrix if rows is None else self.matrix[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= np.asarray(self.scales if rows is None else self.scales[rows])[:, None]
+        return block
+
+    def _search_matrix(self) -> np.ndarray:
+        if self.dtype == "float16":
+            _decode(self)
+        decoded = self.decoded
+        return self.matrix if decoded is None else decoded
+
+    def _scan(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # Upcast block by block: float32 BLAS, bounded temporary memory
+        matrix = self._search_matrix()
+        full = len(rows) == len(self.ids)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, len(rows))
+            block = matrix[start:end] if full else matrix[rows[start:end]]
+            scores[start:end] = np.asarray(block, dtype=np.float32) @ q
+        return scores
+
+    def search(self, query: np.ndarray, k: int, where: dict | None = None) -> List[Tuple[int, float]]:
+        with self.lock:
+            self.refresh()
+            if self.matrix is None:
+                return []
+            rows = self.select(where)
+            if len(rows) == 0:
+                return []
+            q = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+            if self.dtype != "int8":
+                scores = self._scan(rows, q)
+            else:
+                # Coarse pass: integer codes against an int8-quantized query
+                q_codes, q_scale = quantize_int8(q.reshape(1, -1))
+                scales = np.asarray(self.scales[rows])
+                coarse = self._scan(rows, q_codes[0].astype(np.float32)) * scales * q_scale[0]
+                # Re-score the best candidates against the float query
+                n = min(len(rows), k * RESCORE_OVERSAMPLE)
+                candidates = np.argpartition(-coarse, n - 1)[:n]
+                rows = rows[candidates]
+                scores = (np.asarray(self.matrix[rows], dtype=np.float32) @ q) * scales[candidates]
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+def _decode(index: FlatIndex) -> None:
+    """Give a float16 index a float32 copy within the global budget, or mark it recently used."""
+    global _decoded_bytes
+    budget = config.FLAT_DECODE_CACHE_MB * 2**20
+    size = index.matrix.size * 4
+    with _decode_lock:
+        if index in _decoded:
+            _decoded.move_to_end(index)
+            return
+        if size > budget:
+            return
+        # Make room first, so the total never exceeds the budget
+        while _decoded and _decoded_bytes + size > budget:
+            victim, nbytes = _decoded.popitem(last=False)
+            victim.decoded = None
+            _decoded_bytes -= nbytes
+        index.decoded = np.asarray(index.matrix, dtype=np.float32)
+        _decoded[index] = size
+        _decoded_bytes += size
+
+
+def _release_decoded(index: FlatIndex) -> None:
+    global _decoded_bytes
+    with _decode_lock:
+        index.decoded = None
+        _decoded_bytes -= _decoded.pop(index, 0)
+
+
+def open_flat_index(index_dir: str, dtype: str = "float16") -> FlatIndex:
+    with _cache_lock:
+        index = _cache.get(index_dir)
+        if index is not None:
+            _cache.move_to_end(index_dir)
+            return index
+        index = _live.get(index_dir)
+        if index is None:
+            index = FlatIndex(index_dir, dtype)
+            _live[index_dir] = index
+        _cache[index_dir] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return index
+
+
+def drop_flat_index(index_dir: str) -> None:
+    with _cache_lock:
+        _cache.pop(index_dir, None)
+        index = _live.pop(index_dir, None)
+    if index is not None:
+        _release_decoded(index)
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def forget_flat_indexes(prefix: str) -> None:
+    # Evict cached indexes whose directories are about to be removed
+    with _cache_lock:
+        forgotten = [_live.pop(d) for d in [d for d in _live if d.startswith(prefix)]]
+        for index in forgotten:
+            _cache.pop(index.index_dir, None)
+    for index in forgotten:
+        _release_decoded(index)
+
+
+class FlatRetriever(BaseRetriever):
+    store: Any
+    k: int = 4
+    where: Optional[dict] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.store.similarity_search(query, k=self.k, where=self.where)
+
+
+class FlatSessionStore:
+    backend = "flat"
+
+    def __init__(self, index_dir: str, embeddings, user_id: str, session_id: str, dtype: str = "float16"):
+        self.index_dir = index_dir
+        self.embeddings = embeddings
+        self.user_id = user_id
+        self.session_id = session_id
+        self.dtype = dtype
+        self.index = open_flat_index(index_dir, dtype)
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self.index.ids[row], page_content=self.index.texts[row], metadata=dict(self.index.metadatas[row]))
+
+    def count(self, where: dict | None = None) -> int:
+        with self.index.lock:
+            self.index.refresh()
+            return len(self.index.select(where)) if where else len(self.index)
+
+    def add_documents(self, docs: List[Document], vectors=None) -> List[str]:
+        texts = [d.page_content for d in docs]
+        metadatas = []
+        for d in docs:
+            m = dict(d.metadata or {})
+            m["user_id"] = self.user_id
+            m["session_id"] = self.session_id
+            metadatas.append(m)
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(texts)
+        return self.index.append(np.asarray(vectors, dtype=np.float32), texts, metadatas)
+
+    def get(self, where: dict | None = None, include: list[str] | None = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        with self.index.lock:
+            self.index.refresh()
+            rows = self.index.select(where)
+            out = {"ids": [self.index.ids[i] for i in rows]}
+            if "documents" in include:
+                out["documents"] = [self.index.texts[i] for i in rows]
+            if "metadatas" in include:
+                out["metadatas"] = [self.index.metadatas[i] for i in rows]
+            if "embeddings" in include:
+                out["embeddings"] = self.index.vectors(rows)
+        return out
+
+    def similarity_search_with_score(self, query: str, k: int = 4, where: dict | None = None) -> List[Tuple[Document, float]]:
+        if not len(self.index):
+            return []
+        query_vector = self.embeddings.embed_query(query)
+        return [(self._document(row), score) for row, score in self.index.search(query_vector, k, where)]
+
+    def similarity_search_by_vector_with_score(self, vector, k: int = 4, where: dict | None = None) -> List[Tuple[Document, float]]:
+        return [(self._document(row), score) for row, score in self.index.search(vector, k, where)]
+
+    def search_ids_by_vector(self, vector, k: int = 4, where: dict | None = None) -> List[Tuple[str, float]]:
+        return [(self.index.ids[row], score) for row, score in self.index.search(vector, k, where)]
+
+    def get_by_ids(self, ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        with self.index.lock:
+            rows = [(i, self.index.row_of[i]) for i in ids if i in self.index.row_of]
+            return {i: (self.index.texts[r], self.index.metadatas[r]) for i, r in rows}
+
+    def similarity_search_by_vector(self, vector, k: int = 4, where: dict | None = None) -> List[Document]:
+        return [self._document(row) for row, _ in self.index.search(vector, k, where)]
+
+    def similarity_search(self, query: str, k: int = 4, where: dict | None = None) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score(query, k=k, where=where)]
+
+    def as_retriever(self, k: int = 4, where: dict | None = None) -> FlatRetriever:
+        return FlatRetriever(store=self, k=k, where=where)
+
+    def delete_all(self) -> None:
+        drop_flat_index(self.index_dir)
+        self.index = open_flat_index(self.index_dir, self.dtype)
@@ -0,0 +1,74 @@
+"""Id-based hybrid retrieval primitives.
+
+Retrievers return ranked chunk ids; fusion works on those ids only and
+``Document`` objects are materialized just for the final winners, so chunk
+text is never hashed or copied during ranking.
+"""
+import heapq
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from rank_bm25 import BM25Okapi
+
+Ranking = Sequence[str]
+
+
+def default_tokenize(text: str) -> List[str]:
+    # Same preprocessing as LangChain's BM25Retriever
+    return text.split()
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of chunk ids."""
+
+    def __init__(self, ids: List[str], texts: List[str], tokenize: Callable[[str], List[str]] = default_tokenize):
+        self.ids = ids
+        self.tokenize = tokenize
+        self.bm25 = BM25Okapi([tokenize(t) for t in texts]) if texts else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        if self.bm25 is None:
+            return []
+        scores = self.bm25.get_scores(self.tokenize(query))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+def weighted_rrf(rankings: Iterable[Tuple[Ranking, float]], top_k: int, c: int = 60) -> List[Tuple[str, float]]:
+    """Reciprocal Rank Fusion with a weight per ranking; top-k by a bounded heap."""
+    scores: Dict[str, float] = {}
+    for ids, weight in rankings:
+        for rank, chunk_id in enumerate(ids):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (c + rank)
+    return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+class CandidateStore:
+    """Chunk id -> (text, metadata), filled from whatever the retrievers already fetched."""
+
+    def __init__(self, fetch: Optional[Callable[[List[str]], Dict[str, Tuple[str, dict]]]] = None):
+        self.chunks: Dict[str, Tuple[str, dict]] = {}
+        self.fetch = fetch
+
+    def add_many(self, ids: List[str], texts: List[str], metadatas: List[dict]) -> None:
+        for i, t, m in zip(ids, texts, metadatas):
+            self.chunks[i] = (t, m or {})
+
+    def materialize(self, fused: List[Tuple[str, float]]) -> List[Document]:
+        missing = [i for i, _ in fused if i not in self.chunks]
+        if missing and self.fetch is not None:
+            self.chunks.update(self.fetch(missing))
+        out = []
+        for chunk_id, score in fused:
+            if chunk_id not in self.chunks:
+                continue
+            text, meta = self.chunks[chunk_id]
+            meta = dict(meta)
+            meta["rrf_score"] = score
+            out.append(Document(id=chunk_id, page_content=text, metadata=meta))
+        return out
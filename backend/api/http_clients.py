@@ -0,0 +1,94 @@
+"""Shared, connection-pooled HTTP clients for all outbound calls.
+
+One ``httpx.AsyncClient`` serves request handlers and one ``httpx.Client``
+serves code running in worker threads (the LangChain pipeline). Both are
+created at startup and closed at shutdown. The OpenAI SDK clients, the chat
+model and the Cloudinary REST calls all reuse them, so TLS connections stay
+warm across requests.
+"""
+import threading
+from typing import Optional
+import httpx
+from .core import config
+from . import metrics
+
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+_async_openai = None
+_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.HTTP_POOL_SIZE,
+        max_keepalive_connections=config.HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+
+
+def _count_sync_request(request: httpx.Request):
+    metrics.inc("http_client_requests_total", client="sync", host=request.url.host)
+
+
+async def _count_async_request(request: httpx.Request):
+    metrics.inc("http_client_requests_total", client="async", host=request.url.host)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), event_hooks={"request": [_count_async_request]})
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(limits=_limits(), timeout=_timeout(), event_hooks={"request": [_count_sync_request]})
+        return _sync_client
+
+
+def get_async_openai():
+    """Process-wide AsyncOpenAI client on the shared async pool."""
+    global _async_openai
+    if _async_openai is None:
+        from openai import AsyncOpenAI
+        _async_openai = AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL, http_client=get_async_client())
+    return _async_openai
+
+
+async def start_http_clients() -> None:
+    get_async_client()
+    get_sync_client()
+
+
+async def close_http_clients() -> None:
+    global _async_client, _sync_client, _async_openai
+    if _async_client is not None:
+        await _async_client.aclose()
+    if _sync_client is not None:
+        _sync_client.close()
+    _async_client = _sync_client = _async_openai = None
+
+
+def _pool_connections(client) -> list:
+    # httpx does not expose pool state publicly; read the httpcore pool when present
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+def publish_pool_metrics() -> None:
+    for name, client in (("async", _async_client), ("sync", _sync_client)):
+        if client is None or client.is_closed:
+            continue
+        connections = _pool_connections(client)
+        idle = sum(1 for c in connections if c.is_idle())
+        metrics.gauge("http_pool_connections", len(connections), client=name)
+        metrics.gauge("http_pool_idle_connections", idle, client=name)
+        metrics.gauge("http_pool_active_connections", len(connections) - idle, client=name)
+        metrics.gauge("http_pool_utilization", (len(connections) - idle) / max(1, config.HTTP_POOL_SIZE), client=name)
@@ -0,0 +1,201 @@
+"""In-process counters, gauges, latency summaries and histograms.
+
+Components record into named series with optional labels; ``snapshot()``
+returns everything as plain JSON for the ``/api/stats`` endpoint and
+``render_prometheus()`` the same series in the Prometheus text format for
+``/metrics``. ``stage()`` times one step of a request into the
+``stage_seconds`` histogram and into the per-request timings that become the
+``Server-Timing`` header.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from . import tracing
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_gauges: dict[tuple, float] = {}
+_summaries: dict[tuple, list[float]] = {}  # key -> [count, sum, max]
+_histograms: dict[tuple, list] = {}  # key -> [bucket counts..., +Inf count, sum]
+
+# Upper bounds in seconds, from a BM25 lookup to a slow generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage durations (ms) of the request being served, None outside of one
+_timings: ContextVar[Optional[dict]] = ContextVar("stage_timings", default=None)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def gauge(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = float(value)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        s = _summaries.get(key)
+        if s is None:
+            _summaries[key] = [1, value, value]
+        else:
+            s[0] += 1
+            s[1] += value
+            s[2] = max(s[2], value)
+
+
+def histogram(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        h[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        h[-1] += value
+
+
+def collect_timings() -> dict:
+    """Start collecting stage timings for the current context; returns the live dict.
+
+    Worker threads started with ``run_in_threadpool`` copy the context, so
+    stages timed there land in the same dict.
+    """
+    timings: dict = {}
+    _timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage into ``stage_seconds{stage=name}``, the request timings and a trace span."""
+    t0 = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        histogram("stage_seconds", elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            # Repeated stages (one search per query variant) add up
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+
+
+def server_timing(timings: dict) -> str:
+    """``Server-Timing`` header value for collected stage timings."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+def _series_name(key: tuple) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _quantile(h: list, q: float) -> float:
+    # Upper bound of the bucket holding the q-th observation
+    total = sum(h[:-1])
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, h):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = {_series_name(k): v for k, v in _counters.items()}
+        gauges = {_series_name(k): v for k, v in _gauges.items()}
+        summaries = {
+            _series_name(k): {"count": int(c), "sum": s, "avg": s / c if c else 0.0, "max": m}
+            for k, (c, s, m) in _summaries.items()
+        }
+        histograms = {
+            _series_name(k): {
+                "count": sum(h[:-1]), "sum": h[-1],
+                "p50": _quantile(h, 0.5), "p95": _quantile(h, 0.95), "p99": _quantile(h, 0.99),
+            }
+            for k, h in _histograms.items()
+        }
+    return {"counters": counters, "gauges": gauges, "summaries": summaries, "histograms": histograms}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prom_series(name: str, labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _prom_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+
+def render_prometheus() -> str:
+    """All series in the Prometheus text exposition format (version 0.0.4)."""
+    lines: list[str] = []
+
+    def family(items, kind, emit):
+        by_name: dict[str, list] = {}
+        for (name, labels), value in items:
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in by_name[name]:
+                emit(name, labels, value)
+
+    with _lock:
+        counters = list(_counters.items())
+        gauges = list(_gauges.items())
+        summaries = [(k, list(v)) for k, v in _summaries.items()]
+        histograms = [(k, list(v)) for k, v in _histograms.items()]
+
+    family(counters, "counter", lambda n, l, v: lines.append(f"{_prom_series(n, l)} {_prom_value(v)}"))
+    family(gauges, "gauge", lambda n, l, v: lines.append(f"{_prom_series(n, l)} {_prom_value(v)}"))
+
+    def emit_summary(name, labels, value):
+        count, total, _ = value
+        lines.append(f"{_prom_series(name + '_count', labels)} {int(count)}")
+        lines.append(f"{_prom_series(name + '_sum', labels)} {_prom_value(float(total))}")
+
+    family(summaries, "summary", emit_summary)
+
+    def emit_histogram(name, labels, h):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), h[:-1]):
+            cumulative += count
+            lines.append(f"{_prom_series(name + '_bucket', labels, (('le', _prom_value(float(bound))),))} {cumulative}")
+        lines.append(f"{_prom_series(name + '_count', labels)} {cumulative}")
+        lines.append(f"{_prom_series(name + '_sum', labels)} {_prom_value(float(h[-1]))}")
+
+    family(histograms, "histogram", emit_histogram)
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _summaries.clear()
+        _histograms.clear()
@@ -0,0 +1,185 @@
+"""ONNX Runtime backend for the sentence-embedding model.
+
+The HuggingFace model is exported to ONNX ahead of time, optionally with
+int8 dynamic quantization, by ``python -m api.onnx_embeddings export`` (at
+image build or deploy time; it needs torch and transformers). The server
+only loads an existing export, with ``onnxruntime`` and ``tokenizers``:
+torch is not imported at all. Pooling
+matches sentence-transformers (attention-masked mean, then L2
+normalization), so vectors are interchangeable with the torch backend.
+The export is checked against torch right away, and the result is stored
+in ``export.json`` next to the model.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+EXPORT_FILE = "export.json"
+# sentence-transformers truncates all-MiniLM-L6-v2 inputs at 256 tokens
+MAX_SEQ_LENGTH = 256
+PARITY_TEXTS = [
+    "The quarterly report shows revenue growth in all regions.",
+    "Photosynthesis converts light energy into chemical energy.",
+    "Section 4.2 describes the termination clause of the contract.",
+    "What are the side effects of the medication?",
+    "Das Modell wurde auf mehrsprachigen Daten trainiert.",
+    "",
+]
+
+_export_lock = threading.Lock()
+log = logging.getLogger(__name__)
+
+
+def model_dir(cache_dir: str, model_name: str) -> str:
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def cosine_agreement(a, b) -> dict:
+    """Row-wise cosine between two embedding matrices: min and mean."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    cos = (a * b).sum(axis=1)
+    return {"min": float(cos.min()), "mean": float(cos.mean())}
+
+
+def export_model(model_name: str, out_dir: str, quantize: bool = False) -> dict:
+    """Export ``model_name`` to ``out_dir`` (needs torch and transformers) and check parity."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(repo)
+    model = AutoModel.from_pretrained(repo)
+    model.eval()
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(out_dir) or ".")
+    try:
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        names = ["input_ids", "attention_mask", "token_type_ids"]
+        dynamic = {n: {0: "batch", 1: "sequence"} for n in names}
+        dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[n] for n in names),
+                os.path.join(tmp, MODEL_FILE),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic,
+                opset_version=14,
+            )
+        tokenizer.backend_tokenizer.save(os.path.join(tmp, TOKENIZER_FILE))
+        if quantize:
+            quantize_dynamic(os.path.join(tmp, MODEL_FILE), os.path.join(tmp, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+        # Parity against sentence-transformers on the same texts
+        from sentence_transformers import SentenceTransformer
+        reference = SentenceTransformer(repo).encode(PARITY_TEXTS, normalize_embeddings=True)
+        info = {"model": model_name, "parity": {}}
+        for file in [MODEL_FILE] + ([QUANTIZED_FILE] if quantize else []):
+            candidate = OnnxEmbeddings(tmp, model_file=file).embed_documents(PARITY_TEXTS)
+            info["parity"][file] = cosine_agreement(reference, candidate)
+        with open(os.path.join(tmp, EXPORT_FILE), "w") as f:
+            json.dump(info, f, indent=2)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp, out_dir)
+        return info
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def find_export(cache_dir: str, model_name: str, quantize: bool = False) -> Optional[str]:
+    """Directory holding an existing export of the wanted model file, None if there is none. Never exports."""
+    out_dir = model_dir(cache_dir, model_name)
+    wanted = QUANTIZED_FILE if quantize else MODEL_FILE
+    return out_dir if os.path.isfile(os.path.join(out_dir, wanted)) else None
+
+
+def ensure_exported(cache_dir: str, model_name: str, quantize: bool = False, force: bool = False) -> str:
+    """Directory holding the exported model, exporting it when missing (or with ``force``)."""
+    out_dir = model_dir(cache_dir, model_name)
+    with _export_lock:
+        if force or find_export(cache_dir, model_name, quantize) is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            log.info("ONNX: exporting %s to %s (quantize=%s)", model_name, out_dir, quantize)
+            info = export_model(model_name, out_dir, quantize=quantize)
+            log.info("ONNX: export done, parity %s", info["parity"])
+    return out_dir
+
+
+def load_export_info(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, EXPORT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_path: str, model_file: str = MODEL_FILE, threads: int = 0, batch_size: int = 32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_path, model_file), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.asarray([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+        # Attention-masked mean pooling, then L2 normalization
+        m = mask[:, :, None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        out = []
+        for start in range(0, len(texts), self.batch_size):
+            out.extend(self._encode(list(texts[start:start + self.batch_size])).tolist())
+        return out
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def main():
+    import argparse
+    from .core import config
+    from .rag import EMBEDDING_MODEL_NAME
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX for EMBEDDING_BACKEND=onnx/onnx-int8.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--cache-dir", default=config.ONNX_CACHE_DIR, help="defaults to ONNX_CACHE_DIR")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--no-int8", action="store_true", help="skip the int8-quantized model")
+    parser.add_argument("--force", action="store_true", help="export again even if an export exists")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    out_dir = ensure_exported(args.cache_dir, args.model, quantize=not args.no_int8, force=args.force)
+    print(f"{out_dir}: parity {load_export_info(out_dir).get('parity')}")
+
+
+if __name__ == "__main__":
+    main()
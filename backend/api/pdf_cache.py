@@ -0,0 +1,164 @@
+"""Size-capped local disk cache of uploaded PDF bytes.
+
+Files are named ``<document_id>-<sha256>.pdf``, so a re-uploaded document
+never serves stale bytes. Eviction is least-recently-used: the order is
+rebuilt from file access times at startup and updated on every hit. Readers
+keep an open file handle, so evicting a file mid-stream is safe.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Iterator, Optional, Tuple
+from .core import config
+from . import metrics
+
+CHUNK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PdfCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # file name -> size, oldest first
+        self.total = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith(".pdf") and os.path.isfile(path):
+                st = os.stat(path)
+                files.append((st.st_atime, name, st.st_size))
+            elif name.endswith(".part"):
+                os.remove(path)
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total += size
+
+    @staticmethod
+    def _name(document_id: str, sha256: str) -> str:
+        return f"{document_id}-{sha256}.pdf"
+
+    def path(self, document_id: str, sha256: str) -> Optional[str]:
+        """Path of a cached file (marked as recently used), None on a miss."""
+        name = self._name(document_id, sha256)
+        with self.lock:
+            if name not in self.entries:
+                metrics.inc("pdf_cache_requests_total", result="miss")
+                return None
+            self.entries.move_to_end(name)
+        metrics.inc("pdf_cache_requests_total", result="hit")
+        return os.path.join(self.cache_dir, name)
+
+    def put_file(self, document_id: str, source_path: str, sha256: str | None = None) -> Tuple[str, str]:
+        """Copy a local file into the cache; returns (sha256, cached path)."""
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        with os.fdopen(fd, "wb") as dst, open(source_path, "rb") as src:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return self._commit(document_id, tmp, sha256 or file_sha256(tmp))
+
+    async def put_async_stream(self, document_id: str, chunks: AsyncIterator[bytes]) -> Tuple[str, str]:
+        """Write downloaded chunks into the cache, hashing on the way; returns (sha256, cached path)."""
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                async for chunk in chunks:
+                    h.update(chunk)
+                    dst.write(chunk)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return self._commit(document_id, tmp, h.hexdigest())
+
+    def _commit(self, document_id: str, tmp: str, sha256: str) -> Tuple[str, str]:
+        name = self._name(document_id, sha256)
+        path = os.path.join(self.cache_dir, name)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total -= self.entries.pop(name, 0)
+            self.entries[name] = size
+            self.total += size
+            self._evict()
+        return sha256, path
+
+    def _evict(self):
+        # Keep at least the newest entry even if it alone exceeds the cap
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            metrics.inc("pdf_cache_evictions_total")
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+        metrics.gauge("pdf_cache_bytes", self.total)
+
+    def evict_document(self, document_id: str) -> None:
+        prefix = f"{document_id}-"
+        with self.lock:
+            for name in [n for n in self.entries if n.startswith(prefix)]:
+                self.total -= self.entries.pop(name)
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+            metrics.gauge("pdf_cache_bytes", self.total)
+
+
+def parse_range(header: str | None, size: int) -> Optional[Tuple[int, int]]:
+    """Single ``bytes=`` range as inclusive (start, end); None for a full response.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m:
+        # Multiple or malformed ranges: serve the whole file
+        return None
+    first, last = m.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def iter_file(f, start: int, end: int) -> Iterator[bytes]:
+    """Yield bytes ``start..end`` (inclusive) of an open file, then close it."""
+    try:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+pdf_cache = PdfCache(config.PDF_CACHE_DIR, config.PDF_CACHE_MAX_MB * 1024 * 1024)
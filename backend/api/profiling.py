@@ -0,0 +1,241 @@
+"""Opt-in profiles of individual chat and upload requests.
+
+With ``PROFILING_ENABLED`` set, a user listed in ``PROFILE_USERS`` can ask
+for a profile of one request with an ``X-Profile`` header (``cprofile`` or
+``sample``; any other true value uses ``PROFILE_MODE``), or have every
+request profiled by setting ``profile_requests: true`` on their user
+document. The profile covers the blocking work the request hands to the
+threadpool (retrieval, generation, PDF indexing): call sites pass their
+function through ``wrap()``.
+
+``cprofile`` stores a pstats dump, ``sample`` stores collapsed stacks
+(one ``frame;frame;frame count`` line per stack, for flame graph tools).
+Files are named by a server-generated profile id (returned as
+``X-Profile-Id``; the request id is kept in the metadata), the directory
+keeps the newest ``PROFILE_MAX_FILES`` profiles, and
+``GET /api/profiles/{profile_id}`` returns one to its owner. One request is profiled at a time; when profiling
+is off, the only cost is a flag check per request.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Optional
+from bson import ObjectId
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from .core import config
+from . import metrics, tracing
+
+MODES = ("cprofile", "sample")
+
+log = logging.getLogger(__name__)
+
+_active: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+# Profilers hook the interpreter per thread (process-wide on newer Pythons): one request at a time
+_slot = threading.Lock()
+
+
+class ProfileSession:
+    def __init__(self, request_id: str, user_id: str, route: str, mode: str):
+        # File names never come from the client: a caller-chosen X-Request-ID
+        # could otherwise overwrite another user's profile
+        self.profile_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.user_id = user_id
+        self.route = route
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.profiles: list[cProfile.Profile] = []
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        if mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    @contextmanager
+    def thread(self):
+        """Profile the calling worker thread for the duration of the block."""
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.profiles.append(profile)
+            return
+        tid = threading.get_ident()
+        with self._lock:
+            self._threads.add(tid)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads.discard(tid)
+
+    def _sample_loop(self) -> None:
+        interval = config.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            with self._lock:
+                threads = list(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for tid in threads:
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+
+
+def wrap(fn: Callable) -> Callable:
+    """``fn`` profiled when the current request is being profiled, otherwise ``fn`` itself."""
+    session = _active.get()
+    if session is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with session.thread():
+            return fn(*args, **kwargs)
+    return run
+
+
+def _allowed(user_id: str) -> bool:
+    users = {u.strip() for u in config.PROFILE_USERS.split(",") if u.strip()}
+    return "*" in users or user_id in users
+
+
+async def _requested_mode(request: Request, db, user_id: str) -> Optional[str]:
+    if not _allowed(user_id):
+        return None
+    header = request.headers.get("x-profile", "").strip().lower()
+    if header in MODES:
+        return header
+    if header in ("1", "true", "yes", "on"):
+        return config.PROFILE_MODE
+    try:
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"profile_requests": 1})
+    except Exception:
+        return None
+    return config.PROFILE_MODE if user and user.get("profile_requests") else None
+
+
+@asynccontextmanager
+async def profile_request(request: Request, db, user_id: str, route: str) -> AsyncIterator[Optional[ProfileSession]]:
+    """Profile the enclosed block when requested; yields the session or None."""
+    if not config.PROFILING_ENABLED:
+        yield None
+        return
+    mode = await _requested_mode(request, db, user_id)
+    if mode is None:
+        yield None
+        return
+    if not _slot.acquire(blocking=False):
+        metrics.inc("profiles_total", route=route, result="busy")
+        yield None
+        return
+    session = ProfileSession(tracing.current_request_id() or "", user_id, route, mode)
+    token = _active.set(session)
+    try:
+        yield session
+    finally:
+        _active.reset(token)
+        session.stop()
+        try:
+            await run_in_threadpool(_save, session)
+            metrics.inc("profiles_total", route=route, result="saved")
+        except Exception as e:
+            metrics.inc("profiles_total", route=route, result="failed")
+            log.warning("Saving profile %s failed: %s", session.profile_id, e)
+        finally:
+            _slot.release()
+
+
+def _safe_id(value: str) -> str:
+    return "".join(c for c in value if c.isalnum() or c in "-_")[:64]
+
+
+def _save(session: ProfileSession) -> None:
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(config.PROFILE_DIR, session.profile_id)
+    if session.mode == "cprofile":
+        if session.profiles:
+            stats = pstats.Stats(session.profiles[0])
+            for profile in session.profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(base + ".pstats")
+    else:
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    meta = {
+        "profile_id": session.profile_id, "request_id": session.request_id, "user_id": session.user_id, "route": session.route, "mode": session.mode,
+        "duration_ms": round(session.duration * 1000, 1), "samples": session.samples, "created_at": time.time(),
+    }
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    _prune()
+
+
+def _prune() -> None:
+    metas = sorted(
+        (os.path.getmtime(os.path.join(config.PROFILE_DIR, n)), n[:-len(".json")])
+        for n in os.listdir(config.PROFILE_DIR) if n.endswith(".json")
+    )
+    for _, stem in metas[:max(0, len(metas) - config.PROFILE_MAX_FILES)]:
+        for ext in (".json", ".pstats", ".collapsed"):
+            try:
+                os.remove(os.path.join(config.PROFILE_DIR, stem + ext))
+            except FileNotFoundError:
+                pass
+
+
+def load_profile(profile_id: str) -> Optional[tuple[dict, Optional[str]]]:
+    """(metadata, data file path) of a stored profile, None when unknown."""
+    base = os.path.join(config.PROFILE_DIR, _safe_id(profile_id))
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    path = base + (".pstats" if meta.get("mode") == "cprofile" else ".collapsed")
+    return meta, path if os.path.exists(path) else None
+
+
+def read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def render_pstats(path: str, limit: int = 60) -> str:
+    """Top functions by cumulative time, as printed by pstats."""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
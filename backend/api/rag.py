@@ -1,111 +1,303 @@
 import os
+import json
+import logging
+import shutil
+import threading
+import time
 from typing import Optional
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import ChatOpenAI
+# Heavy dependencies (Chroma, sentence-transformers/torch, OpenAI, PDF loaders,
+# chains) are imported inside the functions that need them, so the API server
+# starts answering before they are loaded
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
 from typing import List, Tuple
 from .core import config
+from . import doc_router, metrics, tracing
+from .embedding_service import BatchedEmbeddings, EmbeddingScheduler, embed_queries
+from .fusion import BM25Index, CandidateStore, weighted_rrf
+from .flat_index import FlatSessionStore, flat_index_exists, forget_flat_indexes
+from .vectorstore import ChromaSessionStore, forget_shared_chroma, open_shared_chroma
 
+log = logging.getLogger(__name__)
 
-def get_embeddings():
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def build_embedding_model():
     if config.HUGGINGFACE_TOKEN:
         os.environ["HUGGINGFACE_TOKEN"] = config.HUGGINGFACE_TOKEN
+    if config.EMBEDDING_BACKEND in ("onnx", "onnx-int8"):
+        try:
+            from .onnx_embeddings import MODEL_FILE, QUANTIZED_FILE, OnnxEmbeddings, find_export, load_export_info
+            quantize = config.EMBEDDING_BACKEND == "onnx-int8"
+            # Exporting needs torch and far more memory than serving, so it never happens here
+            model_path = find_export(config.ONNX_CACHE_DIR, EMBEDDING_MODEL_NAME, quantize=quantize)
+            if model_path is None:
+                raise FileNotFoundError(f"no export in {config.ONNX_CACHE_DIR}, run `python -m api.onnx_embeddings export`")
+            model_file = QUANTIZED_FILE if quantize else MODEL_FILE
+            parity = load_export_info(model_path).get("parity", {}).get(model_file, {})
+            if parity and parity["min"] < config.ONNX_PARITY_MIN:
+                raise ValueError(f"exported model disagrees with torch (min cosine {parity['min']:.4f})")
+            log.info("Embeddings: ONNX Runtime backend (%s, parity %s)", model_file, parity or "unknown")
+            return OnnxEmbeddings(model_path, model_file=model_file, threads=config.ONNX_THREADS)
+        except Exception as e:
+            log.warning("ONNX embedding backend unavailable (%s), using torch", e)
+    from langchain_huggingface import HuggingFaceEmbeddings
     # Use all-MiniLM-L6-v2: smaller model (~90MB) that works well on free tier
     # all-mpnet-base-v2 (~420MB) is too large for Render free tier (512MB RAM)
     return HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2",
+        model_name=EMBEDDING_MODEL_NAME,
         encode_kwargs={"normalize_embeddings": True},
     )
 
 
+def get_embeddings():
+    # One model per process; loading it per request costs seconds and ~100MB each time
+    global _embeddings
+    if _embeddings is not None:
+        return _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            model = build_embedding_model()
+            if config.EMBED_MICRO_BATCHING:
+                # Concurrent callers share forward passes through one scheduler
+                model = BatchedEmbeddings(EmbeddingScheduler(
+                    model, max_batch=config.EMBED_BATCH_MAX, max_wait=config.EMBED_BATCH_WAIT_MS / 1000.0,
+                ))
+            _embeddings = model
+    return _embeddings
+
+
+# /tmp by default to avoid permission issues in HF Spaces
+CHROMA_BASE_DIR = config.CHROMA_BASE_DIR
+
+
 def get_user_chroma_dir(user_id: str, session_id: str | None = None) -> str:
-    # Use /tmp for ChromaDB to avoid permission issues in HF Spaces
-    base = "/tmp/chroma_db"
+    # session_id is the session's immutable storage key (its ObjectId), never its
+    # display name, so renaming a session never touches vector data
     if session_id:
-        return os.path.join(base, f"user_{user_id}", f"session_{session_id}")
-    return os.path.join(base, f"user_{user_id}")
+        return os.path.join(CHROMA_BASE_DIR, f"user_{user_id}", f"sid_{session_id}")
+    return os.path.join(CHROMA_BASE_DIR, f"user_{user_id}")
+
+
+def get_shared_chroma_dir(user_id: str) -> str | None:
+    # Consolidated layouts keep many sessions in one database; None for per-session layout
+    if config.VECTOR_STORE_LAYOUT == "user":
+        return os.path.join(CHROMA_BASE_DIR, f"user_{user_id}", "shared")
+    if config.VECTOR_STORE_LAYOUT == "global":
+        return os.path.join(CHROMA_BASE_DIR, "global")
+    return None
 
 
-def get_vectorstore_for_user(user_id: str, session_id: str | None = None) -> Chroma:
+def get_flat_index_dir(user_id: str, session_id: str) -> str:
+    return os.path.join(get_user_chroma_dir(user_id, session_id), "flat")
+
+
+def select_session_backend(user_id: str, session_id: str) -> str:
+    # An existing session keeps the backend its data was written with
+    persist_dir = get_user_chroma_dir(user_id, session_id)
+    if flat_index_exists(get_flat_index_dir(user_id, session_id)):
+        return "flat"
+    if os.path.isfile(os.path.join(persist_dir, "chroma.sqlite3")):
+        return "chroma"
+    return "flat" if config.VECTOR_BACKEND in ("flat", "auto") else "chroma"
+
+
+def get_vectorstore_for_user(user_id: str, session_id: str | None = None, backend: str | None = None):
     if not session_id:
         # Enforce per-session isolation; caller must provide session_id
         raise ValueError("session_id is required for vectorstore access")
     
     # Try to use persistent directory, fall back to in-memory if it fails
     try:
+        embeddings = get_embeddings()
+        shared_dir = get_shared_chroma_dir(user_id)
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            return ChromaSessionStore(open_shared_chroma(shared_dir, embeddings), user_id, session_id, shared=True)
         persist_dir = get_user_chroma_dir(user_id, session_id)
         os.makedirs(persist_dir, exist_ok=True)
-        embeddings = get_embeddings()
-        return Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+        if (backend or select_session_backend(user_id, session_id)) == "flat":
+            return FlatSessionStore(get_flat_index_dir(user_id, session_id), embeddings, user_id, session_id, dtype=config.VECTOR_DTYPE)
+        from langchain_chroma import Chroma
+        return ChromaSessionStore(Chroma(persist_directory=persist_dir, embedding_function=embeddings), user_id, session_id)
     except Exception as e:
-        print(f"⚠️ Persistent ChromaDB failed ({e}), using in-memory mode")
+        log.warning("Persistent ChromaDB failed (%s), using in-memory mode", e)
         # Fallback to in-memory ChromaDB (no persistence)
+        from langchain_chroma import Chroma
         embeddings = get_embeddings()
-        return Chroma(embedding_function=embeddings)
+        return ChromaSessionStore(Chroma(embedding_function=embeddings), user_id, session_id)
+
+
+def promote_flat_to_chroma(user_id: str, session_id: str, flat: FlatSessionStore) -> ChromaSessionStore:
+    """Move a session that outgrew the flat index into Chroma, reusing its stored vectors."""
+    data = flat.get(include=["documents", "metadatas", "embeddings"])
+    vs = get_vectorstore_for_user(user_id, session_id, backend="chroma")
+    batch = 500
+    for i in range(0, len(data["ids"]), batch):
+        vs._collection.add(
+            ids=data["ids"][i:i + batch],
+            embeddings=data["embeddings"][i:i + batch].tolist(),
+            documents=data["documents"][i:i + batch],
+            metadatas=data["metadatas"][i:i + batch],
+        )
+    flat.delete_all()
+    log.info("Promoted session %s from flat index to Chroma (%d chunks)", session_id, len(data["ids"]))
+    return vs
+
+
+def delete_session_vectors(user_id: str, session_id: str) -> None:
+    if get_shared_chroma_dir(user_id):
+        get_vectorstore_for_user(user_id, session_id).delete_all()
+    # Per-session directories also exist for sidecar data in consolidated layouts
+    session_dir = get_user_chroma_dir(user_id, session_id)
+    forget_flat_indexes(session_dir)
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def delete_user_vectors(user_id: str) -> None:
+    shared_dir = get_shared_chroma_dir(user_id)
+    if config.VECTOR_STORE_LAYOUT == "global":
+        vs = open_shared_chroma(shared_dir, get_embeddings())
+        vs._collection.delete(where={"user_id": user_id})
+    elif shared_dir:
+        forget_shared_chroma(shared_dir)
+    user_dir = get_user_chroma_dir(user_id, None)
+    forget_flat_indexes(user_dir)
+    shutil.rmtree(user_dir, ignore_errors=True)
+
+
+def document_filter(document_ids: Optional[List[str]]) -> dict | None:
+    """Metadata filter restricting retrieval to the given documents (None = whole session)."""
+    ids = [d for d in (document_ids or []) if d]
+    if not ids:
+        return None
+    if len(ids) == 1:
+        return {"document_id": ids[0]}
+    return {"document_id": {"$in": ids}}
 
 
-def index_pdf_for_user(user_id: str, temp_pdf_path: str, session_id: str | None = None):
+def index_pdf_for_user(user_id: str, temp_pdf_path: str, session_id: str | None = None, document_id: str | None = None, filename: str | None = None):
     if not session_id:
         raise ValueError("session_id is required for indexing")
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     loader = PyPDFLoader(temp_pdf_path)
-    docs = loader.load()
+    with metrics.stage("pdf_parse"):
+        docs = loader.load()
     # Filter out empty pages (e.g., scanned PDFs without OCR)
     docs = [d for d in docs if (d.page_content or "").strip()]
     if not docs:
         raise ValueError("No extractable text found in the PDF. Try another file or OCR.")
     # Slightly smaller chunks generally improve recall; keep modest overlap for continuity
-    splitter = RecursiveCharacterTextSplitter(chunk_size=900, chunk_overlap=150)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP)
     splits = splitter.split_documents(docs)
+    tracing.annotate(pages=len(docs), chunks=len(splits))
     if not splits:
         raise ValueError("No text chunks generated from the PDF.")
+    if document_id:
+        # Stable per-document tag so retrieval can be scoped to chosen documents
+        for d in splits:
+            d.metadata["document_id"] = document_id
     vs = get_vectorstore_for_user(user_id, session_id)
-    vs.add_documents(splits)
+    if vs.backend == "flat" and config.VECTOR_BACKEND == "auto" and vs.count() + len(splits) > config.FLAT_INDEX_MAX_CHUNKS:
+        vs = promote_flat_to_chroma(user_id, session_id, vs)
+    # Embed once: the same vectors feed the chunk index and the document router
+    with metrics.stage("embedding"):
+        vectors = vs.embeddings.embed_documents([d.page_content for d in splits])
+    with metrics.stage("vectorstore_write"):
+        vs.add_documents(splits, vectors=vectors)
+    if document_id:
+        doc_router.add_document(get_user_chroma_dir(user_id, session_id), document_id, vectors, filename=filename)
 
 
-def get_llm() -> ChatOpenAI:
-    # Deterministic answers; we rely on retrieved context only
-    return ChatOpenAI(api_key=config.OPENAI_API_KEY, model="gpt-4o-mini", temperature=0)
+_llm = None
+_llm_clients = None
 
 
-def build_conversational_chain(user_id: str, history: Optional[BaseChatMessageHistory], session_id: str | None = None):
+def get_llm():
+    # One chat model per process, on the shared connection pools
+    global _llm, _llm_clients
+    from .http_clients import get_async_client, get_sync_client
+    clients = (get_sync_client(), get_async_client())
+    if _llm is None or _llm_clients != clients:
+        from langchain_openai import ChatOpenAI
+        # Deterministic answers; we rely on retrieved context only
+        _llm = ChatOpenAI(
+            api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL, model="gpt-4o-mini", temperature=0,
+            http_client=clients[0], http_async_client=clients[1],
+        )
+        _llm_clients = clients
+    return _llm
+
+
+def build_conversational_chain(user_id: str, history: Optional[BaseChatMessageHistory], session_id: str | None = None, document_ids: Optional[List[str]] = None):
     if not session_id:
         raise ValueError("session_id is required for chat")
-    vs = get_vectorstore_for_user(user_id, session_id)
-    # Embedding retriever (primary). Avoid score_threshold here due to Chroma compatibility.
-    embedding_retriever = vs.as_retriever(search_kwargs={"k": 8})
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    with metrics.stage("vectorstore_open"):
+        vs = get_vectorstore_for_user(user_id, session_id)
+    # Scope to the chosen documents; the filter is pushed down into the vector store
+    where = document_filter(document_ids)
+    # Chunk texts seen by any retriever, keyed by chunk id; winners are materialized from here
+    candidates = CandidateStore(fetch=vs.get_by_ids)
+    # Lightweight BM25 indexes for hybrid search, built lazily per scope (session,
+    # chosen documents or routed documents) and reused across query variants
+    bm25_by_scope = {}
 
-    # Build a lightweight BM25 retriever over all docs in the session for hybrid search
-    bm25 = None
-    try:
-        # Try to get all documents from the collection
-        collection = vs._collection
-        all_data = collection.get(include=["documents", "metadatas"])
-        texts = all_data.get("documents", []) or []
-        metas = all_data.get("metadatas", []) or []
-        
-        print(f"Chroma collection has {len(texts)} documents")
-        
-        if texts and len(texts) > 0:
-            bm25_docs: List[Document] = [Document(page_content=t, metadata=m or {}) for t, m in zip(texts, metas)]
-            bm25 = BM25Retriever.from_documents(bm25_docs)
-            bm25.k = 8
-            print(f"BM25 initialized with {len(bm25_docs)} documents")
-        else:
-            print("WARNING: No documents found in Chroma collection - did you upload a PDF?")
-    except Exception as e:
-        print(f"BM25 initialization failed: {e}")
-        import traceback
-        traceback.print_exc()
+    def get_bm25(scope: dict | None) -> BM25Index | None:
+        key = json.dumps(scope, sort_keys=True)
+        if key in bm25_by_scope:
+            metrics.inc("rag_cache_total", cache="bm25", result="hit")
+            return bm25_by_scope[key]
+        metrics.inc("rag_cache_total", cache="bm25", result="miss")
         bm25 = None
+        try:
+            with metrics.stage("bm25_build"):
+                # Only the chunks in scope are fetched, so BM25 never scores anything outside it
+                all_data = vs.get(where=scope, include=["documents", "metadatas"])
+                ids = all_data.get("ids", []) or []
+                texts = all_data.get("documents", []) or []
+                if texts:
+                    candidates.add_many(ids, texts, all_data.get("metadatas", []) or [])
+                    bm25 = BM25Index(ids, texts)
+            metrics.observe("rag_corpus_chunks", len(texts), scope="routed" if use_router else "session")
+            if bm25 is not None:
+                log.debug("BM25 initialized with %d documents", len(bm25))
+            else:
+                log.warning("No documents found in scope - did you upload a PDF?")
+        except Exception as e:
+            log.exception("BM25 initialization failed: %s", e)
+        bm25_by_scope[key] = bm25
+        return bm25
+
+    # Two-stage retrieval: with many documents, route each question to the best few
+    # documents first. Only when every chunk is covered by the router (no legacy chunks).
+    router = doc_router.load_router(get_user_chroma_dir(user_id, session_id))
+    use_router = (
+        where is None
+        and len(router["ids"]) > config.ROUTER_MIN_DOCUMENTS
+        and doc_router.routed_chunk_count(router) == vs.count()
+    )
+
+    def route_scope(query_vector) -> dict | None:
+        if not use_router:
+            return where
+        t0 = time.perf_counter()
+        with metrics.stage("route"):
+            routed = doc_router.route(router, query_vector, config.ROUTER_TOP_DOCUMENTS)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        log.debug("Router: %d/%d documents selected in %.2fms (top score %.3f)",
+                  len(routed), len(router["ids"]), elapsed_ms, routed[0][1] if routed else 0)
+        tracing.annotate(routed_documents=len(routed), router_documents=len(router["ids"]))
+        return document_filter([d for d, _ in routed])
+
     llm = get_llm()
 
     contextualize_q_system_prompt = (
@@ -123,7 +315,7 @@ def build_conversational_chain(user_id: str, history: Optional[BaseChatMessageHi
         ]
     )
 
-    history_aware_retriever = create_history_aware_retriever(llm, embedding_retriever, contextualize_q_prompt)
+    contextualize_chain = contextualize_q_prompt | llm | StrOutputParser()
 
     system_prompt = (
         "You are a grounded RAG assistant.\n"
@@ -142,18 +334,16 @@ def build_conversational_chain(user_id: str, history: Optional[BaseChatMessageHi
 
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
 
-    # Compose a custom retrieval function that performs multi-query expansion and RRF fusion
-    def retrieve(query: str, chat_history) -> List[Document]:
+    def expand_query(query: str) -> List[str]:
         # Multi-query expansion: generate several paraphrases of the user query
-        # Simplified to avoid breaking on subsequent queries
-        queries = [query]
+        alternatives = []
         try:
             mq_prompt = ChatPromptTemplate.from_messages([
                 ("system", "Generate 2 alternative search queries to find relevant information. Return ONLY a JSON array of strings, nothing else. Example: [\"query 1\", \"query 2\"]"),
                 ("human", "{q}")
             ])
-            mq = llm.invoke(mq_prompt.format_messages(q=query)).content.strip()
-            import json
+            with metrics.stage("expansion"):
+                mq = llm.invoke(mq_prompt.format_messages(q=query)).content.strip()
             # Try to extract JSON array if wrapped in markdown code blocks
             if "```" in mq:
                 # Extract content between ```json and ``` or ``` and ```
@@ -164,92 +354,142 @@ def build_conversational_chain(user_id: str, history: Optional[BaseChatMessageHi
             parsed = json.loads(mq)
             if isinstance(parsed, list):
                 for alt in parsed:
-                    if isinstance(alt, str) and alt.strip() and alt not in queries:
-                        queries.append(alt.strip())
-                print(f"Multi-query expansion: Generated {len(queries)-1} additional queries")
+                    if isinstance(alt, str) and alt.strip() and alt.strip() != query and alt.strip() not in alternatives:
+                        alternatives.append(alt.strip())
+                log.debug("Multi-query expansion: generated %d additional queries", len(alternatives))
         except Exception as e:
             # Log for debugging but don't fail - single query still works fine
-            print(f"Multi-query expansion skipped ({e}). Continuing with original query.")
-            pass
-
-        def dedup_by_text(docs: List[Document]) -> List[Document]:
-            seen = set()
-            unique = []
-            for d in docs:
-                key = (d.page_content.strip(), str(d.metadata))
-                if key in seen:
-                    continue
-                seen.add(key)
-                unique.append(d)
-            return unique
-
-        # Collect candidates per retriever
-        candidates: List[Tuple[Document, int]] = []  # (doc, rank)
-        print(f"Retrieve: Processing {len(queries)} queries: {[q[:50] for q in queries]}")
-        for i, q in enumerate(queries):
+            log.warning("Multi-query expansion skipped (%s). Continuing with original query.", e)
+        return alternatives
+
+    def first_pass_is_weak(dense_hits: List[Tuple[str, float]], sparse_ids: List[str]) -> bool:
+        """Expansion only pays off when single-query retrieval is unsure of itself."""
+        if not dense_hits:
+            return True
+        scores = [score for _, score in dense_hits]
+        top = scores[0]
+        margin = top - sum(scores) / len(scores)
+        overlap = len({i for i, _ in dense_hits} & set(sparse_ids)) / len(dense_hits)
+        # Dense and sparse agree, or dense is confident and well separated
+        agree = bool(sparse_ids) and overlap >= config.QUERY_ROUTER_MIN_OVERLAP
+        confident = top >= config.QUERY_ROUTER_MIN_TOP_SCORE and margin >= config.QUERY_ROUTER_MIN_MARGIN
+        log.debug("Query router: top=%.3f margin=%.3f overlap=%.2f -> %s",
+                  top, margin, overlap, "strong" if agree or confident else "weak")
+        return not (agree or confident)
+
+    # Compose a custom retrieval function: single-query retrieval first, then
+    # contextualization or multi-query expansion only when needed, and RRF fusion
+    def retrieve(query: str, chat_history) -> List[Document]:
+        t0 = time.perf_counter()
+        path = "fast"
+        if chat_history:
+            # Follow-up questions are rewritten into a standalone query instead of expanded
+            path = "contextualize"
+            try:
+                with metrics.stage("contextualize"):
+                    rewritten = contextualize_chain.invoke({"input": query, "chat_history": chat_history}).strip()
+                if rewritten:
+                    log.debug("Contextualized query: '%s'", rewritten[:100])
+                    query = rewritten
+            except Exception as e:
+                log.warning("Contextualization skipped (%s). Continuing with original query.", e)
+
+        # Ranked chunk ids per retriever and query variant, fused by id
+        rankings: List[Tuple[List[str], float]] = []
+
+        def search(q: str, qv, scope) -> Tuple[List[Tuple[str, float]], List[str]]:
             # Embedding hits - always retrieve, don't filter by threshold at this stage
             try:
-                docs = embedding_retriever.invoke(q)
-                print(f"  Query {i+1}: Embedding retriever returned {len(docs)} docs for: '{q[:50]}...'")
+                with metrics.stage("dense_search"):
+                    dense_hits = vs.search_ids_by_vector(qv, k=config.RETRIEVER_K, where=scope)
+                log.debug("Embedding retriever returned %d docs for: '%s...'", len(dense_hits), q[:50])
             except Exception as e:
-                print(f"  Query {i+1}: Embedding invoke failed: {e}, trying get_relevant_documents")
-                try:
-                    docs = embedding_retriever.get_relevant_documents(q)
-                    print(f"  Query {i+1}: get_relevant_documents returned {len(docs)} docs")
-                except Exception as e2:
-                    print(f"  Query {i+1}: get_relevant_documents also failed: {e2}")
-                    docs = []
-            for rank, d in enumerate(docs):
-                candidates.append((d, rank))
+                log.warning("Embedding search failed: %s", e)
+                dense_hits = []
+            rankings.append(([i for i, _ in dense_hits], config.RRF_DENSE_WEIGHT))
             # BM25 hits
+            sparse_ids = []
             if bm25 is not None:
                 try:
-                    bm25_docs = bm25.get_relevant_documents(q)
-                    print(f"  BM25 returned {len(bm25_docs)} docs for query: {q[:50]}")
-                    for rank, d in enumerate(bm25_docs):
-                        candidates.append((d, rank))
+                    with metrics.stage("sparse_search"):
+                        sparse_ids = [i for i, _ in bm25.search(q, k=config.RETRIEVER_K)]
+                    log.debug("BM25 returned %d docs for query: %s", len(sparse_ids), q[:50])
+                    rankings.append((sparse_ids, config.RRF_SPARSE_WEIGHT))
                 except Exception as e:
-                    print(f"  BM25 retrieval failed: {e}")
-                    pass
-
-        # Reciprocal Rank Fusion
-        scores = {}
-        for d, r in candidates:
-            key = (d.page_content, tuple(sorted(d.metadata.items()))) if isinstance(d.metadata, dict) else (d.page_content, str(d.metadata))
-            scores[key] = scores.get(key, 0) + 1.0 / (60 + r)  # 60 for stability
-
-        # Rebuild documents with aggregated scores
-        scored_docs = []
-        for d, r in candidates:
-            key = (d.page_content, tuple(sorted(d.metadata.items()))) if isinstance(d.metadata, dict) else (d.page_content, str(d.metadata))
-            if key in scores:
-                d.metadata = dict(d.metadata or {})
-                d.metadata["rrf_score"] = scores[key]
-                scored_docs.append(d)
-        # Sort by fused score desc, then truncate
-        scored_docs.sort(key=lambda x: x.metadata.get("rrf_score", 0), reverse=True)
-        out = dedup_by_text(scored_docs)[:6]
-        print(f"Retrieve: Final result: {len(out)} documents after deduplication and ranking")
-        
+                    log.warning("BM25 retrieval failed: %s", e)
+            return dense_hits, sparse_ids
+
+        with metrics.stage("embedding"):
+            query_vector = vs.embeddings.embed_query(query)
+        # Routing is decided once per question, on the original query
+        scope = route_scope(query_vector)
+        bm25 = get_bm25(scope)
+        dense_hits, sparse_ids = search(query, query_vector, scope)
+        queries = 1
+
+        expand = config.QUERY_EXPANSION == "always" or (
+            config.QUERY_EXPANSION == "adaptive" and first_pass_is_weak(dense_hits, sparse_ids)
+        )
+        if path == "fast" and expand:
+            path = "expand"
+            alternatives = expand_query(query)
+            if alternatives:
+                log.debug("Retrieve: processing %d expanded queries: %s", len(alternatives), [q[:50] for q in alternatives])
+                with metrics.stage("embedding"):
+                    alternative_vectors = embed_queries(vs.embeddings, alternatives)
+                for q, qv in zip(alternatives, alternative_vectors):
+                    search(q, qv, scope)
+                queries += len(alternatives)
+
+        elapsed = time.perf_counter() - t0
+        metrics.inc("rag_query_path_total", path=path)
+        metrics.observe("rag_query_path_seconds", elapsed, path=path)
+        log.info("Retrieve: path=%s in %.1fms", path, elapsed * 1000)
+
+        # Weighted Reciprocal Rank Fusion over chunk ids; only the winners become Documents
+        with metrics.stage("fusion"):
+            fused = weighted_rrf(rankings, top_k=config.FINAL_K, c=config.RRF_K)
+            out = candidates.materialize(fused)
+        log.debug("Retrieve: %d documents after fusion", len(out))
+        tracing.annotate(
+            path=path, query_count=queries, fused=len(out),
+            candidates=len({i for ids, _ in rankings for i in ids}),
+        )
+
         return out
 
     # Return a simple invokable object that mirrors the output shape of create_retrieval_chain
     class SimpleRAG:
         def invoke(self, inputs):
+            from langchain_community.callbacks import get_openai_callback
+            # Token usage of every LLM call made for this question (rewrite, expansion, answer)
+            with tracing.span("rag") as span, get_openai_callback() as usage:
+                result = self._invoke(inputs)
+                if span is not None:
+                    span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                             llm_requests=usage.successful_requests)
+            model = llm.model_name
+            metrics.inc("llm_requests_total", usage.successful_requests, model=model)
+            metrics.inc("llm_tokens_total", usage.prompt_tokens, model=model, kind="prompt")
+            metrics.inc("llm_tokens_total", usage.completion_tokens, model=model, kind="completion")
+            return result
+
+        def _invoke(self, inputs):
             q = inputs.get("input", "")
             chat_history = inputs.get("chat_history", [])
-            print(f"SimpleRAG: Processing query: '{q[:100]}...'")
-            docs = retrieve(q, chat_history)
-            print(f"SimpleRAG: Retrieved {len(docs)} documents")
+            log.debug("SimpleRAG: processing query: '%s...'", q[:100])
+            with tracing.span("retrieve"):
+                docs = retrieve(q, chat_history)
             if not docs:
-                print("SimpleRAG: No documents retrieved, returning 'I don't know' response")
+                log.info("SimpleRAG: no documents retrieved, returning 'I don't know' response")
                 return {"answer": "I don't know based on the uploaded documents. Please make sure you have uploaded PDF documents to this session.", "context": []}
-            answer = question_answer_chain.invoke({
-                "input": q,
-                "chat_history": chat_history,
-                "context": docs,
-            })
-            print(f"SimpleRAG: Generated answer: '{answer[:100]}...'")
+            with metrics.stage("generation"):
+                answer = question_answer_chain.invoke({
+                    "input": q,
+                    "chat_history": chat_history,
+                    "context": docs,
+                })
+            log.debug("SimpleRAG: generated answer: '%s...'", answer[:100])
             # create_stuff_documents_chain returns a string by default
             return {"answer": answer, "context": docs}
 
@@ -0,0 +1,177 @@
+"""Background reclaim worker for deleted sessions.
+
+Deleting a session only removes its row and records a reclaim job (the
+tombstone). This worker then removes the remote PDFs in bulk, drops the
+session's Mongo rows and deletes its vector files, retrying with backoff.
+Jobs stay in the ``reclaim_jobs`` collection so the backlog can be inspected.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+from .core import config
+from .cloud_storage import delete_resources
+from .db.mongo import get_db
+from .pdf_cache import pdf_cache
+from .rag import delete_session_vectors
+
+PENDING_STATUSES = ["pending", "retry"]
+# A job stuck in "running" for this long belongs to a worker that died mid-job
+STALE_RUNNING_AFTER = timedelta(minutes=10)
+
+_worker_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+_remote_slots: asyncio.Semaphore | None = None
+
+
+async def enqueue_session_reclaim(db, user_id: str, session_key: str, session_name: str) -> str:
+    now = datetime.utcnow()
+    res = await db.reclaim_jobs.insert_one({
+        "kind": "session",
+        "owner_id": user_id,
+        "session_key": session_key,
+        "name": session_name,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    })
+    if _wakeup is not None:
+        _wakeup.set()
+    return str(res.inserted_id)
+
+
+async def get_backlog(db, user_id: str | None = None) -> dict:
+    query = {} if user_id is None else {"owner_id": user_id}
+    counts = {}
+    jobs = []
+    async for job in db.reclaim_jobs.find(query).sort("created_at", -1).limit(100):
+        status = job.get("status", "pending")
+        counts[status] = counts.get(status, 0) + 1
+        if status != "done":
+            jobs.append({
+                "_id": str(job["_id"]),
+                "name": job.get("name"),
+                "status": status,
+                "attempts": job.get("attempts", 0),
+                "last_error": job.get("last_error"),
+                "created_at": job.get("created_at"),
+                "next_attempt_at": job.get("next_attempt_at"),
+            })
+    return {"counts": counts, "jobs": jobs}
+
+
+async def _destroy_remote_batch(public_ids: list[str]) -> None:
+    async with _remote_slots:
+        res = await delete_resources(public_ids)
+    failed = [pid for pid, status in (res.get("deleted") or {}).items() if status not in ("deleted", "not_found")]
+    if failed:
+        raise RuntimeError(f"Cloudinary could not delete {len(failed)} resources: {failed[:5]}")
+
+
+async def _reclaim_session(db, job: dict) -> int:
+    user_id = job["owner_id"]
+    session_key = job["session_key"]
+    query = {"owner_id": user_id, "session_key": session_key}
+
+    # Remote objects first: Mongo rows are the only record of their public ids
+    public_ids = []
+    document_ids = []
+    async for doc in db.documents.find(query, {"cloudinary_public_id": 1}):
+        document_ids.append(str(doc["_id"]))
+        if doc.get("cloudinary_public_id"):
+            public_ids.append(doc["cloudinary_public_id"])
+    batch_size = max(1, config.RECLAIM_BATCH_SIZE)
+    batches = [public_ids[i:i + batch_size] for i in range(0, len(public_ids), batch_size)]
+    await asyncio.gather(*[_destroy_remote_batch(b) for b in batches])
+
+    await db.messages.delete_many(query)
+    await db.documents.delete_many(query)
+    await run_in_threadpool(delete_session_vectors, user_id, session_key)
+    for document_id in document_ids:
+        pdf_cache.evict_document(document_id)
+    return len(public_ids)
+
+
+async def _claim_next_job(db) -> dict | None:
+    now = datetime.utcnow()
+    return await db.reclaim_jobs.find_one_and_update(
+        {"$or": [
+            {"status": {"$in": PENDING_STATUSES}, "next_attempt_at": {"$lte": now}},
+            {"status": "running", "locked_at": {"$lt": now - STALE_RUNNING_AFTER}},
+        ]},
+        {"$set": {"status": "running", "locked_at": now}, "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def run_pending_jobs(db) -> int:
+    """Process every job that is due; returns the number of jobs handled."""
+    handled = 0
+    while True:
+        job = await _claim_next_job(db)
+        if job is None:
+            return handled
+        handled += 1
+        try:
+            pdfs = await _reclaim_session(db, job)
+            await db.reclaim_jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {"status": "done", "finished_at": datetime.utcnow(), "pdfs": pdfs}, "$unset": {"last_error": ""}},
+            )
+            print(f"Reclaim: session {job['session_key']} of user {job['owner_id']} reclaimed ({pdfs} PDFs)")
+        except Exception as e:
+            attempts = job.get("attempts", 1)
+            failed = attempts >= config.RECLAIM_MAX_ATTEMPTS
+            backoff = timedelta(seconds=min(2 ** attempts * 5, 3600))
+            await db.reclaim_jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "status": "failed" if failed else "retry",
+                    "last_error": str(e)[:500],
+                    "next_attempt_at": datetime.utcnow() + backoff,
+                }},
+            )
+            print(f"Reclaim: job {job['_id']} attempt {attempts} failed ({e}){' - giving up' if failed else ''}")
+
+
+async def _worker_loop():
+    while True:
+        try:
+            await run_pending_jobs(await get_db())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Reclaim: worker error: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=config.RECLAIM_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def start_worker():
+    global _worker_task, _wakeup, _remote_slots
+    if _worker_task is not None:
+        return
+    db = await get_db()
+    await db.reclaim_jobs.create_index([("status", 1), ("next_attempt_at", 1)])
+    await db.reclaim_jobs.create_index("owner_id")
+    # Finished jobs are kept for a week for inspection
+    await db.reclaim_jobs.create_index("finished_at", expireAfterSeconds=7 * 24 * 3600)
+    _wakeup = asyncio.Event()
+    _remote_slots = asyncio.Semaphore(max(1, config.RECLAIM_CONCURRENCY))
+    _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    global _worker_task
+    if _worker_task is None:
+        return
+    _worker_task.cancel()
+    try:
+        await _worker_task
+    except asyncio.CancelledError:
+        pass
+    _worker_task = None
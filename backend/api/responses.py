@@ -0,0 +1,101 @@
+"""Compressed, conditional JSON responses for frequently re-fetched endpoints.
+
+``conditional_json`` answers ``If-None-Match`` / ``If-Modified-Since`` with
+304 before any body is built. Otherwise it serializes with orjson when it is
+installed and compresses bodies above ``RESPONSE_COMPRESS_MIN_BYTES`` with
+brotli (when installed and accepted) or gzip. Callers build the validator
+from cheap data (latest timestamp, row count) instead of the full payload.
+"""
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional
+from fastapi import Request
+from fastapi.responses import Response
+from .core import config
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as for GET
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return _utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+
+def _utc(dt: datetime) -> datetime:
+    # Mongo returns naive UTC datetimes
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _encode(request: Request, body: bytes) -> tuple[bytes, Optional[str]]:
+    if len(body) < config.RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    accept = request.headers.get("accept-encoding", "").lower()
+    if brotli is not None and "br" in accept:
+        return brotli.compress(body, quality=config.RESPONSE_BROTLI_QUALITY), "br"
+    if "gzip" in accept:
+        return gzip.compress(body, compresslevel=config.RESPONSE_GZIP_LEVEL), "gzip"
+    return body, None
+
+
+async def conditional_json(
+    request: Request,
+    route: str,
+    etag: str,
+    build: Callable[[], Awaitable[Any]],
+    last_modified: Optional[datetime] = None,
+) -> Response:
+    """304 when the client's copy is current, otherwise the (compressed) JSON from ``await build()``."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding, Authorization"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_utc(last_modified), usegmt=True)
+    if _not_modified(request, etag, last_modified):
+        metrics.inc("conditional_responses_total", route=route, status="304")
+        return Response(status_code=304, headers=headers)
+    body = dumps(await build())
+    encoded, encoding = _encode(request, body)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    metrics.inc("conditional_responses_total", route=route, status="200")
+    metrics.inc("response_bytes_total", len(body), route=route, stage="raw")
+    metrics.inc("response_bytes_total", len(encoded), route=route, stage="sent")
+    return Response(content=encoded, media_type="application/json", headers=headers)
@@ -2,7 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, Header, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import EmailStr
 from ..db.mongo import get_db
-from ..core.security import get_password_hash, verify_password, create_access_token, decode_token
+from ..core.security import get_password_hash_async, verify_password_async, create_access_token, decode_token
+from .. import metrics, tracing
 from ..models import UserCreate, UserLogin, TokenResponse
 from ..email_service import send_welcome_email
 from bson import ObjectId
@@ -14,7 +15,8 @@ async def get_current_user_id(authorization: str = Header(None)) -> str:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     token = authorization.split(" ", 1)[1]
-    user_id = decode_token(token)
+    with tracing.span("auth"):
+        user_id = decode_token(token)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
     return user_id
@@ -25,7 +27,7 @@ async def register(payload: UserCreate, background_tasks: BackgroundTasks):
     existing = await db.users.find_one({"email": payload.email})
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed = get_password_hash(payload.password)
+    hashed = await get_password_hash_async(payload.password)
     res = await db.users.insert_one({
         "name": payload.name,
         "email": payload.email,
@@ -42,8 +44,10 @@ async def register(payload: UserCreate, background_tasks: BackgroundTasks):
 async def login(payload: UserLogin):
     db = await get_db()
     user = await db.users.find_one({"email": payload.email})
-    if not user or not verify_password(payload.password, user.get("password", "")):
+    if not user or not await verify_password_async(payload.password, user.get("password", "")):
+        metrics.inc("auth_logins_total", result="failed")
         raise HTTPException(status_code=400, detail="Invalid credentials")
+    metrics.inc("auth_logins_total", result="ok")
     token = create_access_token(str(user["_id"]))
     return TokenResponse(access_token=token)
 
@@ -1,18 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from ..routes.auth import get_current_user_id
 from ..db.mongo import get_db
+from ..db.sessions import resolve_session_key
 from ..models import ChatRequest, ChatResponse
-from ..rag import build_conversational_chain, get_vectorstore_for_user
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import Runnable
+from ..rag import build_conversational_chain, document_filter, get_vectorstore_for_user
+from ..singleflight import SingleFlight
+from ..responses import conditional_json, make_etag
+from ..admission import query_admission
+from .. import metrics, profiling, tracing
+from langchain_core.chat_history import InMemoryChatMessageHistory as ChatMessageHistory
 import asyncio
+import logging
+from datetime import datetime
 from fastapi import Query
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
 user_histories = {}
+# Identical questions in flight (retries, double submits) share one pipeline run
+chat_flight = SingleFlight("chat")
 
 def get_history(user_id: str, session_id: str):
     key = f"{user_id}:{session_id}"
@@ -20,90 +29,13 @@ def get_history(user_id: str, session_id: str):
         user_histories[key] = ChatMessageHistory()
     return user_histories[key]
 
-@router.post("/ask", response_model=ChatResponse)
-async def ask(payload: ChatRequest, user_id: str = Depends(get_current_user_id)):
-    if not payload.message:
-        raise HTTPException(status_code=400, detail="Message cannot be empty")
-    if not payload.session_id:
-        raise HTTPException(status_code=400, detail="session_id is required")
-    history = get_history(user_id, payload.session_id)
-    # Quick guard: if no vectors exist for this session, refuse to answer
-    try:
-        print(f"Chat: Attempting to access vectorstore for user {user_id}, session '{payload.session_id}'")
-        vs = get_vectorstore_for_user(user_id, payload.session_id)
-        # Check if collection has any documents
-        collection = vs._collection
-        count = collection.count()
-        print(f"Chat: Vectorstore collection has {count} documents")
-        if count == 0:
-            print(f"Chat: No documents found in vectorstore for session '{payload.session_id}'")
-            # Check if this might be a renamed session - try to find documents in the original session
-            if not payload.session_id.startswith("Session "):
-                print(f"Chat: Attempting to find original session for renamed session '{payload.session_id}'...")
-                try:
-                    import re
-                    
-                    # Query MongoDB to find which original session this renamed session came from
-                    db = await get_db()
-                    
-                    # Look for documents in this renamed session to find the original session_id
-                    docs = []
-                    original_session_id = None
-                    async for doc in db.documents.find({"owner_id": user_id, "session_id": payload.session_id}):
-                        docs.append(doc)
-                        # Get the original_session_id from the first document
-                        if original_session_id is None and "original_session_id" in doc:
-                            original_session_id = doc["original_session_id"]
-                    
-                    if docs and original_session_id:
-                        print(f"Chat: Found {len(docs)} documents in MongoDB for session '{payload.session_id}' with original session '{original_session_id}'")
-                        
-                        # Try to use the original session's vectorstore
-                        try:
-                            vs_fallback = get_vectorstore_for_user(user_id, original_session_id)
-                            fallback_count = vs_fallback._collection.count()
-                            print(f"Chat: Original session '{original_session_id}' has {fallback_count} documents")
-                            if fallback_count > 0:
-                                print(f"Chat: Using fallback vectorstore from original session '{original_session_id}' for renamed session '{payload.session_id}'")
-                                chain = build_conversational_chain(user_id, history, session_id=original_session_id)
-                                result = chain.invoke({"input": payload.message, "chat_history": history.messages})
-                                answer = result.get("answer")
-                                sources = []
-                                for d in (result.get("context", []) or []):
-                                    meta = d.metadata or {}
-                                    sources.append({
-                                        "filename": meta.get("source") or meta.get("filename") or "",
-                                        "page": meta.get("page", meta.get("page_number")),
-                                        "score": meta.get("rrf_score") or meta.get("similarity") or None,
-                                        "snippet": (d.page_content or "")[:300]
-                                    })
-                                history.add_user_message(payload.message)
-                                history.add_ai_message(answer)
-                                await db.messages.insert_many([
-                                    {"owner_id": user_id, "session_id": payload.session_id, "role": "user", "content": payload.message, "ts": __import__('datetime').datetime.utcnow()},
-                                    {"owner_id": user_id, "session_id": payload.session_id, "role": "assistant", "content": answer, "ts": __import__('datetime').datetime.utcnow()},
-                                ])
-                                return ChatResponse(answer=answer, sources=sources)
-                        except Exception as session_error:
-                            print(f"Chat: Error accessing original session '{original_session_id}': {session_error}")
-                    else:
-                        print(f"Chat: No documents found in MongoDB for session '{payload.session_id}' or no original_session_id tracked")
-                    
-                    print(f"Chat: No suitable fallback session found for '{payload.session_id}'")
-                except Exception as fallback_error:
-                    print(f"Chat: Fallback attempt failed: {fallback_error}")
-            return ChatResponse(answer="I don't know based on the uploaded documents. Please upload a PDF document first.")
-    except Exception as e:
-        print(f"Chat: Vectorstore access error for user {user_id}, session '{payload.session_id}': {e}")
-        import traceback
-        traceback.print_exc()
-        return ChatResponse(answer="I don't know based on the uploaded documents. Please upload a PDF document first.")
-    chain = build_conversational_chain(user_id, history, session_id=payload.session_id)
-    result = chain.invoke({"input": payload.message, "chat_history": history.messages})
-    answer = result.get("answer")
-    # Extract citations from the retrieved context if available
+NO_DOCUMENTS_ANSWER = "I don't know based on the uploaded documents. Please upload a PDF document first."
+
+
+def sources_from_context(context) -> list[dict]:
+    # Extract citations from the retrieved context
     sources = []
-    for d in (result.get("context", []) or []):
+    for d in (context or []):
         meta = d.metadata or {}
         sources.append({
             "filename": meta.get("source") or meta.get("filename") or "",
@@ -111,45 +43,135 @@ async def ask(payload: ChatRequest, user_id: str = Depends(get_current_user_id))
             "score": meta.get("rrf_score") or meta.get("similarity") or None,
             "snippet": (d.page_content or "")[:300]
         })
+    return sources
+
+
+def count_session_chunks(user_id: str, session_key: str, document_ids) -> int:
+    # Opening a cold Chroma store blocks, so this runs in the threadpool
+    with tracing.span("vectorstore_guard") as span:
+        count = get_vectorstore_for_user(user_id, session_key).count(where=document_filter(document_ids))
+        if span is not None:
+            span.set(chunks=count)
+    return count
+
+
+async def session_has_chunks(user_id: str, session_key: str, document_ids) -> bool:
+    """Quick guard: without vectors for this session (or the chosen documents) there is nothing to answer from."""
+    try:
+        count = await run_in_threadpool(count_session_chunks, user_id, session_key, document_ids)
+    except Exception as e:
+        log.exception("Chat: vectorstore access error for user %s, session %s: %s", user_id, session_key, e)
+        return False
+    log.debug("Chat: vectorstore for session %s has %d chunks", session_key, count)
+    return count > 0
+
+
+async def run_pipeline(user_id: str, session_key: str, message: str, document_ids, guard: bool = False) -> dict:
+    history = get_history(user_id, session_key)
+    # Stage timings of this run; shared with coalesced duplicates through the result
+    timings = metrics.collect_timings()
+
+    def invoke():
+        chain = build_conversational_chain(user_id, history, session_id=session_key, document_ids=document_ids)
+        return chain.invoke({"input": message, "chat_history": history.messages})
+
+    # Retrieval and generation block, keep them off the event loop; one admission
+    # slot per logical question, coalesced duplicates do not take their own
+    async with query_admission.admit(user_id):
+        if guard and not await session_has_chunks(user_id, session_key, document_ids):
+            return {"answer": NO_DOCUMENTS_ANSWER, "sources": [], "timings": timings}
+        result = await run_in_threadpool(profiling.wrap(invoke))
+    answer = result.get("answer")
+    sources = sources_from_context(result.get("context", []))
     # ChatMessageHistory updates are handled by RunnableWithMessageHistory in Streamlit; here we emulate persistence in memory
-    history.add_user_message(payload.message)
+    history.add_user_message(message)
     history.add_ai_message(answer)
-    # Persist message to Mongo for this session
+    # Persist message to Mongo for this session, once per logical question
     db = await get_db()
-    await db.messages.insert_many([
-        {"owner_id": user_id, "session_id": payload.session_id, "role": "user", "content": payload.message, "ts": __import__('datetime').datetime.utcnow()},
-        {"owner_id": user_id, "session_id": payload.session_id, "role": "assistant", "content": answer, "ts": __import__('datetime').datetime.utcnow()},
-    ])
-    return ChatResponse(answer=answer, sources=sources) 
+    now = datetime.utcnow()
+    with metrics.stage("mongo_persist"):
+        await db.messages.insert_many([
+            {"owner_id": user_id, "session_key": session_key, "role": "user", "content": message, "ts": now},
+            {"owner_id": user_id, "session_key": session_key, "role": "assistant", "content": answer, "ts": now},
+        ])
+    return {"answer": answer, "sources": sources, "timings": timings}
+
+
+async def answer_question(user_id: str, session_key: str, message: str, document_ids, guard: bool = False) -> dict:
+    key = (user_id, session_key, message.strip(), tuple(sorted(d for d in (document_ids or []) if d)))
+    # The leader's pipeline spans nest under its own "answer" span
+    with tracing.span("answer"):
+        return await chat_flight.do(key, lambda: run_pipeline(user_id, session_key, message, document_ids, guard))
+
+
+@router.post("/ask", response_model=ChatResponse)
+async def ask(payload: ChatRequest, request: Request, response: Response, user_id: str = Depends(get_current_user_id)):
+    if not payload.message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    if not payload.session_id:
+        raise HTTPException(status_code=400, detail="session_id is required")
+    db = await get_db()
+    # The client addresses sessions by display name; storage is keyed by the immutable id
+    with tracing.span("resolve_session"):
+        session_key = await resolve_session_key(db, user_id, payload.session_id)
+    if not session_key:
+        log.info("Chat: unknown session '%s' for user %s", payload.session_id, user_id)
+        return ChatResponse(answer=NO_DOCUMENTS_ANSWER)
+    # The empty-session guard runs inside query admission, off the event loop
+    async with profiling.profile_request(request, db, user_id, "ask") as profile:
+        result = await answer_question(user_id, session_key, payload.message, payload.document_ids, guard=True)
+    response.headers["Server-Timing"] = metrics.server_timing(result["timings"])
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profile.profile_id
+    return ChatResponse(answer=result["answer"], sources=result["sources"])
+
 
 # Experimental: Server-sent events stream for typing animation
 @router.post("/ask_stream")
-async def ask_stream(payload: ChatRequest, user_id: str = Depends(get_current_user_id)):
+async def ask_stream(payload: ChatRequest, request: Request, user_id: str = Depends(get_current_user_id)):
     if not payload.message:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
-    history = get_history(user_id, payload.session_id)
-    chain = build_conversational_chain(user_id, history, session_id=payload.session_id)
+    db = await get_db()
+    with tracing.span("resolve_session"):
+        session_key = await resolve_session_key(db, user_id, payload.session_id)
+    if not session_key:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Resolve the answer before streaming so failures still surface as HTTP errors
+    async with profiling.profile_request(request, db, user_id, "ask_stream") as profile:
+        result = await answer_question(user_id, session_key, payload.message, payload.document_ids)
+    headers = {"Server-Timing": metrics.server_timing(result["timings"])}
+    if profile is not None:
+        headers["X-Profile-Id"] = profile.profile_id
 
     async def event_generator():
-        # Use the underlying LLM stream if supported through LangChain
         # Fallback: chunk the final answer to simulate streaming
-        result = chain.invoke({"input": payload.message, "chat_history": history.messages})
         text = result["answer"]
         chunk_size = 20
         for i in range(0, len(text), chunk_size):
             yield text[i:i+chunk_size]
             await asyncio.sleep(0.03)
-        history.add_user_message(payload.message)
-        history.add_ai_message(text)
 
-    return StreamingResponse(event_generator(), media_type="text/plain")
+    return StreamingResponse(event_generator(), media_type="text/plain", headers=headers)
 
 @router.get("/history")
-async def get_history_messages(session_id: str = Query(...), user_id: str = Depends(get_current_user_id)):
+async def get_history_messages(request: Request, session_id: str = Query(...), user_id: str = Depends(get_current_user_id)):
     db = await get_db()
-    out = []
-    async for m in db.messages.find({"owner_id": user_id, "session_id": session_id}).sort("ts", 1):
-        out.append({"role": m.get("role"), "content": m.get("content")})
-    return out
+    session_key = await resolve_session_key(db, user_id, session_id)
+    if not session_key:
+        return []
+    query = {"owner_id": user_id, "session_key": session_key}
+    # Validator from the newest message and the count (both served by the messages index)
+    latest = await db.messages.find_one(query, {"ts": 1}, sort=[("ts", -1), ("_id", -1)])
+    count = await db.messages.count_documents(query)
+    last_ts = latest.get("ts") if latest else None
+    etag = make_etag("history", user_id, session_key, count, last_ts, latest["_id"] if latest else None)
+
+    async def build():
+        out = []
+        async for m in db.messages.find(query, {"role": 1, "content": 1}).sort("ts", 1):
+            out.append({"role": m.get("role"), "content": m.get("content")})
+        return out
+
+    return await conditional_json(request, "chat_history", etag, build, last_modified=last_ts)
 
 
@@ -1,38 +1,56 @@
+import hashlib
+import logging
 import os
 import tempfile
-import requests
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
-from fastapi.responses import Response
+from datetime import datetime
+import httpx
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from ..routes.auth import get_current_user_id
 from ..db.mongo import get_db
+from ..db.sessions import resolve_session_key
 from bson import ObjectId
 from ..rag import index_pdf_for_user
+from ..admission import ingest_admission
+from ..responses import conditional_json, make_etag
+from ..pdf_cache import CHUNK_SIZE, iter_file, parse_range, pdf_cache
+from ..singleflight import SingleFlight
 from ..core import config
-from openai import OpenAI
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
-from cloudinary.utils import cloudinary_url
+from .. import cloud_storage, metrics, profiling, tracing
+from ..http_clients import get_async_client, get_async_openai
+from cloudinary.utils import private_download_url
 
 router = APIRouter()
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=config.CLOUDINARY_CLOUD_NAME,
-    api_key=config.CLOUDINARY_API_KEY,
-    api_secret=config.CLOUDINARY_API_SECRET,
-    secure=True
-)
+log = logging.getLogger(__name__)
+pdf_flight = SingleFlight("pdf")
 
 @router.post("/upload")
-async def upload_document(file: UploadFile = File(...), user_id: str = Depends(get_current_user_id), session_id: str | None = Form(None)):
+async def upload_document(request: Request, response: Response, file: UploadFile = File(...), user_id: str = Depends(get_current_user_id), session_id: str | None = Form(None)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    # Embedding is CPU and memory heavy: bounded per user and globally
+    async with ingest_admission.admit(user_id):
+        async with profiling.profile_request(request, await get_db(), user_id, "upload") as profile:
+            result = await ingest_document(file, user_id, session_id)
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profile.profile_id
+    return result
+
+
+async def ingest_document(file: UploadFile, user_id: str, session_id: str | None):
     db = await get_db()
     content = await file.read()
+    # Vector data is stored under the session's immutable key, not its display name
+    with tracing.span("resolve_session"):
+        session_key = await resolve_session_key(db, user_id, session_id, create=True)
+    tracing.annotate(bytes=len(content))
     
     # Insert document record first to get the ID
-    doc = {"owner_id": user_id, "session_id": session_id or "", "filename": file.filename, "size": len(content)}
+    # The content hash keys the local PDF cache and serves as the view ETag
+    content_sha256 = hashlib.sha256(content).hexdigest()
+    doc = {"owner_id": user_id, "session_key": session_key or "", "filename": file.filename, "size": len(content),
+           "content_sha256": content_sha256, "updated_at": datetime.utcnow()}
     res = await db.documents.insert_one(doc)
     doc_id = str(res.inserted_id)
     
@@ -44,14 +62,14 @@ async def upload_document(file: UploadFile = File(...), user_id: str = Depends(g
     try:
         # Upload to Cloudinary
         # Use user_id and doc_id in the public_id for organization and security
-        cloudinary_response = cloudinary.uploader.upload(
-            temp_path,
-            resource_type="raw",  # 'raw' type for PDFs
-            public_id=f"docfusion/{user_id}/{doc_id}",
-            folder="docfusion_pdfs",
-            overwrite=True,
-            tags=[user_id, session_id or "no_session"]
-        )
+        # 'raw' resource type for PDFs
+        with metrics.stage("cloud_upload"):
+            cloudinary_response = await cloud_storage.upload_raw(
+                temp_path,
+                public_id=f"docfusion/{user_id}/{doc_id}",
+                folder="docfusion_pdfs",
+                tags=[user_id, session_key or "no_session"]
+            )
         
         cloudinary_url = cloudinary_response.get("secure_url")
         cloudinary_public_id = cloudinary_response.get("public_id")
@@ -59,18 +77,26 @@ async def upload_document(file: UploadFile = File(...), user_id: str = Depends(g
         # Update document record with Cloudinary URL
         await db.documents.update_one(
             {"_id": ObjectId(doc_id)},
-            {"$set": {"cloudinary_url": cloudinary_url, "cloudinary_public_id": cloudinary_public_id}}
+            {"$set": {"cloudinary_url": cloudinary_url, "cloudinary_public_id": cloudinary_public_id, "resolved_url": cloudinary_url,
+                      "updated_at": datetime.utcnow()}}
         )
         
         # Index PDF for RAG
-        index_pdf_for_user(user_id, temp_path, session_id=session_id)
+        with tracing.span("index_pdf"):
+            await run_in_threadpool(profiling.wrap(index_pdf_for_user), user_id, temp_path, session_id=session_key, document_id=doc_id, filename=file.filename)
+
+        # Write-through: the first view is served locally
+        try:
+            await run_in_threadpool(pdf_cache.put_file, doc_id, temp_path, content_sha256)
+        except OSError as e:
+            log.warning("PDF cache write skipped for %s: %s", doc_id, e)
         
     except ValueError as e:
         # Clean up if indexing fails
         try:
             # Try to delete from Cloudinary if it was uploaded
             if 'cloudinary_public_id' in locals():
-                cloudinary.uploader.destroy(cloudinary_public_id, resource_type="raw")
+                await cloud_storage.destroy_raw(cloudinary_public_id)
         except:
             pass
         await db.documents.delete_one({"_id": ObjectId(doc_id)})
@@ -89,16 +115,32 @@ async def upload_document(file: UploadFile = File(...), user_id: str = Depends(g
     return {"_id": doc_id, "owner_id": user_id, "filename": file.filename, "size": len(content)}
 
 @router.get("")
-async def list_documents(user_id: str = Depends(get_current_user_id), session_id: str | None = None):
+async def list_documents(request: Request, user_id: str = Depends(get_current_user_id), session_id: str | None = None):
     db = await get_db()
-    docs = []
     query = {"owner_id": user_id}
     if session_id is not None:
-        query["session_id"] = session_id
-    async for d in db.documents.find(query).sort("_id", -1):
-        d["_id"] = str(d["_id"])
-        docs.append(d)
-    return docs
+        session_key = await resolve_session_key(db, user_id, session_id)
+        if not session_key:
+            return []
+        query["session_key"] = session_key
+    # Document version: row count, newest row and latest update
+    version = None
+    async for v in db.documents.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "n": {"$sum": 1}, "last_id": {"$max": "$_id"}, "updated": {"$max": "$updated_at"}}},
+    ]):
+        version = v
+    version = version or {}
+    etag = make_etag("documents", user_id, query.get("session_key"), version.get("n", 0), version.get("last_id"), version.get("updated"))
+
+    async def build():
+        docs = []
+        async for d in db.documents.find(query).sort("_id", -1):
+            d["_id"] = str(d["_id"])
+            docs.append(d)
+        return docs
+
+    return await conditional_json(request, "documents", etag, build, last_modified=version.get("updated"))
 
 @router.get("/test-cloudinary")
 async def test_cloudinary():
@@ -112,7 +154,7 @@ async def test_cloudinary():
         }
         
         # Test Cloudinary connection
-        test_result = cloudinary.api.ping()
+        test_result = await cloud_storage.ping()
         
         return {
             "status": "success",
@@ -130,9 +172,119 @@ async def test_cloudinary():
             }
         }
 
+def resolve_public_id(doc: dict) -> str:
+    # Get Cloudinary public_id from document
+    cloudinary_public_id = doc.get("cloudinary_public_id")
+    if cloudinary_public_id:
+        return cloudinary_public_id
+    # This document was uploaded before Cloudinary integration
+    # Check if it has a cloudinary_url as fallback
+    doc_cloudinary_url = doc.get("cloudinary_url")
+    if not doc_cloudinary_url:
+        # Document was uploaded before Cloudinary integration
+        # Return a helpful error message
+        raise HTTPException(
+            status_code=404,
+            detail="This document was uploaded before cloud storage integration. Please re-upload it to view."
+        )
+    # Extract public_id from URL
+    # URL format: https://res.cloudinary.com/cloud_name/image/upload/v1234567890/docfusion/user_id/doc_id.pdf
+    parts = doc_cloudinary_url.split('/')
+    if 'docfusion' not in parts:
+        raise HTTPException(status_code=404, detail="PDF file not found in cloud storage")
+    # Find the docfusion part and reconstruct public_id
+    return '/'.join(parts[parts.index('docfusion'):]).replace('.pdf', '')
+
+
+async def stream_into_cache(document_id: str, url: str) -> tuple[str, str]:
+    async with get_async_client().stream("GET", url, follow_redirects=True) as response:
+        response.raise_for_status()
+        return await pdf_cache.put_async_stream(document_id, response.aiter_bytes(CHUNK_SIZE))
+
+
+async def download_pdf(document_id: str, url: str, public_id: str) -> tuple[str, str]:
+    """Stream the remote PDF into the local cache; returns (sha256, cached path)."""
+    try:
+        return await stream_into_cache(document_id, url)
+    except httpx.HTTPError as e:
+        log.info("PDF download from delivery URL failed (%s), trying a signed download URL", e)
+    # Delivery of raw PDFs can be disabled on free accounts; signed API downloads still work
+    return await stream_into_cache(document_id, private_download_url(public_id, "", resource_type="raw"))
+
+
+async def fetch_into_cache(db, doc: dict) -> tuple[str, str]:
+    document_id = str(doc["_id"])
+    public_id = resolve_public_id(doc)
+    url = doc.get("resolved_url")
+    if not url:
+        # Use Cloudinary's admin API to resolve the delivery URL, once per document
+        resource_info = await cloud_storage.get_resource(public_id)
+        url = (resource_info or {}).get('secure_url')
+        if not url:
+            raise HTTPException(status_code=404, detail="PDF file not found in cloud storage")
+        await db.documents.update_one({"_id": doc["_id"]}, {"$set": {"resolved_url": url, "updated_at": datetime.utcnow()}})
+    sha256, path = await download_pdf(document_id, url, public_id)
+    if sha256 != doc.get("content_sha256"):
+        # Backfill documents uploaded before hashes were recorded
+        await db.documents.update_one({"_id": doc["_id"]}, {"$set": {"content_sha256": sha256, "updated_at": datetime.utcnow()}})
+    return sha256, path
+
+
+def pdf_headers(sha256: str, filename: str) -> dict:
+    return {
+        "ETag": f'"{sha256}"',
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'inline; filename="{filename}"',
+        "Cache-Control": "private, max-age=3600",
+    }
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")])
+
+
+def open_cached_pdf(document_id: str, sha256: str | None):
+    path = pdf_cache.path(document_id, sha256) if sha256 else None
+    if path is None:
+        return None
+    try:
+        # The handle stays valid even if the file is evicted while it is streamed
+        return open(path, "rb")
+    except FileNotFoundError:
+        # Evicted between the lookup and the open
+        return None
+
+
+def pdf_response(request: Request, f, sha256: str, filename: str):
+    headers = pdf_headers(sha256, filename)
+    etag = headers["ETag"]
+    if not_modified(request, etag):
+        f.close()
+        return Response(status_code=304, headers=headers)
+    size = os.fstat(f.fileno()).st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(f, start, end), status_code=status_code, media_type="application/pdf", headers=headers)
+
+
 @router.get("/{document_id}/view")
-async def view_document(document_id: str, user_id: str = Depends(get_current_user_id)):
-    """Fetch PDF from Cloudinary and serve it to the browser"""
+async def view_document(document_id: str, request: Request, user_id: str = Depends(get_current_user_id)):
+    """Serve a PDF from the local cache, fetching it from Cloudinary on a miss"""
     db = await get_db()
     
     # Verify document exists and belongs to user
@@ -143,102 +295,37 @@ async def view_document(document_id: str, user_id: str = Depends(get_current_use
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    
-    # Get Cloudinary public_id from document
-    cloudinary_public_id = doc.get("cloudinary_public_id")
-    
-    if not cloudinary_public_id:
-        # This document was uploaded before Cloudinary integration
-        # Check if it has a cloudinary_url as fallback
-        doc_cloudinary_url = doc.get("cloudinary_url")
-        if doc_cloudinary_url:
-            # Extract public_id from URL
-            try:
-                # URL format: https://res.cloudinary.com/cloud_name/image/upload/v1234567890/docfusion/user_id/doc_id.pdf
-                parts = doc_cloudinary_url.split('/')
-                if 'docfusion' in parts:
-                    # Find the docfusion part and reconstruct public_id
-                    docfusion_index = parts.index('docfusion')
-                    public_id_parts = parts[docfusion_index:]
-                    cloudinary_public_id = '/'.join(public_id_parts).replace('.pdf', '')
-                else:
-                    raise HTTPException(status_code=404, detail="PDF file not found in cloud storage")
-            except:
-                raise HTTPException(status_code=404, detail="PDF file not found in cloud storage")
-        else:
-            # Document was uploaded before Cloudinary integration
-            # Return a helpful error message
-            raise HTTPException(
-                status_code=404, 
-                detail="This document was uploaded before cloud storage integration. Please re-upload it to view."
-            )
-    
-    try:
-        # Use Cloudinary's admin API to download the file directly
-        # This works even when PDF delivery is disabled on free accounts
-        import cloudinary.api
-        
-        # Get the resource using admin API
-        resource_info = cloudinary.api.resource(
-            cloudinary_public_id,
-            resource_type="raw"
-        )
-        
-        # Get the secure URL from the resource info
-        secure_url = resource_info.get('secure_url')
-        if not secure_url:
-            raise HTTPException(status_code=404, detail="PDF file not found in cloud storage")
-        
-        # Download the file using the secure URL
-        response = requests.get(secure_url, timeout=30)
-        
-        if response.status_code != 200:
-            # If direct URL fails, try using the admin API to download the file content
-            try:
-                # Use admin API to get the file content directly
-                file_content = cloudinary.uploader.download(cloudinary_public_id, resource_type="raw")
-                
-                return Response(
-                    content=file_content,
-                    media_type="application/pdf",
-                    headers={
-                        "Content-Disposition": f'inline; filename="{doc.get("filename", "document.pdf")}"',
-                        "Cache-Control": "public, max-age=3600"
-                    }
-                )
-            except Exception as download_error:
-                raise HTTPException(status_code=404, detail="Failed to retrieve PDF from cloud storage")
-        
-        # Return the PDF with proper headers for inline viewing
-        return Response(
-            content=response.content,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'inline; filename="{doc.get("filename", "document.pdf")}"',
-                "Cache-Control": "public, max-age=3600"
-            }
-        )
-        
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching document: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+
+    sha256 = doc.get("content_sha256")
+    filename = doc.get("filename", "document.pdf")
+    # Revalidation is answered from the recorded hash, before the cache or Cloudinary
+    if sha256 and not_modified(request, f'"{sha256}"'):
+        return Response(status_code=304, headers=pdf_headers(sha256, filename))
+    f = open_cached_pdf(document_id, sha256)
+    if f is None:
+        try:
+            # Concurrent misses for the same document share one download
+            sha256, path = await pdf_flight.do(document_id, lambda: fetch_into_cache(db, doc))
+        except HTTPException:
+            raise
+        except (httpx.HTTPError, cloud_storage.CloudStorageError) as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching document: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+        f = open(path, "rb")
+    return pdf_response(request, f, sha256, filename)
 
 @router.post("/reembed_all")
 async def reembed_all(user_id: str = Depends(get_current_user_id)):
     """Clear all Chroma databases for the current user to force re-indexing with new embedding model."""
-    from ..rag import get_user_chroma_dir
-    import shutil
-    import os
+    from ..rag import delete_user_vectors
     
     # Clear all user's Chroma data
-    user_base_dir = get_user_chroma_dir(user_id, None)
     try:
-        if os.path.exists(user_base_dir):
-            shutil.rmtree(user_base_dir)
-            print(f"Cleared Chroma database for user {user_id}")
+        delete_user_vectors(user_id)
+        log.info("Cleared vector data for user %s", user_id)
     except Exception as e:
-        print(f"Error clearing Chroma database: {e}")
+        log.exception("Error clearing vector data for user %s: %s", user_id, e)
     
     return {"status": "cleared", "message": "All Chroma databases cleared. Please re-upload your PDFs to re-index with the new embedding model."}
 
@@ -250,10 +337,9 @@ async def suggest_session_name(user_id: str = Depends(get_current_user_id)):
         titles.append(d.get("filename", ""))
     if not titles:
         return {"name": "New Chat"}
-    client = OpenAI(api_key=config.OPENAI_API_KEY)
     prompt = "Generate a short, 3-5 word session name summarizing these PDFs: " + ", ".join(titles)
     try:
-        resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role":"user","content":prompt}], temperature=0.5)
+        resp = await get_async_openai().chat.completions.create(model="gpt-4o-mini", messages=[{"role":"user","content":prompt}], temperature=0.5)
         name = resp.choices[0].message.content.strip().strip('"')
         return {"name": name[:60] or "New Chat"}
     except Exception:
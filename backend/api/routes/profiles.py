@@ -0,0 +1,26 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+from ..routes.auth import get_current_user_id
+from ..core import config
+from .. import profiling
+
+router = APIRouter()
+
+
+@router.get("/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("raw", pattern="^(raw|text)$"), user_id: str = Depends(get_current_user_id)):
+    """A stored request profile: the raw pstats / collapsed-stacks file, or a text report."""
+    if not config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    found = await run_in_threadpool(profiling.load_profile, profile_id)
+    # Profiles of other users' requests are reported as missing
+    if not found or found[0].get("user_id") != user_id or found[1] is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    meta, path = found
+    if format == "text":
+        if meta.get("mode") == "cprofile":
+            return PlainTextResponse(await run_in_threadpool(profiling.render_pstats, path))
+        return PlainTextResponse(await run_in_threadpool(profiling.read_text, path))
+    return FileResponse(path, filename=os.path.basename(path), media_type="application/octet-stream")
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from bson import ObjectId
+from ..routes.auth import get_current_user_id
+from ..db.mongo import get_db
+from ..core import config
+from .. import doc_router
+from ..rag import get_embeddings, get_user_chroma_dir, get_vectorstore_for_user
+
+router = APIRouter()
+log = logging.getLogger(__name__)
+
+# Dedicated pool so a user-wide search cannot take every threadpool worker
+_executor = ThreadPoolExecutor(max_workers=max(1, config.CROSS_SEARCH_WORKERS), thread_name_prefix="cross-search")
+# One slot per pool worker, held until the worker is done: a store job only gets
+# submitted when a worker is free, so its timeout never counts time spent queued
+_slots: asyncio.Semaphore | None = None
+
+
+def search_session(user_id: str, session_key: str, query_vector, k: int) -> list[tuple]:
+    vs = get_vectorstore_for_user(user_id, session_key)
+    if vs.count() == 0:
+        return []
+    # Both backends report cosine similarity, so scores are comparable across sessions
+    return vs.similarity_search_by_vector_with_score(query_vector, k=k)
+
+
+def select_sessions(user_id: str, session_keys, query_vector) -> tuple[list[str], int]:
+    """Sessions worth opening, from each session's document centroids, and the number skipped."""
+    targets = []
+    skipped = 0
+    for session_key in session_keys:
+        router_data = doc_router.load_router(get_user_chroma_dir(user_id, session_key))
+        best = doc_router.best_score(router_data, query_vector)
+        if best is not None and best < config.CROSS_SEARCH_MIN_SCORE:
+            skipped += 1
+            continue
+        targets.append(session_key)
+    return targets, skipped
+
+
+async def run_timed(fn, *args):
+    """Run fn on the search pool once a worker is free; the timeout starts with the run."""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, config.CROSS_SEARCH_WORKERS))
+    await _slots.acquire()
+    future = asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    # A timed-out job keeps its worker busy, so its slot is released only when it ends
+    future.add_done_callback(lambda _: _slots.release())
+    return await asyncio.wait_for(asyncio.shield(future), timeout=config.CROSS_SEARCH_TIMEOUT)
+
+
+@router.get("")
+async def search_all_sessions(
+    q: str = Query(..., min_length=1),
+    k: int = Query(10, ge=1, le=50),
+    user_id: str = Depends(get_current_user_id),
+):
+    """Search every session of the current user and return merged session/document/page hits."""
+    t0 = time.perf_counter()
+    db = await get_db()
+    sessions = {}
+    async for s in db.sessions.find({"owner_id": user_id}, {"name": 1}):
+        sessions[str(s["_id"])] = s.get("name", "New Chat")
+    if not sessions:
+        return {"query": q, "hits": [], "sessions": [], "searched": 0, "skipped": 0, "timed_out": 0}
+
+    query_vector = await run_in_threadpool(get_embeddings().embed_query, q)
+
+    # Per-user summary: each session's document centroids. Sessions whose best
+    # document clearly cannot match are not opened at all.
+    targets, skipped = await run_in_threadpool(select_sessions, user_id, list(sessions), query_vector)
+
+    results = await asyncio.gather(
+        *[run_timed(search_session, user_id, key, query_vector, k) for key in targets], return_exceptions=True
+    )
+
+    hits = []
+    timed_out = 0
+    for session_key, result in zip(targets, results):
+        if isinstance(result, asyncio.TimeoutError):
+            timed_out += 1
+            log.warning("Search: session %s timed out after %ss", session_key, config.CROSS_SEARCH_TIMEOUT)
+            continue
+        if isinstance(result, Exception):
+            log.warning("Search: session %s failed: %s", session_key, result)
+            continue
+        for d, score in result:
+            meta = d.metadata or {}
+            hits.append({
+                "session": sessions[session_key],
+                "session_key": session_key,
+                "document_id": meta.get("document_id"),
+                "page": meta.get("page", meta.get("page_number")),
+                "score": round(float(score), 4),
+                "snippet": (d.page_content or "")[:300],
+            })
+    # Fusion on the raw scores: every store is searched with the same embedding model
+    # and reports cosine similarity (Chroma distances are converted), so scores are
+    # already on one scale. Per-session min-max or rank fusion would lift the best
+    # hit of an unrelated session to par with the best hit of a relevant one
+    hits.sort(key=lambda h: h["score"], reverse=True)
+    hits = hits[:k]
+
+    # Resolve filenames for the winning hits in one query
+    doc_ids = {h["document_id"] for h in hits if h["document_id"] and ObjectId.is_valid(h["document_id"])}
+    filenames = {}
+    if doc_ids:
+        async for d in db.documents.find({"_id": {"$in": [ObjectId(i) for i in doc_ids]}, "owner_id": user_id}, {"filename": 1}):
+            filenames[str(d["_id"])] = d.get("filename", "")
+    per_session = {}
+    for h in hits:
+        h["filename"] = filenames.get(h["document_id"], "")
+        summary = per_session.setdefault(h["session_key"], {"session": h["session"], "session_key": h["session_key"], "best_score": h["score"], "hits": 0})
+        summary["hits"] += 1
+
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    log.info("Search: %d sessions searched, %d skipped, %d timed out in %.1fms", len(targets), skipped, timed_out, elapsed_ms)
+    return {
+        "query": q,
+        "hits": hits,
+        "sessions": list(per_session.values()),
+        "searched": len(targets),
+        "skipped": skipped,
+        "timed_out": timed_out,
+    }
@@ -1,32 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Request
 from bson import ObjectId
 from ..routes.auth import get_current_user_id
 from ..db.mongo import get_db
-from ..core import config
-from openai import OpenAI
-from ..rag import get_user_chroma_dir
-import shutil
-import os
-import cloudinary
-import cloudinary.uploader
+from ..reclaim import enqueue_session_reclaim, get_backlog
+from .chat import user_histories
+from ..http_clients import get_async_openai
+from ..responses import conditional_json, make_etag
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=config.CLOUDINARY_CLOUD_NAME,
-    api_key=config.CLOUDINARY_API_KEY,
-    api_secret=config.CLOUDINARY_API_SECRET,
-    secure=True
-)
+log = logging.getLogger(__name__)
 
 @router.get("")
-async def list_sessions(user_id: str = Depends(get_current_user_id)):
+async def list_sessions(request: Request, user_id: str = Depends(get_current_user_id)):
     db = await get_db()
     out = []
-    async for s in db.sessions.find({"owner_id": user_id}).sort("_id", -1):
+    async for s in db.sessions.find({"owner_id": user_id}, {"name": 1}).sort("_id", -1):
         out.append({"_id": str(s["_id"]), "name": s.get("name", "New Chat")})
-    return out
+
+    async def build():
+        return out
+
+    # The projected list is tiny; its own content is the validator
+    return await conditional_json(request, "sessions", make_etag("sessions", user_id, out), build)
 
 @router.post("/new")
 async def create_session(payload: dict | None = None, user_id: str = Depends(get_current_user_id)):
@@ -51,7 +48,7 @@ async def create_session(payload: dict | None = None, user_id: str = Depends(get
             
             if session_num is not None:
                 existing_numbers.append(session_num)
-                print(f"DEBUG: Found session '{session_name}' with session_number: {session_num}")
+                log.debug("Found session '%s' with session_number: %s", session_name, session_num)
             else:
                 # Handle legacy sessions without session_number field
                 # Try to extract from name if it follows "Session N" pattern
@@ -59,7 +56,7 @@ async def create_session(payload: dict | None = None, user_id: str = Depends(get
                     try:
                         legacy_num = int(session_name.replace("Session ", ""))
                         existing_numbers.append(legacy_num)
-                        print(f"DEBUG: Legacy session '{session_name}' -> session_number: {legacy_num}")
+                        log.debug("Legacy session '%s' -> session_number: %s", session_name, legacy_num)
                         # Update the session to include session_number for future consistency
                         await db.sessions.update_one(
                             {"_id": session["_id"]},
@@ -68,10 +65,10 @@ async def create_session(payload: dict | None = None, user_id: str = Depends(get
                     except ValueError:
                         pass
                 else:
-                    print(f"DEBUG: Non-Session session found: '{session_name}' (ignoring for numbering)")
+                    log.debug("Non-Session session found: '%s' (ignoring for numbering)", session_name)
         
-        print(f"DEBUG: All existing sessions: {existing_sessions}")
-        print(f"DEBUG: All existing session_numbers: {existing_numbers}")
+        log.debug("All existing sessions: %s", existing_sessions)
+        log.debug("All existing session_numbers: %s", existing_numbers)
         
         # Find the lowest available number (fill gaps)
         # Start from 2 to avoid confusion with renamed "Session 1"
@@ -80,7 +77,7 @@ async def create_session(payload: dict | None = None, user_id: str = Depends(get
             n += 1
         
         name = f"Session {n}"
-        print(f"DEBUG: Creating new session with number: {n}, name: '{name}'")
+        log.debug("Creating new session with number: %d, name: '%s'", n, name)
     
     try:
         session_data = {"owner_id": user_id, "name": name}
@@ -111,72 +108,36 @@ async def suggest_from_chat(payload: dict, user_id: str = Depends(get_current_us
     messages = payload.get("messages", [])
     if not messages:
         return {"name": "New Chat"}
-    client = OpenAI(api_key=config.OPENAI_API_KEY)
     prompt = (
         "You are titling a chat thread. Given the following last 2-3 exchanges, "
         "produce a short 3-5 word title that captures the topic (no quotes).\n\n"
         + "\n\n".join([f"{m.get('role')}: {m.get('content')}" for m in messages[-6:]])
     )
     try:
-        resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role":"user","content":prompt}], temperature=0.5)
+        resp = await get_async_openai().chat.completions.create(model="gpt-4o-mini", messages=[{"role":"user","content":prompt}], temperature=0.5)
         name = resp.choices[0].message.content.strip().strip('"')
         return {"name": name[:60] or "New Chat"}
     except Exception:
         return {"name": "New Chat"}
 
+@router.get("/reclaim")
+async def reclaim_backlog(user_id: str = Depends(get_current_user_id)):
+    """Inspect this user's pending and failed session deletions."""
+    db = await get_db()
+    return await get_backlog(db, user_id)
+
 @router.delete("/{session_name}")
 async def delete_session(session_name: str, user_id: str = Depends(get_current_user_id)):
     db = await get_db()
-    
-    # First, get all documents for this session to delete from Cloudinary
-    documents = []
-    async for doc in db.documents.find({"owner_id": user_id, "session_id": session_name}):
-        documents.append(doc)
-    
-    # Delete PDFs from Cloudinary
-    for doc in documents:
-        cloudinary_public_id = doc.get("cloudinary_public_id")
-        if cloudinary_public_id:
-            try:
-                cloudinary.uploader.destroy(cloudinary_public_id, resource_type="raw")
-                print(f"Deleted PDF from Cloudinary: {cloudinary_public_id}")
-            except Exception as e:
-                print(f"Warning: Could not delete PDF from Cloudinary: {cloudinary_public_id}, Error: {e}")
-    
-    # Remove session record
-    await db.sessions.delete_many({"owner_id": user_id, "name": session_name})
-    
-    # Remove messages
-    await db.messages.delete_many({"owner_id": user_id, "session_id": session_name})
-    
-    # Remove documents metadata for this session
-    await db.documents.delete_many({"owner_id": user_id, "session_id": session_name})
-    
-    # Remove per-session Chroma directory (embeddings)
-    chroma_dir = get_user_chroma_dir(user_id, session_name)
-    try:
-        if os.path.isdir(chroma_dir):
-            # Try multiple times with delays to handle file locks
-            import time
-            for attempt in range(3):
-                try:
-                    shutil.rmtree(chroma_dir, ignore_errors=True)
-                    print(f"Deleted ChromaDB directory: {chroma_dir}")
-                    break
-                except Exception as e:
-                    if attempt < 2:
-                        print(f"Attempt {attempt + 1} failed, retrying in 0.5s: {e}")
-                        time.sleep(0.5)
-                    else:
-                        print(f"Warning: Could not delete ChromaDB directory after 3 attempts: {e}")
-    except Exception as e:
-        print(f"Warning: Could not delete ChromaDB directory: {e}")
-    
-    return {"status": "deleted", "cleaned_up": {
-        "pdfs": len(documents),
-        "messages": "deleted",
-        "chroma_db": "deleted"
-    }}
+    session = await db.sessions.find_one_and_delete({"owner_id": user_id, "name": session_name})
+    if not session:
+        return {"status": "deleted", "reclaim_job": None}
+    session_key = str(session["_id"])
+    user_histories.pop(f"{user_id}:{session_key}", None)
+    # Removing the session row hides it immediately; PDFs, messages, documents and
+    # vector files are reclaimed in the background
+    job_id = await enqueue_session_reclaim(db, user_id, session_key, session_name)
+    return {"status": "deleted", "reclaim_job": job_id}
 
 @router.post("/rename_by_name")
 async def rename_by_name(payload: dict, user_id: str = Depends(get_current_user_id)):
@@ -184,48 +145,17 @@ async def rename_by_name(payload: dict, user_id: str = Depends(get_current_user_
     new_name = (payload or {}).get("new_name")
     if not old_name or not new_name:
         raise HTTPException(status_code=400, detail="old_name and new_name are required")
+    if old_name == new_name:
+        return {"status": "renamed", "name": new_name}
     db = await get_db()
-    # Update session document (create if missing)
-    existing = await db.sessions.find_one({"owner_id": user_id, "name": old_name})
-    if existing:
-        await db.sessions.update_one({"_id": existing["_id"]}, {"$set": {"name": new_name}})
-    else:
-        await db.sessions.insert_one({"owner_id": user_id, "name": new_name})
-    # Update references - but keep track of original session for fallback purposes
-    await db.messages.update_many({"owner_id": user_id, "session_id": old_name}, {"$set": {"session_id": new_name, "original_session_id": old_name}})
-    await db.documents.update_many({"owner_id": user_id, "session_id": old_name}, {"$set": {"session_id": new_name, "original_session_id": old_name}})
-    # Rename chroma dir if exists and clear vectorstore cache by moving directory
-    old_dir = get_user_chroma_dir(user_id, old_name)
-    new_dir = get_user_chroma_dir(user_id, new_name)
+    # Messages, documents and vector data are keyed by the session's immutable id,
+    # so a rename is a single update of the display name
+    existing = await db.sessions.find_one({"owner_id": user_id, "name": old_name}, {"_id": 1})
     try:
-        if os.path.isdir(old_dir):
-            print(f"Session rename: Moving Chroma directory from '{old_dir}' to '{new_dir}'")
-            os.makedirs(os.path.dirname(new_dir), exist_ok=True)
-            
-            # Copy instead of move to avoid file lock issues with Chroma databases
-            import shutil
-            try:
-                shutil.copytree(old_dir, new_dir, dirs_exist_ok=True)
-                print(f"Session rename: Successfully copied Chroma directory to new location")
-                
-                # Try to remove the old directory after a small delay
-                import time
-                time.sleep(0.5)  # Give Chroma time to release file locks
-                try:
-                    shutil.rmtree(old_dir)
-                    print(f"Session rename: Successfully removed old Chroma directory")
-                except Exception as cleanup_error:
-                    print(f"Session rename: Warning - Could not remove old directory (will be cleaned up later): {cleanup_error}")
-                    
-            except Exception as e:
-                print(f"Session rename: Error copying Chroma directory: {e}")
-                raise e
+        if existing:
+            await db.sessions.update_one({"_id": existing["_id"]}, {"$set": {"name": new_name}})
         else:
-            print(f"Session rename: Old Chroma directory '{old_dir}' does not exist")
-    except Exception as e:
-        print(f"Session rename: Error moving Chroma directory: {e}")
-        import traceback
-        traceback.print_exc()
+            await db.sessions.insert_one({"owner_id": user_id, "name": new_name})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"Session '{new_name}' already exists")
     return {"status": "renamed", "name": new_name}
-
-
@@ -1,7 +1,19 @@
+import time
+_import_started = time.perf_counter()
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import auth, documents, chat, sessions
-from .db.mongo import ensure_indexes
+from .routes import auth, documents, chat, sessions, search, profiles
+from .db.mongo import ensure_indexes, get_db
+from . import metrics, startup, tracing
+from .core import config
+from .db.sessions import migrate_legacy_sessions
+from .reclaim import start_worker, stop_worker
+from .http_clients import close_http_clients, publish_pool_metrics, start_http_clients
+
+startup.record_phase("server_import", time.perf_counter() - _import_started)
+
+tracing.configure_logging()
 
 app = FastAPI(title="Persona RAG API", version="1.0.0")
 
@@ -11,12 +23,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing", "X-Profile-Id"],
 )
+# Outermost, so the trace covers CORS handling and every route
+app.add_middleware(tracing.TracingMiddleware)
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(sessions.router, prefix="/api/sessions", tags=["sessions"])
+app.include_router(search.router, prefix="/api/search", tags=["search"])
+app.include_router(profiles.router, prefix="/api/profiles", tags=["profiles"])
 
 @app.get("/")
 async def root():
@@ -27,9 +44,44 @@ async def root():
 async def health():
     return {"status": "ok"}
 
+@app.get("/api/startup")
+async def startup_profile():
+    """Import/startup timings and warmup progress."""
+    return startup.profile
+
+@app.get("/api/stats")
+async def stats():
+    """In-process counters and latency summaries (query paths, caches, queues)."""
+    publish_pool_metrics()
+    return metrics.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """The same series in the Prometheus text format, for scraping."""
+    publish_pool_metrics()
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.on_event("startup")
 async def on_startup():
+    t0 = time.perf_counter()
+    await start_http_clients()
     await ensure_indexes()
-    print("✓ Server started - embedding model will load on first document upload")
-
+    try:
+        await migrate_legacy_sessions(await get_db())
+    except Exception as e:
+        print(f"⚠️ Session storage migration failed: {e}")
+    await start_worker()
+    startup.record_phase("startup_hooks", time.perf_counter() - t0)
+    startup.mark_ready(_import_started)
+    if config.WARMUP_ON_STARTUP:
+        # Health checks are answered while models load in the background
+        startup.profile["warmup"]["state"] = "pending"
+        startup.start_warmup()
+        print("✓ Server started - warming up models in the background")
+    else:
+        print("✓ Server started - embedding model will load on first document upload")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_worker()
+    await close_http_clients()
@@ -0,0 +1,42 @@
+"""Single-flight request coalescing.
+
+Concurrent calls with the same key share one in-flight computation: the first
+caller starts it and every caller, including duplicates that arrive while it
+runs, receives the same result (or exception). The work runs as its own task,
+so a caller that disconnects does not cancel it for the others.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+from . import metrics, tracing
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            metrics.inc("singleflight_requests_total", group=self.name, role="leader")
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            metrics.inc("singleflight_requests_total", group=self.name, role="follower")
+            tracing.annotate(coalesced=True)
+            log.debug("SingleFlight[%s]: joined in-flight request (%d in flight)", self.name, len(self._inflight))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
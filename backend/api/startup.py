@@ -0,0 +1,71 @@
+"""Startup profile and opt-in warmup.
+
+The server records how long its own imports and startup hooks take, and
+which heavy dependencies were already loaded when it became ready (ideally
+none). With ``WARMUP_ON_STARTUP`` enabled, a background task then imports
+the heavy modules and loads the embedding model while health checks are
+already being answered, timing each step.
+"""
+import asyncio
+import importlib
+import sys
+import time
+from fastapi.concurrency import run_in_threadpool
+from . import metrics
+
+# Imported lazily behind the RAG entry points; listed in load order
+HEAVY_MODULES = (
+    "langchain_text_splitters",
+    "langchain_community.document_loaders",
+    "langchain_openai",
+    "langchain.chains.combine_documents",
+    "langchain_chroma",
+    "langchain_huggingface",
+)
+
+profile = {"phases": {}, "heavy_loaded_at_ready": [], "modules_at_ready": 0, "warmup": {"state": "disabled", "steps": {}}}
+_warmup_task: asyncio.Task | None = None
+
+
+def record_phase(name: str, seconds: float) -> None:
+    profile["phases"][name] = round(seconds, 4)
+    metrics.gauge("startup_seconds", seconds, phase=name)
+    print(f"Startup: {name} took {seconds * 1000:.0f}ms")
+
+
+def mark_ready(started_at: float) -> None:
+    record_phase("ready", time.perf_counter() - started_at)
+    profile["modules_at_ready"] = len(sys.modules)
+    profile["heavy_loaded_at_ready"] = [m for m in HEAVY_MODULES if m in sys.modules]
+
+
+def _warmup() -> None:
+    steps = profile["warmup"]["steps"]
+    for module in HEAVY_MODULES:
+        t0 = time.perf_counter()
+        importlib.import_module(module)
+        steps[f"import {module}"] = round(time.perf_counter() - t0, 4)
+    from .rag import get_embeddings
+    t0 = time.perf_counter()
+    get_embeddings().embed_query("warmup")
+    steps["embedding model"] = round(time.perf_counter() - t0, 4)
+
+
+async def _run_warmup() -> None:
+    profile["warmup"]["state"] = "running"
+    t0 = time.perf_counter()
+    try:
+        await run_in_threadpool(_warmup)
+        profile["warmup"]["state"] = "done"
+    except Exception as e:
+        profile["warmup"]["state"] = f"failed: {e}"
+        print(f"⚠️ Warmup failed: {e}")
+    elapsed = time.perf_counter() - t0
+    profile["warmup"]["seconds"] = round(elapsed, 4)
+    metrics.gauge("startup_seconds", elapsed, phase="warmup")
+    print(f"Startup: warmup {profile['warmup']['state']} in {elapsed:.1f}s")
+
+
+def start_warmup() -> None:
+    global _warmup_task
+    _warmup_task = asyncio.create_task(_run_warmup())
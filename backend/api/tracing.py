@@ -0,0 +1,238 @@
+"""Per-request tracing: a request id, a tree of timed spans and leveled logs.
+
+``TracingMiddleware`` starts a trace for every API request, taking the id
+from ``X-Request-ID`` (or generating one) and echoing it on the response.
+Code opens nested spans with ``span(name, **attributes)``; ``metrics.stage()``
+opens one too, so every timed pipeline stage shows up in the tree. Spans and
+the trace live in context variables, which ``run_in_threadpool`` copies, so
+work done in worker threads nests under the request that started it.
+
+When a trace ends it is written as one JSON line to a rotating local file if
+it was sampled (``TRACE_SAMPLE_RATE``), failed, or took at least
+``TRACE_SLOW_MS``. Log records from the ``api`` loggers are attached to the
+current span as events; on the console, INFO and below are only printed for
+sampled requests while warnings and errors always are.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+from .core import config
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "attributes", "children", "events", "error")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.children: list[Span] = []
+        self.events: list[dict] = []
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self, origin: float) -> dict:
+        out = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 3),
+        }
+        if self.attributes:
+            out["attributes"] = self.attributes
+        if self.error:
+            out["error"] = self.error
+        if self.events:
+            out["events"] = self.events
+        if self.children:
+            out["children"] = [c.to_dict(origin) for c in self.children]
+        return out
+
+
+class Trace:
+    def __init__(self, request_id: str, name: str, attributes: dict):
+        self.request_id = request_id
+        self.started_at = time.time()
+        self.root = Span(name, attributes)
+        # Head decision, used for console logs while the request runs
+        self.sampled = random.random() < config.TRACE_SAMPLE_RATE
+
+    def should_write(self) -> bool:
+        # Tail decision: keep sampled, failed and slow requests
+        duration_ms = ((self.root.end or time.perf_counter()) - self.root.start) * 1000
+        return self.sampled or self.root.error is not None or duration_ms >= config.TRACE_SLOW_MS
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "timestamp": self.started_at,
+            "sampled": self.sampled,
+            "root": self.root.to_dict(self.root.start),
+        }
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+_child_lock = threading.Lock()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+def current_span() -> Optional[Span]:
+    return _span.get()
+
+
+def annotate(**attributes: Any) -> None:
+    """Add attributes to the innermost open span (no-op outside a trace)."""
+    s = _span.get()
+    if s is not None:
+        s.set(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    parent = _span.get()
+    if parent is None:
+        # Not inside a traced request (startup, background workers)
+        yield None
+        return
+    s = Span(name, attributes)
+    with _child_lock:
+        # Spans may be opened from several worker threads at once
+        parent.children.append(s)
+    token = _span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _span.reset(token)
+
+
+# Finished traces, one JSON object per line; rotated by size
+_sink = logging.getLogger("api.tracing.sink")
+_sink.propagate = False
+_sink.setLevel(logging.INFO)
+
+
+def _open_sink() -> None:
+    if _sink.handlers or not config.TRACE_FILE:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(config.TRACE_FILE)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        config.TRACE_FILE, maxBytes=config.TRACE_FILE_MAX_MB * 1024 * 1024,
+        backupCount=config.TRACE_FILE_BACKUPS, encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _sink.addHandler(handler)
+
+
+def _write(trace: Trace) -> None:
+    _open_sink()
+    if _sink.handlers:
+        _sink.info(json.dumps(trace.to_dict(), default=str, separators=(",", ":")))
+
+
+class TracingMiddleware:
+    """ASGI middleware: one trace per ``/api`` request, id echoed as ``X-Request-ID``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        trace = Trace(request_id, f"{scope['method']} {scope['path']}", {"method": scope["method"], "path": scope["path"]})
+        trace_token = _trace.set(trace)
+        span_token = _span.set(trace.root)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.set(status=message["status"])
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except BaseException as e:
+            trace.root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            trace.root.end = time.perf_counter()
+            _span.reset(span_token)
+            _trace.reset(trace_token)
+            if trace.root.attributes.get("status", 200) >= 500:
+                trace.root.error = trace.root.error or "server error"
+            if trace.should_write():
+                try:
+                    _write(trace)
+                except Exception as e:
+                    logging.getLogger(__name__).warning("Trace write failed: %s", e)
+
+
+class _RequestFilter(logging.Filter):
+    """Tag records with the request id; drop unsampled low-level console output."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _trace.get()
+        record.request_id = trace.request_id if trace else "-"
+        if record.levelno >= logging.WARNING or trace is None:
+            return True
+        return trace.sampled
+
+
+class _SpanEventHandler(logging.Handler):
+    """Attach every log record to the current span, sampled or not."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        s = _span.get()
+        if s is None:
+            return
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = str(record.msg)
+        s.events.append({
+            "level": record.levelname,
+            "message": message[:500],
+            "offset_ms": round((time.perf_counter() - s.start) * 1000, 3),
+        })
+
+
+_configured = False
+
+
+def configure_logging() -> None:
+    """Leveled console logging for the ``api`` package plus span events."""
+    global _configured
+    if _configured:
+        return
+    root = logging.getLogger("api")
+    root.setLevel(logging.DEBUG)
+    root.propagate = False
+    console = logging.StreamHandler()
+    console.setLevel(getattr(logging, config.LOG_LEVEL, logging.INFO))
+    console.addFilter(_RequestFilter())
+    console.setFormatter(logging.Formatter("%(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root.addHandler(console)
+    events = _SpanEventHandler()
+    events.setLevel(logging.DEBUG)
+    root.addHandler(events)
+    _configured = True
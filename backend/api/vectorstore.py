@@ -0,0 +1,145 @@
+"""Session-scoped vector store views.
+
+Every caller works against a single session, whatever the physical layout:
+one Chroma database per session, one shared collection per user, or one
+global collection. Shared collections tag each chunk with ``user_id`` and
+``session_id`` metadata, and every read and write is filtered by them.
+"""
+import threading
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Tuple
+from langchain_core.documents import Document
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+SHARED_COLLECTION_NAME = "docfusion"
+
+_shared_clients: dict[str, "Chroma"] = {}
+_shared_lock = threading.Lock()
+
+
+def where_all(*clauses: dict | None) -> dict | None:
+    """Combine metadata filters the way Chroma expects (``$and`` for several)."""
+    parts = []
+    for clause in clauses:
+        if not clause:
+            continue
+        if "$and" in clause:
+            parts.extend(clause["$and"])
+        elif len(clause) > 1:
+            parts.extend({k: v} for k, v in clause.items())
+        else:
+            parts.append(clause)
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return {"$and": parts}
+
+
+def open_shared_chroma(persist_dir: str, embeddings) -> "Chroma":
+    # One client per consolidated database, reused across requests
+    from langchain_chroma import Chroma
+    with _shared_lock:
+        vs = _shared_clients.get(persist_dir)
+        if vs is None:
+            vs = Chroma(
+                collection_name=SHARED_COLLECTION_NAME,
+                persist_directory=persist_dir,
+                embedding_function=embeddings,
+            )
+            _shared_clients[persist_dir] = vs
+        return vs
+
+
+def forget_shared_chroma(persist_dir: str) -> None:
+    # Drop the cached client before its directory is removed
+    with _shared_lock:
+        _shared_clients.pop(persist_dir, None)
+
+
+class ChromaSessionStore:
+    backend = "chroma"
+
+    def __init__(self, chroma: "Chroma", user_id: str, session_id: str, shared: bool = False):
+        self.chroma = chroma
+        self.embeddings = chroma.embeddings
+        self.user_id = user_id
+        self.session_id = session_id
+        self.shared = shared
+        # In a per-session database everything belongs to the session already
+        self.scope = {"user_id": user_id, "session_id": session_id} if shared else None
+
+    @property
+    def _collection(self):
+        return self.chroma._collection
+
+    def count(self, where: dict | None = None) -> int:
+        scoped = where_all(self.scope, where)
+        if scoped is None:
+            return self._collection.count()
+        return len(self._collection.get(where=scoped, include=[])["ids"])
+
+    def add_documents(self, docs: List[Document], vectors=None) -> List[str]:
+        for d in docs:
+            d.metadata = dict(d.metadata or {})
+            d.metadata["user_id"] = self.user_id
+            d.metadata["session_id"] = self.session_id
+        ids = [uuid.uuid4().hex for _ in docs]
+        if vectors is None:
+            return self.chroma.add_documents(docs, ids=ids)
+        # Precomputed embeddings: skip the second embedding pass
+        self._collection.add(
+            ids=ids,
+            embeddings=[list(map(float, v)) for v in vectors],
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata for d in docs],
+        )
+        return ids
+
+    def get(self, where: dict | None = None, include: list[str] | None = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        return self._collection.get(where=where_all(self.scope, where), include=include)
+
+    def similarity_search(self, query: str, k: int = 4, where: dict | None = None) -> List[Document]:
+        return self.chroma.similarity_search(query, k=k, filter=where_all(self.scope, where))
+
+    def similarity_search_by_vector(self, vector, k: int = 4, where: dict | None = None) -> List[Document]:
+        return self.chroma.similarity_search_by_vector(list(map(float, vector)), k=k, filter=where_all(self.scope, where))
+
+    def similarity_search_by_vector_with_score(self, vector, k: int = 4, where: dict | None = None) -> List[Tuple[Document, float]]:
+        # Chroma returns squared L2 distances; for unit vectors cosine = 1 - d / 2
+        hits = self.chroma.similarity_search_by_vector_with_relevance_scores(
+            list(map(float, vector)), k=k, filter=where_all(self.scope, where)
+        )
+        return [(d, 1.0 - dist / 2.0) for d, dist in hits]
+
+    def search_ids_by_vector(self, vector, k: int = 4, where: dict | None = None) -> List[Tuple[str, float]]:
+        # Ids and cosine scores only; texts are fetched later for the winners
+        result = self._collection.query(
+            query_embeddings=[list(map(float, vector))], n_results=k,
+            where=where_all(self.scope, where), include=["distances"],
+        )
+        return [(i, 1.0 - dist / 2.0) for i, dist in zip(result["ids"][0], result["distances"][0])]
+
+    def get_by_ids(self, ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        data = self._collection.get(ids=ids, include=["documents", "metadatas"])
+        return {i: (t, m or {}) for i, t, m in zip(data["ids"], data["documents"], data["metadatas"])}
+
+    def similarity_search_with_score(self, query: str, k: int = 4, where: dict | None = None) -> List[Tuple[Document, float]]:
+        # Relevance in [0, 1], higher is better (normalized embeddings)
+        return self.chroma.similarity_search_with_relevance_scores(query, k=k, filter=where_all(self.scope, where))
+
+    def as_retriever(self, k: int = 4, where: dict | None = None):
+        search_kwargs = {"k": k}
+        scoped = where_all(self.scope, where)
+        if scoped:
+            search_kwargs["filter"] = scoped
+        return self.chroma.as_retriever(search_kwargs=search_kwargs)
+
+    def delete_all(self) -> None:
+        if self.scope is None:
+            self.chroma.delete_collection()
+        else:
+            self._collection.delete(where=where_all(self.scope))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Chunking and retrieval-depth sweep: latency and prompt tokens against recall.
+
+Re-indexes one corpus per (CHUNK_SIZE, CHUNK_OVERLAP) pair through
+index_pdf_for_user, then answers a labelled question set through the /ask
+chain for every (RETRIEVER_K, FINAL_K) pair, so splitting, retrieval and
+fusion are the production code paths. Reports ingestion time, index size,
+query latency, prompt tokens per question and recall@FINAL_K.
+
+A question counts as recalled when one of the fused chunks contains its
+evidence text (whitespace and case are ignored), or, for labels without
+evidence, comes from its document. The default corpus and questions are
+synthetic (benchmarks.synthetic); pass --pdfs with --questions-file (JSON
+lines with "question" and "evidence" and/or "document_id", the PDF's file
+name without extension) to sweep a real corpus.
+
+Usage: python -m benchmarks.chunking_sweep [--chunk-sizes 500,900,1400] [--overlaps 0,150]
+                                           [--retriever-k 4,8,16] [--final-k 3,6,10]
+                                           [--embedder model|hashing] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+import numpy as np
+from benchmarks.pipeline import configure
+from benchmarks.synthetic import labelled_questions, synthetic_pages, write_pdf
+
+
+def int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def corpus(args, tmp: str) -> tuple[list[tuple[str, str]], list[dict]]:
+    """(document_id, pdf path) pairs and labelled questions."""
+    if args.pdfs:
+        with open(args.questions_file, encoding="utf-8") as f:
+            questions = [json.loads(line) for line in f if line.strip()]
+        return [(os.path.splitext(os.path.basename(p))[0], p) for p in args.pdfs], questions[:args.questions]
+    pdfs = []
+    for doc in range(args.docs):
+        path = os.path.join(tmp, f"doc{doc}.pdf")
+        write_pdf(path, synthetic_pages(doc, args.pages, args.seed, markers=True))
+        pdfs.append((f"doc{doc}", path))
+    return pdfs, labelled_questions(args.questions, args.docs, args.pages, args.seed)
+
+
+def recalled(label: dict, docs) -> bool:
+    evidence = label.get("evidence")
+    if evidence:
+        needles = [normalize(e) for e in (evidence if isinstance(evidence, list) else [evidence])]
+        return any(n in normalize(d.page_content) for d in docs for n in needles)
+    return any(d.metadata.get("document_id") == label.get("document_id") for d in docs)
+
+
+def ingest(rag, pdfs, user_id: str, session_id: str) -> dict:
+    t0 = time.perf_counter()
+    for document_id, path in pdfs:
+        rag.index_pdf_for_user(user_id, path, session_id=session_id, document_id=document_id,
+                               filename=os.path.basename(path))
+    seconds = time.perf_counter() - t0
+    vs = rag.get_vectorstore_for_user(user_id, session_id)
+    return {
+        "ingest_s": seconds,
+        "chunks": vs.count(),
+        "index_mb": dir_bytes(rag.get_user_chroma_dir(user_id, session_id)) / 2**20,
+    }
+
+
+def ask(rag, llm, questions, args, user_id: str, session_id: str) -> dict:
+    latencies, tokens, hits = [], [], 0
+    for i, label in enumerate(questions):
+        before = llm.prompt_tokens
+        t0 = time.perf_counter()
+        chain = rag.build_conversational_chain(user_id, None, session_id=session_id)
+        result = chain.invoke({"input": label["question"], "chat_history": []})
+        elapsed = (time.perf_counter() - t0) * 1000
+        hits += recalled(label, result["context"])
+        tokens.append(llm.prompt_tokens - before)
+        if i >= args.warmup:
+            latencies.append(elapsed)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+        "prompt_tokens": float(np.mean(tokens)) if tokens else 0.0,
+        "recall": hits / len(questions) if questions else 0.0,
+    }
+
+
+def print_table(rows: list[dict], defaults: tuple) -> None:
+    print(f"\n  {'chunk':>6} {'overlap':>7} {'ret_k':>5} {'final_k':>7} {'chunks':>7} {'index MB':>8} {'ingest s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'prompt tok':>10} {'recall':>7}")
+    for r in rows:
+        mark = "*" if (r["chunk_size"], r["chunk_overlap"], r["retriever_k"], r["final_k"]) == defaults else " "
+        print(f"{mark} {r['chunk_size']:>6} {r['chunk_overlap']:>7} {r['retriever_k']:>5} {r['final_k']:>7} {r['chunks']:>7} "
+              f"{r['index_mb']:>8.2f} {r['ingest_s']:>8.2f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['prompt_tokens']:>10.0f} {r['recall']:>7.3f}")
+    print("\n* current configuration")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-sizes", type=int_list, default=[500, 900, 1400])
+    parser.add_argument("--overlaps", type=int_list, default=[0, 150])
+    parser.add_argument("--retriever-k", type=int_list, default=[4, 8, 16])
+    parser.add_argument("--final-k", type=int_list, default=[3, 6, 10])
+    parser.add_argument("--docs", type=int, default=5, help="number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic PDF")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--pdfs", nargs="+", help="sweep these PDFs instead of the synthetic corpus")
+    parser.add_argument("--questions-file", help="labelled questions for --pdfs (JSON lines)")
+    parser.add_argument("--warmup", type=int, default=2, help="questions per setting excluded from latency")
+    parser.add_argument("--embedder", choices=("model", "hashing"), default="model",
+                        help="configured embedding model, or the offline hashing stub")
+    parser.add_argument("--backend", choices=("chroma", "flat"), default="chroma")
+    parser.add_argument("--expansion", choices=("adaptive", "always", "never"), default="never")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per stub LLM call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    if args.pdfs and not args.questions_file:
+        parser.error("--pdfs needs --questions-file")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        rag = configure(args, os.path.join(tmp, "vectors"))
+        from api.core import config
+        llm = rag.get_llm()
+        defaults = (config.CHUNK_SIZE, config.CHUNK_OVERLAP, config.RETRIEVER_K, config.FINAL_K)
+        pdfs, questions = corpus(args, tmp)
+        user_id = "sweep"
+        try:
+            for size in args.chunk_sizes:
+                for overlap in args.overlaps:
+                    if overlap >= size:
+                        continue
+                    config.CHUNK_SIZE, config.CHUNK_OVERLAP = size, overlap
+                    session_id = f"c{size}-o{overlap}"
+                    index = ingest(rag, pdfs, user_id, session_id)
+                    print(f"chunk_size={size} overlap={overlap}: {index['chunks']} chunks in {index['ingest_s']:.2f}s")
+                    for retriever_k in args.retriever_k:
+                        for final_k in args.final_k:
+                            config.RETRIEVER_K, config.FINAL_K = retriever_k, final_k
+                            result = ask(rag, llm, questions, args, user_id, session_id)
+                            rows.append({"chunk_size": size, "chunk_overlap": overlap, "retriever_k": retriever_k,
+                                         "final_k": final_k, **index, **result})
+                    # Each setting only needs its index while it is being queried
+                    rag.delete_session_vectors(user_id, session_id)
+        finally:
+            config.CHUNK_SIZE, config.CHUNK_OVERLAP, config.RETRIEVER_K, config.FINAL_K = defaults
+
+    print(f"\n{len(pdfs)} documents, {len(questions)} questions")
+    print_table(rows, defaults)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
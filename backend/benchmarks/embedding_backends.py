@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Throughput, memory and parity of the embedding backends.
+
+Each backend (torch, onnx, onnx-int8) runs in its own subprocess so peak RSS
+reflects only what that backend loads. The subprocess embeds the same corpus
+and reports load time, texts/s and peak RSS. The parent then compares every
+ONNX backend's vectors with torch's (row-wise cosine). A missing ONNX export
+is created first (``python -m api.onnx_embeddings export``), in its own
+subprocess, so the export does not count towards any backend's numbers.
+
+Usage: python -m benchmarks.embedding_backends [--backends torch,onnx,onnx-int8] [--n 512] [--texts corpus.txt] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def synthetic_texts(n: int, seed: int = 0) -> list[str]:
+    # Sentence-length passages with varied vocabulary; lengths vary like PDF chunks
+    rng = np.random.default_rng(seed)
+    words = ("contract revenue patient model energy clause report policy growth data system "
+             "result method analysis section table figure protein market risk cost value").split()
+    return [" ".join(rng.choice(words, size=int(rng.integers(8, 160)))) for _ in range(n)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(backend: str, texts_path: str, out_path: str, batch: int):
+    os.environ["EMBEDDING_BACKEND"] = backend
+    os.environ["EMBED_MICRO_BATCHING"] = "false"
+    with open(texts_path, encoding="utf-8") as f:
+        texts = json.load(f)
+    t0 = time.perf_counter()
+    from api.rag import build_embedding_model
+    model = build_embedding_model()
+    load_s = time.perf_counter() - t0
+    model.embed_documents(texts[:8])  # warm up
+    t0 = time.perf_counter()
+    vectors = []
+    for start in range(0, len(texts), batch):
+        vectors.extend(model.embed_documents(texts[start:start + batch]))
+    elapsed = time.perf_counter() - t0
+    np.save(out_path, np.asarray(vectors, dtype=np.float32))
+    print(json.dumps({
+        "backend": backend,
+        "resolved": type(model).__name__,
+        "load_s": load_s,
+        "texts_per_s": len(texts) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--n", type=int, default=512, help="number of synthetic passages")
+    parser.add_argument("--texts", help="embed this corpus (one passage per line) instead of synthetic text")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--texts-json", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.texts_json, args.out, args.batch)
+        return
+
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = synthetic_texts(args.n)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = os.path.join(tmp, "texts.json")
+        with open(texts_path, "w", encoding="utf-8") as f:
+            json.dump(texts, f)
+        vectors = {}
+        backends = args.backends.split(",")
+        if any(b.startswith("onnx") for b in backends):
+            export = [sys.executable, "-m", "api.onnx_embeddings", "export"] + ([] if "onnx-int8" in backends else ["--no-int8"])
+            proc = subprocess.run(export, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"ONNX export failed\n{proc.stderr[-2000:]}")
+        for backend in backends:
+            out = os.path.join(tmp, f"{backend}.npy")
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.embedding_backends", "--child", backend,
+                 "--texts-json", texts_path, "--out", out, "--batch", str(args.batch)],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"{backend}: failed\n{proc.stderr[-2000:]}")
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            if result["resolved"] == "HuggingFaceEmbeddings" and backend != "torch":
+                print(f"{backend}: fell back to torch, skipped\n{proc.stdout[-2000:]}")
+                continue
+            vectors[backend] = np.load(out)
+            results.append(result)
+
+    from api.onnx_embeddings import cosine_agreement
+    for r in results:
+        if "torch" in vectors and r["backend"] != "torch":
+            r["cosine_vs_torch"] = cosine_agreement(vectors["torch"], vectors[r["backend"]])
+
+    print(f"{len(texts)} passages, batch {args.batch}\n")
+    print(f"{'backend':<10} {'load s':>7} {'texts/s':>9} {'peak RSS MB':>12} {'min cos':>8} {'mean cos':>9}")
+    for r in results:
+        cos = r.get("cosine_vs_torch", {})
+        print(f"{r['backend']:<10} {r['load_s']:>7.2f} {r['texts_per_s']:>9.1f} {r['peak_rss_mb']:>12.0f} "
+              f"{cos.get('min', 1.0):>8.4f} {cos.get('mean', 1.0):>9.4f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"n": len(texts), "batch": args.batch, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
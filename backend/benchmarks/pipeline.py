@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Offline ingestion and retrieval benchmark of the RAG pipeline.
+
+Generates synthetic multi-page PDFs, indexes them into one session through
+index_pdf_for_user, then asks generated questions through the same chain as
+/ask (a fresh chain per question, as in production), with a deterministic
+stub chat model instead of OpenAI. Reports ingestion pages/s and chunks/s,
+per-stage p50/p95/p99 latency (from the pipeline's own metrics.stage timings)
+and peak RSS. Runs on CPU without network access: use --embedder hashing when
+the embedding model is not cached locally.
+
+Results are written as JSON (--json); pass a previous file as --baseline to
+print the change of every headline number.
+
+Usage: python -m benchmarks.pipeline [--docs 5] [--pages 20] [--questions 100] [--embedder model|hashing]
+                                     [--backend chroma|flat] [--expansion adaptive|always|never] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.synthetic import HashingEmbeddings, StubChatModel, synthetic_pages, synthetic_questions, write_pdf
+
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stage_stats(samples: list[dict]) -> dict:
+    """Per-stage latency percentiles (ms) over per-run timing dicts."""
+    stages = sorted({name for s in samples for name in s})
+    out = {}
+    for name in stages:
+        values = np.asarray([s[name] for s in samples if name in s])
+        out[name] = {"runs": int(len(values)), "mean_ms": float(values.mean())}
+        out[name].update({f"p{p}_ms": float(np.percentile(values, p)) for p in PERCENTILES})
+    return out
+
+
+def configure(args, base_dir: str):
+    # Settings are read at import time, so they go into the environment first
+    os.environ["VECTOR_BACKEND"] = args.backend
+    os.environ["VECTOR_STORE_LAYOUT"] = "session"
+    os.environ["QUERY_EXPANSION"] = args.expansion
+    os.environ["EMBED_MICRO_BATCHING"] = "false"
+    os.environ["TRACE_FILE"] = ""
+    from api import rag
+    rag.CHROMA_BASE_DIR = base_dir
+    llm = StubChatModel(latency_ms=args.llm_latency_ms)
+    rag.get_llm = lambda: llm
+    if args.embedder == "hashing":
+        embeddings = HashingEmbeddings()
+        rag.get_embeddings = lambda: embeddings
+    return rag
+
+
+def ingest(rag, metrics, args, tmp: str, user_id: str, session_id: str) -> dict:
+    samples = []
+    pages_total = 0
+    chunks_total = 0
+    t_all = time.perf_counter()
+    for doc in range(args.docs):
+        path = os.path.join(tmp, f"doc{doc}.pdf")
+        write_pdf(path, synthetic_pages(doc, args.pages, args.seed))
+        before = rag.get_vectorstore_for_user(user_id, session_id).count()
+        timings = metrics.collect_timings()
+        t0 = time.perf_counter()
+        rag.index_pdf_for_user(user_id, path, session_id=session_id, document_id=f"doc{doc}", filename=f"doc{doc}.pdf")
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        samples.append(dict(timings))
+        pages_total += args.pages
+        chunks_total += rag.get_vectorstore_for_user(user_id, session_id).count() - before
+    elapsed = time.perf_counter() - t_all
+    return {
+        "documents": args.docs,
+        "pages": pages_total,
+        "chunks": chunks_total,
+        "seconds": elapsed,
+        "pages_per_s": pages_total / elapsed,
+        "chunks_per_s": chunks_total / elapsed,
+        "stages": stage_stats(samples),
+    }
+
+
+def query(rag, metrics, args, user_id: str, session_id: str) -> dict:
+    from langchain_core.messages import AIMessage, HumanMessage
+    questions = synthetic_questions(args.questions, args.docs, args.seed)
+    rng = np.random.default_rng(args.seed)
+    samples = []
+    paths = {}
+    history = []
+    for i, question in enumerate(questions):
+        follow_up = bool(history) and rng.random() < args.followups
+        timings = metrics.collect_timings()
+        t0 = time.perf_counter()
+        chain = rag.build_conversational_chain(user_id, None, session_id=session_id)
+        result = chain.invoke({"input": question, "chat_history": history if follow_up else []})
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        if i >= args.warmup:
+            samples.append(dict(timings))
+            # Path mix over the measured questions only, like the latencies
+            path = "contextualize" if "contextualize" in timings else "expand" if "expansion" in timings else "fast"
+            paths[path] = paths.get(path, 0) + 1
+        history = [HumanMessage(content=question), AIMessage(content=result["answer"])]
+    totals = [s["total"] for s in samples]
+    return {
+        "questions": len(samples),
+        "warmup": args.warmup,
+        "queries_per_s": len(totals) / (sum(totals) / 1000) if totals else 0.0,
+        "paths": paths,
+        "stages": stage_stats(samples),
+    }
+
+
+def headline(result: dict) -> dict:
+    out = {
+        "ingest pages/s": result["ingestion"]["pages_per_s"],
+        "ingest chunks/s": result["ingestion"]["chunks_per_s"],
+        "queries/s": result["retrieval"]["queries_per_s"],
+        "peak RSS MB": result["peak_rss_mb"],
+    }
+    for name, s in result["retrieval"]["stages"].items():
+        out[f"{name} p95 ms"] = s["p95_ms"]
+    return out
+
+
+def print_report(result: dict, baseline: dict | None) -> None:
+    ing = result["ingestion"]
+    print(f"Ingestion: {ing['documents']} docs, {ing['pages']} pages, {ing['chunks']} chunks in {ing['seconds']:.2f}s "
+          f"({ing['pages_per_s']:.1f} pages/s, {ing['chunks_per_s']:.1f} chunks/s)")
+    for title, stages in (("Ingestion stages", ing["stages"]), ("Query stages", result["retrieval"]["stages"])):
+        print(f"\n{title}:")
+        print(f"  {'stage':<18} {'runs':>5} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)")
+        for name, s in stages.items():
+            print(f"  {name:<18} {s['runs']:>5} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+    ret = result["retrieval"]
+    print(f"\nQueries: {ret['questions']} measured, {ret['queries_per_s']:.1f}/s, paths {ret['paths']}")
+    print(f"Peak RSS: {result['peak_rss_mb']:.0f} MB")
+    if baseline:
+        old = headline(baseline)
+        print(f"\n{'vs baseline':<24} {'before':>10} {'after':>10} {'change':>8}")
+        for key, value in headline(result).items():
+            if key in old and old[key]:
+                print(f"  {key:<22} {old[key]:>10.2f} {value:>10.2f} {(value / old[key] - 1) * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5, help="number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=20, help="pages per PDF")
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5, help="questions excluded from the statistics")
+    parser.add_argument("--followups", type=float, default=0.3, help="share of questions asked with chat history")
+    parser.add_argument("--embedder", choices=("model", "hashing"), default="model",
+                        help="configured embedding model, or the offline hashing stub")
+    parser.add_argument("--backend", choices=("chroma", "flat"), default="chroma")
+    parser.add_argument("--expansion", choices=("adaptive", "always", "never"), default="adaptive")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per stub LLM call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rag = configure(args, os.path.join(tmp, "vectors"))
+        from api import metrics
+        user_id, session_id = "bench", "session"
+        ingestion = ingest(rag, metrics, args, tmp, user_id, session_id)
+        retrieval = query(rag, metrics, args, user_id, session_id)
+
+    result = {
+        "args": vars(args),
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()},
+        "ingestion": ingestion,
+        "retrieval": retrieval,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
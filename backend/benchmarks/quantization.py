@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Recall and memory of quantized flat indexes against float32.
+
+Builds one flat index per storage dtype over the same vectors and reports
+recall@k against exact float32 search, search latency and vector bytes.
+Vectors are synthetic clustered embeddings by default; pass --texts with
+one passage per line to embed a real corpus with the configured model.
+
+Usage: python -m benchmarks.quantization [--n 5000] [--k 6] [--texts corpus.txt] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from api.flat_index import DTYPES, FlatIndex
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, rng) -> np.ndarray:
+    # Clustered unit vectors look more like sentence embeddings than uniform noise
+    centers = rng.standard_normal((clusters, dim))
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def embedded_vectors(path: str) -> np.ndarray:
+    from api.rag import get_embeddings
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+
+
+def percentile(values, p):
+    return float(np.percentile(np.asarray(values), p)) * 1000 if values else 0.0
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int) -> list[dict]:
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    texts = [""] * len(vectors)
+    metas = [{}] * len(vectors)
+    results = []
+    for dtype in DTYPES:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = FlatIndex(os.path.join(tmp, "flat"), dtype)
+            index.append(vectors, texts, metas)
+            disk = sum(os.path.getsize(os.path.join(index.index_dir, f)) for f in ("vectors.bin", "scales.bin")
+                       if os.path.exists(os.path.join(index.index_dir, f)))
+            latencies = []
+            hits = 0
+            for q, expected in zip(queries, truth):
+                start = time.perf_counter()
+                found = [row for row, _ in index.search(q, k)]
+                latencies.append(time.perf_counter() - start)
+                hits += len(set(found) & set(expected.tolist()))
+            results.append({
+                "dtype": dtype,
+                f"recall@{k}": hits / (len(queries) * k),
+                "vector_bytes": index.nbytes(),
+                "disk_bytes": disk,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=5000, help="number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vector dimension (MiniLM: 384)")
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--texts", help="embed this corpus (one passage per line) instead of synthetic vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = embedded_vectors(args.texts) if args.texts else synthetic_vectors(args.n, args.dim, args.clusters, rng)
+    # Queries are perturbed corpus vectors so each has a meaningful neighbourhood
+    picks = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    results = run(vectors, queries, args.k)
+    baseline = results[0]["vector_bytes"]
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}\n")
+    print(f"{'dtype':<8} {'recall@' + str(args.k):>9} {'vector MB':>10} {'saved':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        saved = 1 - r["vector_bytes"] / baseline
+        print(f"{r['dtype']:<8} {r[f'recall@{args.k}']:>9.4f} {r['vector_bytes'] / 1e6:>10.2f} {saved:>7.0%} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"n": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Offline stand-ins for benchmarks: synthetic PDFs, a hashing embedder and a
+deterministic chat model.
+
+Documents are built from a fixed vocabulary with a few topic words per
+document, so generated questions have a right answer to retrieve. PDFs are
+written by hand (Helvetica text pages, no extra dependency) and read back
+with the same loader as uploads.
+"""
+
+import json
+import re
+import time
+import zlib
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+COMMON = ("the of and to in a is for that on with as by this are be from at or an which results "
+          "data analysis method report section table figure value system process model study "
+          "effect level group total rate change period review case result use based").split()
+TOPICS = ("contract revenue patient energy clause policy growth protein market risk cost turbine "
+          "vaccine tariff lender sensor harvest reactor pension satellite mortgage enzyme drought "
+          "freight audit glacier cipher vessel ledger").split()
+LINES_PER_PAGE = 60
+WORDS_PER_LINE = 14
+
+
+def document_topics(doc_index: int, per_doc: int = 3) -> list[str]:
+    rng = np.random.default_rng(1000 + doc_index)
+    return [str(t) for t in rng.choice(TOPICS, size=per_doc, replace=False)]
+
+
+def line_marker(doc_index: int, page: int, line: int, seed: int = 0) -> str:
+    """Token unique to one line, so labelled evidence is findable by exactly one passage."""
+    return "ref%08x" % zlib.crc32(f"{seed}:{doc_index}:{page}:{line}".encode())
+
+
+def synthetic_pages(doc_index: int, pages: int, seed: int = 0, markers: bool = False) -> list[list[str]]:
+    """Pages of text lines; roughly one in five words is one of the document's topics.
+
+    With ``markers`` every line starts with its ``line_marker``.
+    """
+    rng = np.random.default_rng(seed * 100_003 + doc_index)
+    topics = document_topics(doc_index)
+    out = []
+    for page in range(pages):
+        lines = []
+        for line in range(LINES_PER_PAGE):
+            words = [str(rng.choice(topics)) if rng.random() < 0.2 else str(rng.choice(COMMON))
+                     for _ in range(WORDS_PER_LINE)]
+            if markers:
+                words.insert(0, line_marker(doc_index, page, line, seed))
+            lines.append(" ".join(words))
+        out.append(lines)
+    return out
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list[list[str]]) -> None:
+    """Minimal valid PDF: one Helvetica text stream per page."""
+    kids = [4 + 2 * i for i in range(len(pages))]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(pages)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_num, lines in zip(kids, pages):
+        text = " ".join(f"({_escape(line)}) Tj T*" for line in lines)
+        data = f"BT /F1 9 Tf 12 TL 40 770 Td {text} ET".encode("latin-1")
+        objects[page_num] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_num + 1} 0 R >>"
+        ).encode()
+        objects[page_num + 1] = b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += f"{num} 0 obj\n".encode() + objects[num] + b"\nendobj\n"
+    xref = len(out)
+    size = len(objects) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for num in range(1, size):
+        out += f"{offsets[num]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_questions(n: int, documents: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed + 7)
+    questions = []
+    for _ in range(n):
+        topics = document_topics(int(rng.integers(0, documents)))
+        picked = rng.choice(topics, size=2, replace=False)
+        questions.append(f"What does the report say about {picked[0]} and {picked[1]} {rng.choice(COMMON)}?")
+    return questions
+
+
+def labelled_questions(n: int, documents: int, pages: int, seed: int = 0, span: int = 6) -> list[dict]:
+    """Questions about one line of ``synthetic_pages(..., markers=True)``.
+
+    The question names the line's marker and first word; the evidence is the
+    marker plus the next ``span - 1`` words, so a hit needs the right passage
+    kept whole in one retrieved chunk.
+    """
+    rng = np.random.default_rng(seed + 11)
+    corpus = {}
+    out = []
+    for _ in range(n):
+        doc = int(rng.integers(0, documents))
+        if doc not in corpus:
+            corpus[doc] = synthetic_pages(doc, pages, seed, markers=True)
+        line = corpus[doc][int(rng.integers(0, pages))][int(rng.integers(0, LINES_PER_PAGE))].split()
+        out.append({
+            "question": f"What does the report say at {line[0]} about {line[1]}?",
+            "document_id": f"doc{doc}",
+            "evidence": " ".join(line[:span]),
+        })
+    return out
+
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """OpenAI tokens (cl100k) when tiktoken is installed, else the ~4 characters per token rule of thumb."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return len(_encoding.encode(text)) if _encoding else (len(text) + 3) // 4
+
+
+class HashingEmbeddings(Embeddings):
+    """Signed feature hashing of word tokens: fast, deterministic, no model download."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            v[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(v))
+        return (v / norm if norm else v).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def stub_reply(system: str, question: str, answer_words: int = 40) -> str:
+    """Deterministic reply to the pipeline's prompt shapes.
+
+    Query expansion gets a JSON array of two rewrites, contextualization gets
+    the question back, and answers quote the start of the retrieved context.
+    """
+    if "alternative search queries" in system:
+        words = question.split()
+        return json.dumps([" ".join(reversed(words)), " ".join(words[-4:] + ["overview"])])
+    if "standalone question" in system:
+        return question
+    context = system.split("Retrieved context follows.", 1)[-1].split() or question.split()
+    words = [context[i % len(context)] for i in range(answer_words)] if context else []
+    return "Based on the documents: " + " ".join(words)
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model answering with ``stub_reply``; ``latency_ms`` adds a fixed delay per call."""
+
+    model_name: str = "stub-chat"
+    latency_ms: float = 0.0
+    prompt_tokens: int = 0  # running total over all calls
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        system = str(messages[0].content) if messages and messages[0].type == "system" else ""
+        question = str(messages[-1].content) if messages else ""
+        text = stub_reply(system, question)
+        usage = {"prompt_tokens": sum(count_tokens(str(m.content)) for m in messages), "completion_tokens": count_tokens(text)}
+        self.prompt_tokens += usage["prompt_tokens"]
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        message = AIMessage(content=text)
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage, "model_name": self.model_name})
@@ -8,7 +8,8 @@ import os
 import shutil
 import asyncio
 from api.db.mongo import get_db
-from api.rag import get_user_chroma_dir
+from api.rag import CHROMA_BASE_DIR
+from api.db.sessions import ORPHANED_SUFFIX
 
 async def cleanup_orphaned_chroma():
     """Clean up ChromaDB directories that don't have corresponding sessions in MongoDB."""
@@ -29,17 +30,17 @@ async def cleanup_orphaned_chroma():
     
     print(f"Found {len(users)} users in database")
     
-    # Get all active sessions for each user
+    # Get all active session keys (immutable session ids) for each user
     user_sessions = {}
     for user_id in users:
         sessions = set()
         async for session in db.sessions.find({"owner_id": user_id}):
-            sessions.add(session.get("name"))
+            sessions.add(str(session["_id"]))
         user_sessions[user_id] = sessions
         print(f"User {user_id} has sessions: {list(sessions)}")
     
     # Check ChromaDB directories
-    chroma_base_dir = "./chroma_db"
+    chroma_base_dir = CHROMA_BASE_DIR
     if not os.path.exists(chroma_base_dir):
         print("No chroma_db directory found")
         return
@@ -64,17 +65,19 @@ async def cleanup_orphaned_chroma():
         
         # Check each session directory
         for session_dir in os.listdir(user_path):
-            if not session_dir.startswith("session_"):
+            # Legacy directories the session migration set aside are always orphaned
+            set_aside = session_dir.startswith("session_") and session_dir.endswith(ORPHANED_SUFFIX)
+            if not session_dir.startswith("sid_") and not set_aside:
                 continue
                 
-            session_name = session_dir.replace("session_", "")
+            session_key = session_dir[len("sid_"):]
             session_path = os.path.join(user_path, session_dir)
             
             if not os.path.isdir(session_path):
                 continue
                 
             # Check if this session exists in MongoDB
-            if session_name not in active_sessions:
+            if set_aside or session_key not in active_sessions:
                 print(f"🗑️  Orphaned session directory found: {session_path}")
                 
                 # Calculate size before deletion
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Cloudinary endpoints the API uses.
+
+Implements raw upload and destroy, resource lookup, bulk delete and ping
+under /v1_1/<cloud>/ (point CLOUDINARY_API_BASE at http://host:port/v1_1),
+and serves stored files under /files/ as their secure_url. Files live in a
+local directory; request signatures are not checked.
+
+Usage: python -m loadtest.object_store [--port 9102] [--dir ./object_store]
+"""
+
+import argparse
+import os
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+app = FastAPI(title="Object store stub")
+settings = {"dir": "./object_store", "public_url": "http://127.0.0.1:9102"}
+
+
+def _path(public_id: str) -> str:
+    path = os.path.abspath(os.path.join(settings["dir"], public_id))
+    if not path.startswith(os.path.abspath(settings["dir"]) + os.sep):
+        raise HTTPException(status_code=400, detail={"message": "Invalid public_id"})
+    return path
+
+
+def _resource(public_id: str) -> dict:
+    return {
+        "public_id": public_id, "resource_type": "raw", "type": "upload",
+        "bytes": os.path.getsize(_path(public_id)),
+        "secure_url": f"{settings['public_url']}/files/{public_id}",
+    }
+
+
+@app.post("/v1_1/{cloud}/raw/upload")
+async def upload(cloud: str, request: Request):
+    form = await request.form()
+    public_id = form.get("public_id") or os.path.splitext(form["file"].filename)[0]
+    if form.get("folder"):
+        public_id = f"{form['folder']}/{public_id}"
+    path = _path(public_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(await form["file"].read())
+    return _resource(public_id)
+
+
+@app.post("/v1_1/{cloud}/raw/destroy")
+async def destroy(cloud: str, request: Request):
+    form = await request.form()
+    try:
+        os.remove(_path(form["public_id"]))
+    except FileNotFoundError:
+        return {"result": "not found"}
+    return {"result": "ok"}
+
+
+@app.get("/v1_1/{cloud}/resources/raw/upload/{public_id:path}")
+async def get_resource(cloud: str, public_id: str):
+    if not os.path.isfile(_path(public_id)):
+        raise HTTPException(status_code=404, detail={"message": f"Resource not found - {public_id}"})
+    return _resource(public_id)
+
+
+@app.delete("/v1_1/{cloud}/resources/raw/upload")
+async def delete_resources(cloud: str, request: Request):
+    deleted = {}
+    for public_id in request.query_params.getlist("public_ids[]"):
+        try:
+            os.remove(_path(public_id))
+            deleted[public_id] = "deleted"
+        except FileNotFoundError:
+            deleted[public_id] = "not_found"
+    return {"deleted": deleted}
+
+
+@app.get("/v1_1/{cloud}/ping")
+async def ping(cloud: str):
+    return {"status": "ok"}
+
+
+@app.get("/files/{public_id:path}")
+async def download(public_id: str):
+    path = _path(public_id)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404)
+    return FileResponse(path, media_type="application/pdf")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9102)
+    parser.add_argument("--dir", default="./object_store")
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    settings.update(dir=args.dir, public_url=f"http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
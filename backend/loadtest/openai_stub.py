@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+OpenAI-compatible chat completions stub with configurable latency.
+
+Serves POST /v1/chat/completions, plain and streaming, with the same
+deterministic replies as the benchmark stub model. Every completion waits
+--ttft-ms before its first token and --token-ms per further token; at most
+--max-concurrency generations run at once, the rest queue, which caps the
+aggregate token throughput like a rate-limited account would.
+
+Usage: python -m loadtest.openai_stub [--port 9101] [--ttft-ms 300] [--token-ms 15] [--answer-tokens 120] [--max-concurrency 64]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from benchmarks.synthetic import stub_reply
+
+app = FastAPI(title="OpenAI stub")
+settings = {"ttft_ms": 300.0, "token_ms": 15.0, "answer_tokens": 120}
+stats = {"requests": 0, "in_flight": 0, "queued": 0, "completion_tokens": 0}
+_slots: asyncio.Semaphore | None = None
+
+
+def _reply(messages: list[dict]) -> str:
+    def text(m):
+        content = m.get("content") or ""
+        # Content may be a list of parts
+        return content if isinstance(content, str) else " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+
+    system = text(messages[0]) if messages and messages[0].get("role") == "system" else ""
+    question = text(messages[-1]) if messages else ""
+    return stub_reply(system, question, answer_words=settings["answer_tokens"])
+
+
+async def _generate(tokens: list[str]):
+    """Yield tokens at the configured pace while holding a generation slot."""
+    stats["queued"] += 1
+    async with _slots:
+        stats["queued"] -= 1
+        stats["in_flight"] += 1
+        try:
+            await asyncio.sleep(settings["ttft_ms"] / 1000)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(settings["token_ms"] / 1000)
+                yield token
+        finally:
+            stats["in_flight"] -= 1
+            stats["completion_tokens"] += len(tokens)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    messages = body.get("messages") or []
+    model = body.get("model", "gpt-4o-mini")
+    words = _reply(messages).split(" ")
+    tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+    prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in messages)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+
+    if body.get("stream"):
+        async def events():
+            async for token in _generate(tokens):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (body.get("stream_options") or {}).get("include_usage"):
+                final["usage"] = usage
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    content = "".join([t async for t in _generate(tokens)])
+    return JSONResponse({
+        "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", **stats}
+
+
+def main():
+    global _slots
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="delay per further token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="words in a generated answer")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="generations served at once; the rest queue")
+    args = parser.parse_args()
+    settings.update(ttft_ms=args.ttft_ms, token_ms=args.token_ms, answer_tokens=args.answer_tokens)
+    _slots = asyncio.Semaphore(args.max_concurrency)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
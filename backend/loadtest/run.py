@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of api.server:app without paid services.
+
+Starts a local mongod (or uses --mongo-uri), the OpenAI-compatible stub,
+the object store stand-in for Cloudinary and the API itself under uvicorn,
+all wired together through environment variables. Then it registers users,
+seeds each with a session and a synthetic PDF, and replays a weighted mix
+of upload, ask, ask_stream, history and document-list requests at each
+--concurrency level for --duration seconds.
+
+Per level and route it reports requests/s, error and rejection (429/503)
+rates and p50/p95/p99 latency (time to first byte for streams as well), plus
+the server's own /api/stats snapshot, so the level where the single process
+saturates stands out. --app-url skips starting anything and targets a
+running deployment that is already wired to stubs.
+
+Usage: python -m loadtest.run [--concurrency 1,8,32] [--duration 30] [--users 8]
+                              [--mix ask=6,stream=2,history=4,list=2,upload=1] [--json out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+from benchmarks.synthetic import synthetic_pages, synthetic_questions, write_pdf
+
+ROUTES = ("upload", "ask", "stream", "history", "list")
+PERCENTILES = (50, 95, 99)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ROUTES:
+            raise SystemExit(f"unknown route in --mix: {name} (expected one of {', '.join(ROUTES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def wait_ready(url: str, timeout: float, proc: subprocess.Popen | None = None) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"{url}: process exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise SystemExit(f"{url}: not ready after {timeout:.0f}s")
+
+
+class Services:
+    """Child processes for mongod, the stubs and the API; stopped in reverse order."""
+
+    def __init__(self, tmp: str, args):
+        self.tmp = tmp
+        self.args = args
+        self.procs: list[tuple[str, subprocess.Popen]] = []
+
+    def spawn(self, name: str, cmd: list[str], env: dict | None = None) -> subprocess.Popen:
+        log = open(os.path.join(self.tmp, f"{name}.log"), "wb")
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        self.procs.append((name, proc))
+        return proc
+
+    def start(self) -> str:
+        args = self.args
+        mongo_uri = args.mongo_uri
+        if not mongo_uri:
+            mongod = shutil.which("mongod")
+            if not mongod:
+                raise SystemExit("mongod not found on PATH; install MongoDB or pass --mongo-uri")
+            port = free_port()
+            os.makedirs(os.path.join(self.tmp, "db"))
+            self.spawn("mongod", [mongod, "--dbpath", os.path.join(self.tmp, "db"), "--port", str(port),
+                                  "--bind_ip", "127.0.0.1", "--quiet"])
+            mongo_uri = f"mongodb://127.0.0.1:{port}/loadtest"
+            self._wait_mongo(port)
+
+        llm_port, store_port, app_port = free_port(), free_port(), free_port()
+        llm = self.spawn("openai_stub", [
+            sys.executable, "-m", "loadtest.openai_stub", "--port", str(llm_port),
+            "--ttft-ms", str(args.ttft_ms), "--token-ms", str(args.token_ms),
+            "--answer-tokens", str(args.answer_tokens), "--max-concurrency", str(args.llm_concurrency),
+        ])
+        store = self.spawn("object_store", [
+            sys.executable, "-m", "loadtest.object_store", "--port", str(store_port),
+            "--dir", os.path.join(self.tmp, "objects"),
+        ])
+        wait_ready(f"http://127.0.0.1:{llm_port}/health", 30, llm)
+        wait_ready(f"http://127.0.0.1:{store_port}/health", 30, store)
+
+        env = dict(os.environ)
+        env.update({
+            "MONGODB_URL": mongo_uri,
+            "OPENAI_API_KEY": "sk-loadtest",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+            "CLOUDINARY_CLOUD_NAME": "loadtest",
+            "CLOUDINARY_API_KEY": "loadtest",
+            "CLOUDINARY_API_SECRET": "loadtest",
+            "CLOUDINARY_API_BASE": f"http://127.0.0.1:{store_port}/v1_1",
+            "SENDGRID_API_KEY": "",
+            "CHROMA_BASE_DIR": os.path.join(self.tmp, "vectors"),
+            "PDF_CACHE_DIR": os.path.join(self.tmp, "pdf_cache"),
+            "TRACE_FILE": os.path.join(self.tmp, "traces.jsonl"),
+            "PROFILE_DIR": os.path.join(self.tmp, "profiles"),
+            "LOG_LEVEL": "WARNING",
+        })
+        app = self.spawn("api", [
+            sys.executable, "-m", "uvicorn", "api.server:app", "--host", "127.0.0.1", "--port", str(app_port),
+            "--workers", str(args.workers), "--log-level", "warning",
+        ], env=env)
+        app_url = f"http://127.0.0.1:{app_port}"
+        wait_ready(f"{app_url}/api/health", 120, app)
+        return app_url
+
+    def _wait_mongo(self, port: int) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise SystemExit("mongod did not start")
+
+    def stop(self) -> None:
+        for name, proc in reversed(self.procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+class User:
+    def __init__(self, index: int, token: str, session: str):
+        self.index = index
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.session = session
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[tuple[int, float, float]]] = {r: [] for r in ROUTES}  # (status, latency, ttfb)
+
+    def add(self, route: str, status: int, latency: float, ttfb: float | None = None) -> None:
+        self.samples[route].append((status, latency, latency if ttfb is None else ttfb))
+
+    def summary(self, elapsed: float) -> dict:
+        out = {}
+        for route, samples in self.samples.items():
+            if not samples:
+                continue
+            statuses = [s for s, _, _ in samples]
+            ok = [(lat, ttfb) for s, lat, ttfb in samples if 200 <= s < 400]
+            row = {
+                "requests": len(samples),
+                "rps": len(samples) / elapsed,
+                "ok_rps": len(ok) / elapsed,
+                "error_rate": sum(1 for s in statuses if s == 0 or (s >= 400 and s not in (429, 503))) / len(samples),
+                "rejected_rate": sum(1 for s in statuses if s in (429, 503)) / len(samples),
+                "statuses": {str(s): statuses.count(s) for s in sorted(set(statuses))},
+            }
+            if ok:
+                latencies = np.asarray([lat for lat, _ in ok]) * 1000
+                row.update({f"p{p}_ms": float(np.percentile(latencies, p)) for p in PERCENTILES})
+                if route == "stream":
+                    ttfbs = np.asarray([t for _, t in ok]) * 1000
+                    row.update({f"ttfb_p{p}_ms": float(np.percentile(ttfbs, p)) for p in PERCENTILES})
+            out[route] = row
+        return out
+
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, args, pdf_bytes: bytes):
+        self.client = client
+        self.args = args
+        self.pdf_bytes = pdf_bytes
+        self.questions = synthetic_questions(256, max(1, args.users), args.seed)
+        self.users: list[User] = []
+
+    async def setup(self, run_id: str) -> None:
+        async def create(i: int) -> User:
+            email = f"load{run_id}-{i}@example.com"
+            r = await self.client.post("/api/auth/register", json={"name": f"Load {i}", "email": email, "password": "loadtest-password"})
+            r.raise_for_status()
+            user = User(i, r.json()["access_token"], "load")
+            r = await self.client.post("/api/sessions/new", json={"name": user.session}, headers=user.headers)
+            r.raise_for_status()
+            # Seed every session with one document so chat has something to retrieve
+            r = await self.upload(user)
+            r.raise_for_status()
+            return user
+        self.users = list(await asyncio.gather(*(create(i) for i in range(self.args.users))))
+
+    async def upload(self, user: User) -> httpx.Response:
+        files = {"file": (f"load-{random.getrandbits(32):08x}.pdf", self.pdf_bytes, "application/pdf")}
+        return await self.client.post("/api/documents/upload", files=files, data={"session_id": user.session}, headers=user.headers)
+
+    async def run_one(self, route: str, user: User, rng: random.Random, recorder: Recorder) -> None:
+        question = rng.choice(self.questions)
+        t0 = time.perf_counter()
+        status, ttfb = 0, None
+        try:
+            if route == "upload":
+                status = (await self.upload(user)).status_code
+            elif route == "ask":
+                r = await self.client.post("/api/chat/ask", json={"session_id": user.session, "message": question}, headers=user.headers)
+                status = r.status_code
+            elif route == "stream":
+                async with self.client.stream("POST", "/api/chat/ask_stream", json={"session_id": user.session, "message": question},
+                                              headers=user.headers) as r:
+                    status = r.status_code
+                    async for _ in r.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - t0
+            elif route == "history":
+                status = (await self.client.get("/api/chat/history", params={"session_id": user.session}, headers=user.headers)).status_code
+            elif route == "list":
+                status = (await self.client.get("/api/documents", params={"session_id": user.session}, headers=user.headers)).status_code
+        except httpx.HTTPError:
+            status = 0
+        recorder.add(route, status, time.perf_counter() - t0, ttfb)
+
+    async def level(self, concurrency: int, duration: float, mix: dict[str, float]) -> dict:
+        recorder = Recorder()
+        routes, weights = list(mix), list(mix.values())
+        deadline = time.perf_counter() + duration
+
+        async def worker(n: int):
+            rng = random.Random(self.args.seed * 1000 + n)
+            while time.perf_counter() < deadline:
+                route = rng.choices(routes, weights)[0]
+                await self.run_one(route, rng.choice(self.users), rng, recorder)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+        routes_summary = recorder.summary(elapsed)
+        total = sum(r["requests"] for r in routes_summary.values())
+        stats = (await self.client.get("/api/stats")).json()
+        return {
+            "concurrency": concurrency,
+            "seconds": elapsed,
+            "rps": total / elapsed,
+            "ok_rps": sum(r["ok_rps"] for r in routes_summary.values()),
+            "routes": routes_summary,
+            "server_stats": stats,
+        }
+
+
+def print_level(result: dict) -> None:
+    print(f"\nconcurrency {result['concurrency']}: {result['rps']:.1f} req/s ({result['ok_rps']:.1f} ok/s) over {result['seconds']:.0f}s")
+    print(f"  {'route':<8} {'req':>6} {'req/s':>7} {'err%':>6} {'rej%':>6} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for route, r in result["routes"].items():
+        print(f"  {route:<8} {r['requests']:>6} {r['rps']:>7.1f} {r['error_rate'] * 100:>6.1f} {r['rejected_rate'] * 100:>6.1f} "
+              f"{r.get('p50_ms', 0):>8.0f} {r.get('p95_ms', 0):>8.0f} {r.get('p99_ms', 0):>8.0f}")
+        if "ttfb_p50_ms" in r:
+            print(f"  {'  ttfb':<8} {'':>6} {'':>7} {'':>6} {'':>6} "
+                  f"{r['ttfb_p50_ms']:>8.0f} {r['ttfb_p95_ms']:>8.0f} {r['ttfb_p99_ms']:>8.0f}")
+
+
+async def drive(app_url: str, args, pdf_bytes: bytes) -> dict:
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels) + 8, max_keepalive_connections=max(levels) + 8)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as client:
+        workload = Workload(client, args, pdf_bytes)
+        t0 = time.perf_counter()
+        await workload.setup(f"{int(time.time())}{random.getrandbits(16):04x}")
+        print(f"Setup: {args.users} users with a seeded session in {time.perf_counter() - t0:.1f}s")
+        results = []
+        for concurrency in levels:
+            result = await workload.level(concurrency, args.duration, mix)
+            print_level(result)
+            results.append(result)
+    return {"mix": mix, "levels": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrent clients per level")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--mix", default="ask=6,stream=2,history=4,list=2,upload=1", help="route weights")
+    parser.add_argument("--pages", type=int, default=10, help="pages per uploaded PDF")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="stub LLM delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="stub LLM delay per token")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--llm-concurrency", type=int, default=64, help="stub LLM generations served at once")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--mongo-uri", help="use this MongoDB instead of starting mongod")
+    parser.add_argument("--app-url", help="target an already running API instead of starting one")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request client timeout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the working directory (logs, traces, data)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    pdf_path = os.path.join(tmp, "upload.pdf")
+    write_pdf(pdf_path, synthetic_pages(0, args.pages, args.seed))
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+
+    services = None
+    try:
+        app_url = args.app_url
+        if not app_url:
+            services = Services(tmp, args)
+            app_url = services.start()
+        result = asyncio.run(drive(app_url, args, pdf_bytes))
+    finally:
+        if services is not None:
+            services.stop()
+        if args.keep:
+            print(f"\nWorking directory kept: {tmp}")
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    result["args"] = vars(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Move per-session ChromaDB directories into the consolidated vector store.
+Set VECTOR_STORE_LAYOUT=user or VECTOR_STORE_LAYOUT=global before running.
+Embeddings are copied as-is, nothing is re-embedded.
+
+Usage: python migrate_to_consolidated.py [--delete]
+"""
+
+import os
+import sys
+import shutil
+import chromadb
+from api.core import config
+from api.rag import CHROMA_BASE_DIR, get_embeddings, get_shared_chroma_dir
+from api.vectorstore import open_shared_chroma
+
+BATCH_SIZE = 500
+
+
+def migrate_session_dir(session_path: str, user_id: str, session_key: str, target) -> int:
+    client = chromadb.PersistentClient(path=session_path)
+    moved = 0
+    for collection in client.list_collections():
+        # Older chromadb versions return Collection objects, newer ones return names
+        name = getattr(collection, "name", collection)
+        source = client.get_collection(name)
+        total = source.count()
+        for offset in range(0, total, BATCH_SIZE):
+            data = source.get(include=["embeddings", "documents", "metadatas"], limit=BATCH_SIZE, offset=offset)
+            if not data["ids"]:
+                break
+            metadatas = []
+            for m in data["metadatas"]:
+                m = dict(m or {})
+                m["user_id"] = user_id
+                m["session_id"] = session_key
+                metadatas.append(m)
+            target.upsert(
+                ids=[f"{session_key}:{i}" for i in data["ids"]],
+                embeddings=data["embeddings"],
+                documents=data["documents"],
+                metadatas=metadatas,
+            )
+            moved += len(data["ids"])
+    return moved
+
+
+def main():
+    delete = "--delete" in sys.argv
+    if config.VECTOR_STORE_LAYOUT not in ("user", "global"):
+        print("❌ Set VECTOR_STORE_LAYOUT=user or VECTOR_STORE_LAYOUT=global first")
+        sys.exit(1)
+    if not os.path.exists(CHROMA_BASE_DIR):
+        print("No chroma_db directory found")
+        return
+
+    embeddings = get_embeddings()
+    migrated_sessions = 0
+    migrated_chunks = 0
+    for user_dir in os.listdir(CHROMA_BASE_DIR):
+        user_path = os.path.join(CHROMA_BASE_DIR, user_dir)
+        if not user_dir.startswith("user_") or not os.path.isdir(user_path):
+            continue
+        user_id = user_dir[len("user_"):]
+        shared_dir = get_shared_chroma_dir(user_id)
+        os.makedirs(shared_dir, exist_ok=True)
+        target = open_shared_chroma(shared_dir, embeddings)._collection
+
+        for session_dir in os.listdir(user_path):
+            session_path = os.path.join(user_path, session_dir)
+            if not session_dir.startswith("sid_") or not os.path.isfile(os.path.join(session_path, "chroma.sqlite3")):
+                continue
+            session_key = session_dir[len("sid_"):]
+            try:
+                moved = migrate_session_dir(session_path, user_id, session_key, target)
+            except Exception as e:
+                print(f"❌ Failed to migrate {session_path}: {e}")
+                continue
+            migrated_sessions += 1
+            migrated_chunks += moved
+            print(f"✅ {session_path}: {moved} chunks")
+            if delete:
+                # Only the Chroma files; sidecar data stays in the session directory
+                os.remove(os.path.join(session_path, "chroma.sqlite3"))
+                for entry in os.listdir(session_path):
+                    entry_path = os.path.join(session_path, entry)
+                    if os.path.isdir(entry_path) and len(entry) == 36:  # HNSW segment directories are UUIDs
+                        shutil.rmtree(entry_path, ignore_errors=True)
+
+    print("\n🎉 Migration complete!")
+    print(f"📊 Sessions migrated: {migrated_sessions}")
+    print(f"📦 Chunks migrated: {migrated_chunks}")
+
+
+if __name__ == "__main__":
+    print("🚀 ChromaDB Consolidation Tool")
+    print("=" * 50)
+    main()